@@ -14,6 +14,7 @@ import os
 import json
 import getpass
 import logging
+import tempfile
 
 # Set application logging level
 logging.basicConfig(level=logging.INFO)
@@ -80,11 +81,13 @@ MIDDLEWARE = [
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
     "hydroshare_util.middleware.AuthMiddleware",
     # 'debug_toolbar.middleware.DebugToolbarMiddleware',
-    "django_cprofile_middleware.middleware.ProfilerMiddleware",
+    # 'django_cprofile_middleware.middleware.ProfilerMiddleware',
     "accounts.user_middleware.UserMiddleware",
 ]
 
-DJANGO_CPROFILE_MIDDLEWARE_REQUIRE_STAFF = False
+# only relevant if the profiler middleware above is re-enabled for local debugging;
+# ingestion timings are available from /api/metrics/ instead
+DJANGO_CPROFILE_MIDDLEWARE_REQUIRE_STAFF = True
 
 REST_FRAMEWORK = {
     "DEFAULT_RENDERER_CLASSES": (
@@ -198,6 +201,85 @@ HYDROSHARE_UTIL_CONFIG = {
 # This data period is measured in days
 SENSOR_DATA_PERIOD = data["sensor_data_period"] if "sensor_data_period" in data else "2"
 
+# Data-stream lookup caches: seconds an entry stays valid, and max entries per cache
+DATA_STREAM_CACHE_TTL = int(data.get("data_stream_cache_ttl", 300))
+DATA_STREAM_CACHE_SIZE = int(data.get("data_stream_cache_size", 10000))
+
+# Write-behind spool for data-stream posts: when a path is set, posts are queued in this
+# SQLite file and answered with 202, and `manage.py flush_data_stream_spool` writes them.
+DATA_STREAM_SPOOL_PATH = data.get("data_stream_spool_path", None)
+# seconds a flusher may hold a claimed segment before another flusher replays it
+DATA_STREAM_SPOOL_LEASE = int(data.get("data_stream_spool_lease", 300))
+
+# result value batches larger than this are COPY'd through a temp table instead of
+# a single multi-row INSERT
+RESULT_VALUES_COPY_THRESHOLD = int(data.get("result_values_copy_threshold", 1000))
+# rows of an uploaded data file parsed and written per chunk
+UPLOAD_CHUNK_ROWS = int(data.get("upload_chunk_rows", 10000))
+# seconds SensorMeasurement/results summary updates of data-stream posts are collected
+# in-process before being applied together; 0 applies them within each post
+RESULT_SUMMARY_WINDOW = float(data.get("result_summary_window", 0))
+
+# Data-stream rate limiting: posts per minute and burst size per registration token
+# (a rate of 0 disables it), and an optional Django cache alias to share the buckets
+# between worker processes
+DATA_STREAM_THROTTLE_RATE = float(data.get("data_stream_throttle_rate", 30))
+DATA_STREAM_THROTTLE_BURST = int(data.get("data_stream_throttle_burst", 60))
+DATA_STREAM_THROTTLE_CACHE = data.get("data_stream_throttle_cache", None)
+# data-stream posts allowed to use the database at once (the pool holds 10 connections),
+# and seconds a post waits for a slot before it is shed with 503
+DATA_STREAM_MAX_CONCURRENT = int(data.get("data_stream_max_concurrent", 8))
+DATA_STREAM_CONCURRENCY_TIMEOUT = float(data.get("data_stream_concurrency_timeout", 1.0))
+
+# seconds the status of an accepted data-stream post is remembered, so a resent copy of
+# it (same Idempotency-Key header, or same content) is answered without writing it again
+DATA_STREAM_IDEMPOTENCY_WINDOW = int(data.get("data_stream_idempotency_window", 600))
+DATA_STREAM_IDEMPOTENCY_SIZE = int(data.get("data_stream_idempotency_size", 10000))
+
+# Background processing of uploaded data files: where jobs and their files are stored
+# (outside BASE_DIR, which deployments replace; the system temp directory by default),
+# "thread" to process them in a pool of UPLOAD_JOB_THREADS in the web process or
+# "command" to leave them to `manage.py process_upload_jobs`, and seconds without
+# progress after which a running job is considered abandoned and taken over
+UPLOAD_JOB_DIR = data.get(
+    "upload_job_dir", os.path.join(tempfile.gettempdir(), "websdl-upload-jobs")
+)
+UPLOAD_JOB_WORKER = data.get("upload_job_worker", "thread")
+UPLOAD_JOB_THREADS = int(data.get("upload_job_threads", 2))
+UPLOAD_JOB_STALE_SECONDS = int(data.get("upload_job_stale_seconds", 600))
+# seconds a chunked upload can go without a new chunk before process_upload_jobs removes it
+UPLOAD_JOB_ABANDONED_SECONDS = int(data.get("upload_job_abandoned_seconds", 7 * 24 * 3600))
+# seconds the status of a finished upload job is kept before process_upload_jobs removes it
+UPLOAD_JOB_RETENTION_SECONDS = int(data.get("upload_job_retention_seconds", 7 * 24 * 3600))
+# connections an upload writes its results over at once, shared by all uploads of a
+# process; keep UPLOAD_JOB_THREADS + this well below the pool's 10 connections
+UPLOAD_WRITE_PARALLELISM = int(data.get("upload_write_parallelism", 1))
+
+# database connections of the pool downloads stream from, apart from the one of
+# data-stream posts and uploads (keep it above SITE_BUNDLE_THREADS), and seconds a
+# download waits for one when they are all in use
+EXPORT_DB_POOL_SIZE = int(data.get("export_db_pool_size", 5))
+EXPORT_DB_POOL_TIMEOUT = float(data.get("export_db_pool_timeout", 30))
+
+# rows a CSV download fetches from its server-side cursor at a time
+CSV_EXPORT_FETCH_ROWS = int(data.get("csv_export_fetch_rows", 10000))
+
+# rows per Parquet row group / Arrow record batch of a download (needs pyarrow)
+COLUMNAR_EXPORT_ROW_GROUP_ROWS = int(data.get("columnar_export_row_group_rows", 65536))
+
+# directory of the per-result cache full-history downloads are assembled from, unset
+# to read them from the database every time; see `refresh_export_cache`
+EXPORT_CACHE_DIR = data.get("export_cache_dir", None)
+
+# threads per web process generating the files of site bundle downloads
+SITE_BUNDLE_THREADS = int(data.get("site_bundle_threads", 4))
+
+# ingestion requests slower than this many milliseconds are logged with their stage
+# timings (see /api/metrics/); unset to disable
+SLOW_REQUEST_THRESHOLD = data.get("slow_request_threshold", None)
+if SLOW_REQUEST_THRESHOLD is not None:
+    SLOW_REQUEST_THRESHOLD = float(SLOW_REQUEST_THRESHOLD)
+
 # crontab job settings
 CRONTAB_USER = data.get("crontab_user", getpass.getuser())
 CRONTAB_LOGFILE_PATH = data.get("crontab_log_file", "/var/log/odm2websdl-cron.log")
@@ -7,6 +7,7 @@ from django.dispatch.dispatcher import receiver
 from dataloader.models import SamplingFeature, Site, Annotation, SamplingFeatureAnnotation, SpatialReference, Action, \
     Method, Result, ProcessingLevel, TimeSeriesResult, Unit, Affiliation, ActionType, FeatureAction
 from dataloaderinterface.models import SiteRegistration, SiteSensor
+from dataloaderservices.cache import registration_cache, result_uuid_cache
 
 import accounts
 
@@ -23,8 +24,23 @@ def handle_site_registration_pre_save(sender, instance, update_fields=None, **kw
         )
         instance.sampling_feature_id = sampling_feature.sampling_feature_id
 
+
+def invalidate_site_registration_cache(registration):
+    registration_cache.invalidate(str(registration.registration_token))
+    result_uuid_cache.invalidate(registration.sampling_feature_id)
+
+
+def invalidate_site_sensor_cache(sensor):
+    sampling_feature_id = SiteRegistration.objects.filter(pk=sensor.registration_id)\
+        .values_list('sampling_feature_id', flat=True).first()
+    # if the registration is gone too, its own post_delete receiver handles it
+    if sampling_feature_id is not None:
+        result_uuid_cache.invalidate(sampling_feature_id)
+
+
 @receiver(post_save, sender=SiteRegistration)
 def handle_site_registration_post_save(sender, instance, created, update_fields=None, **kwargs):
+    invalidate_site_registration_cache(instance)
     sampling_feature = instance.sampling_feature
 
     if created:
@@ -89,6 +105,7 @@ def handle_site_registration_post_save(sender, instance, created, update_fields=
 
 @receiver(post_delete, sender=SiteRegistration)
 def handle_site_registration_post_delete(sender, instance, **kwargs):
+    invalidate_site_registration_cache(instance)
     sampling_feature = instance.sampling_feature
     if not sampling_feature:
         return
@@ -124,6 +141,7 @@ def handle_sensor_pre_save(sender, instance, update_fields=None, **kwargs):
 
 @receiver(post_save, sender=SiteSensor)
 def handle_sensor_post_save(sender, instance, created, update_fields=None, **kwargs):
+    invalidate_site_sensor_cache(instance)
     result_queryset = Result.objects.filter(result_id=instance.result_id)
 
     if created:
@@ -155,6 +173,7 @@ def handle_sensor_post_save(sender, instance, created, update_fields=None, **kwa
 
 @receiver(post_delete, sender=SiteSensor)
 def handle_sensor_post_delete(sender, instance, **kwargs):
+    invalidate_site_sensor_cache(instance)
     result = instance.result
     result and result.feature_action.action.delete()
 
@@ -362,6 +362,29 @@ $(document).ready(function () {
         $("#btn-upload-file").prop("disabled", false);
     });
 
+    // Files above this size are uploaded in resumable chunks
+    var RESUMABLE_UPLOAD_THRESHOLD = 16 * 1024 * 1024;
+    var RESUMABLE_UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024;
+    var RESUMABLE_UPLOAD_RETRIES = 10;
+    // Whole files up to this size are hashed before the upload, so the server can check the assembled file
+    var RESUMABLE_UPLOAD_HASH_MAX_SIZE = 256 * 1024 * 1024;
+
+    // Hex SHA-256 of a blob, or null where Web Crypto isn't available (e.g. pages not served over https)
+    function sha256Hex(blob) {
+        if (!window.crypto || !window.crypto.subtle || !blob.arrayBuffer) {
+            return Promise.resolve(null);
+        }
+        return blob.arrayBuffer().then(function (buffer) {
+            return window.crypto.subtle.digest("SHA-256", buffer);
+        }).then(function (digest) {
+            return Array.prototype.map.call(new Uint8Array(digest), function (byte) {
+                return ("0" + byte.toString(16)).slice(-2);
+            }).join("");
+        }).catch(function () {
+            return null;
+        });
+    }
+
     $("#btn-upload-file").click(function () {
         var form = $("#form-file-upload"),
             formData = new FormData(),
@@ -382,6 +405,11 @@ $(document).ready(function () {
         uploadFileButton.prop("disabled", true);
         uploadFileButton.find("span").text("Uploading...");
 
+        if (file.size > RESUMABLE_UPLOAD_THRESHOLD) {
+            resumableUpload();
+            return;
+        }
+
         $.ajax({
             url: url,
             type: "POST",
@@ -390,11 +418,86 @@ $(document).ready(function () {
             cache: false,
             contentType: false,
             processData: false
-        }).done(function (response) {
-            // console.log(response);
-            snackbarMsg("Data was uploaded successfully!");
-            uploadFileButton.prop("disabled", false);
-        }).fail(function (error) {
+        }).done(uploadDone).fail(uploadFailed);
+
+        // Large files are sent in chunks, resuming where the server left off after a failure
+        function resumableUpload() {
+            var csrfToken = form.find('input[name="csrfmiddlewaretoken"]').val();
+            var retries = 0;
+
+            var fileHash = file.size <= RESUMABLE_UPLOAD_HASH_MAX_SIZE ? sha256Hex(file) : Promise.resolve(null);
+            fileHash.then(function (checksum) {
+                var params = {
+                    csrfmiddlewaretoken: csrfToken,
+                    file_name: file.name,
+                    size: file.size
+                };
+                if (checksum) {
+                    params.sha256 = checksum;
+                }
+                $.post(form.data("resumable-url"), params).done(function (upload) {
+                    sendChunk(upload, 0);
+                }).fail(uploadFailed);
+            });
+
+            function sendChunk(upload, offset) {
+                if (offset >= file.size) {
+                    $.ajax({
+                        url: upload.finalize_url,
+                        type: "POST",
+                        headers: {"X-CSRFToken": csrfToken}
+                    }).done(uploadDone).fail(uploadFailed);
+                    return;
+                }
+
+                uploadFileButton.find("span").text("Uploading... " + Math.floor(offset * 100 / file.size) + "%");
+                var piece = file.slice(offset, offset + RESUMABLE_UPLOAD_CHUNK_SIZE);
+                sha256Hex(piece).then(function (checksum) {
+                    var headers = {"X-CSRFToken": csrfToken};
+                    if (checksum) {
+                        // The server drops a piece corrupted on the way, and it's sent again
+                        headers["Content-SHA256"] = checksum;
+                    }
+                    $.ajax({
+                        url: upload.upload_url + "?offset=" + offset,
+                        type: "PUT",
+                        data: piece,
+                        headers: headers,
+                        contentType: "application/octet-stream",
+                        processData: false
+                    }).done(function (response) {
+                        retries = 0;
+                        sendChunk(upload, response.offset);
+                    }).fail(function (error) {
+                        if (retries++ >= RESUMABLE_UPLOAD_RETRIES) {
+                            uploadFailed(error);
+                            return;
+                        }
+                        // A piece sent at the wrong offset is answered with where to resume
+                        if (error.status === 409 && error.responseJSON && error.responseJSON.offset !== undefined) {
+                            sendChunk(upload, error.responseJSON.offset);
+                            return;
+                        }
+                        // The response may be lost even if the chunk arrived; ask where to resume
+                        setTimeout(function () {
+                            $.get(upload.status_url).done(function (job) {
+                                sendChunk(upload, job.received);
+                            }).fail(function () {
+                                sendChunk(upload, offset);
+                            });
+                        }, 5000);
+                    });
+                });
+            }
+        }
+
+        function uploadDone(response) {
+            // The file is processed in the background; poll the job until it's over
+            uploadFileButton.find("span").text("Processing...");
+            pollUploadJob(response.status_url);
+        }
+
+        function uploadFailed(error) {
             console.log(error);
             try {
                 snackbarMsg("Failed to upload data. " + error.responseJSON.error, true)
@@ -404,10 +507,38 @@ $(document).ready(function () {
             }
 
             uploadFileButton.prop("disabled", true);
-            $("#id_data_file").val(null);
-        }).always(function () {
-            // Restore state
             uploadFileButton.find("span").text("Upload");
-        });
+            $("#id_data_file").val(null);
+        }
+
+        function pollUploadJob(statusUrl) {
+            $.get(statusUrl).done(function (job) {
+                if (job.status === "queued" || job.status === "running") {
+                    uploadFileButton.find("span").text("Processing... " + job.rows_parsed + " rows");
+                    setTimeout(function () { pollUploadJob(statusUrl); }, 2000);
+                    return;
+                }
+
+                if (job.status === "done") {
+                    var message = "Data was uploaded successfully! " + job.rows_inserted + " new values";
+                    if (job.rows_duplicate) {
+                        message += ", " + job.rows_duplicate + " already present";
+                    }
+                    if (job.warning_count) {
+                        message += ", " + job.warning_count + " rows skipped";
+                    }
+                    snackbarMsg(message + ".");
+                    uploadFileButton.prop("disabled", false);
+                }
+                else {
+                    snackbarMsg("Failed to upload data. " + job.error, true);
+                    uploadFileButton.prop("disabled", true);
+                    $("#id_data_file").val(null);
+                }
+                uploadFileButton.find("span").text("Upload");
+            }).fail(function () {
+                setTimeout(function () { pollUploadJob(statusUrl); }, 5000);
+            });
+        }
     });
 });
\ No newline at end of file
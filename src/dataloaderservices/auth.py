@@ -1,3 +1,5 @@
+from typing import Any, Dict, Iterable, Union
+
 from rest_framework import authentication
 from rest_framework import exceptions
 
@@ -5,6 +7,50 @@ from django.db.models.expressions import Subquery, OuterRef
 
 from dataloader.models import SamplingFeature
 from dataloaderinterface.models import SiteRegistration
+from dataloaderservices.cache import registration_cache
+from dataloaderservices.payloads import DataStreamPayload
+
+
+def get_registrations(tokens: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+    """Looks up the sampling feature id and uuid registered to each token.
+
+    Cached tokens are served from `registration_cache`, the rest are fetched in a single query.
+    Tokens that do not match a site registration are absent from the returned dict.
+    """
+    found = {}
+    missing = []
+    for token in tokens:
+        registration = registration_cache.get(token)
+        if registration:
+            found[token] = registration
+        else:
+            missing.append(token)
+    if not missing:
+        return found
+
+    registrations = SiteRegistration.objects.filter(registration_token__in=missing
+        ).annotate(sampling_feature_uuid=Subquery(
+            SamplingFeature.objects.filter(
+                pk=OuterRef("sampling_feature_id")
+            ).values("sampling_feature_uuid")[:1])
+        ).values("registration_token", "sampling_feature_id", "sampling_feature_uuid")
+    for registration in registrations:
+        registration_cache.set(registration["registration_token"], registration)
+        found[registration["registration_token"]] = registration
+    return found
+
+
+def get_registration(token: str) -> Union[Dict[str, Any], None]:
+    return get_registrations([token]).get(token)
+
+
+def verify_registration(registration: Union[Dict[str, Any], None], sampling_feature: str) -> None:
+    if not registration:
+        raise exceptions.PermissionDenied('Invalid Security Token')
+
+    # request needs to have the sampling feature uuid of the registration -
+    if str(registration["sampling_feature_uuid"]) != sampling_feature:
+        raise exceptions.AuthenticationFailed('Site Identifier is not associated with this Token')
 
 
 class UUIDAuthentication(authentication.BaseAuthentication):
@@ -12,9 +58,16 @@ class UUIDAuthentication(authentication.BaseAuthentication):
         if request.META['REQUEST_METHOD'] != 'POST':
             return None
 
+        if isinstance(request.data, DataStreamPayload):
+            sampling_feature = request.data.sampling_feature  # parsed from a columnar body
+        elif 'sampling_feature' in request.data:
+            sampling_feature = request.data['sampling_feature']
+        else:
+            sampling_feature = None
+
         if 'HTTP_TOKEN' not in request.META:
             raise exceptions.ParseError("Registration Token not present in the request.")
-        elif 'sampling_feature' not in request.data:
+        elif sampling_feature is None:
             raise exceptions.ParseError("Sampling feature UUID not present in the request.")
 
         # Get auth_token(uuid) from header,
@@ -23,17 +76,7 @@ class UUIDAuthentication(authentication.BaseAuthentication):
         # verify sampling_feature uuid is registered by this user,
         # be happy.
         token = request.META['HTTP_TOKEN']
-        registration = SiteRegistration.objects.filter(registration_token=token
-            ).annotate(sampling_feature_uuid=Subquery(
-                SamplingFeature.objects.filter(
-                    pk=OuterRef("sampling_feature_id")
-                ).values("sampling_feature_uuid")[:1])
-            ).values("sampling_feature_uuid").first()
-        if not registration:
-            raise exceptions.PermissionDenied('Invalid Security Token')
-
-        # request needs to have the sampling feature uuid of the registration -
-        if str(registration["sampling_feature_uuid"]) != request.data['sampling_feature']:
-            raise exceptions.AuthenticationFailed('Site Identifier is not associated with this Token')
+        registration = get_registration(token)
+        verify_registration(registration, sampling_feature)
 
         return None
@@ -0,0 +1,116 @@
+"""
+Zip bundles streamed while their members are still being generated.
+
+`stream_zip` takes futures that each produce one member (its name in the zip and a
+spooled temporary file with its content), typically submitted to a thread pool, and
+copies every member into the zip as soon as its future completes: the download
+starts with the first finished member and the slowest one only delays the end.
+The zip is written to an unseekable sink (sizes go in data descriptors after each
+member), so besides the member being copied nothing is held in memory, and members
+larger than `SPOOL_MAX_BYTES` wait on disk. A member that fails is logged and its
+description listed in an `errors.txt` at the end of the zip, as the response has
+started; the error itself stays in the log since the bundle is public.
+"""
+import logging
+import tempfile
+import zipfile
+from concurrent.futures import Future, as_completed
+from typing import IO, Dict, Iterable, Iterator, NamedTuple, Union
+
+logger = logging.getLogger(__name__)
+
+SPOOL_MAX_BYTES = 8 * 2 ** 20
+COPY_CHUNK_BYTES = 2 ** 20
+
+
+class BundleMember(NamedTuple):
+    name: str
+    content: IO[bytes]
+
+
+class _ZipSink:
+    """Write-only file without tell, so zipfile writes a streamable zip into it."""
+
+    def __init__(self) -> None:
+        self.chunks = []
+
+    def write(self, data) -> int:
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def spooled_member(name: str, chunks: Iterable[Union[str, bytes]]) -> BundleMember:
+    """A member whose content is written from text or bytes chunks, e.g. a streamed export."""
+    content = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES)
+    for chunk in chunks:
+        content.write(chunk.encode("utf8") if isinstance(chunk, str) else chunk)
+    content.seek(0)
+    return BundleMember(name, content)
+
+
+def _unique_name(name: str, names: set) -> str:
+    stem, dot, extension = name.rpartition(".")
+    if not dot:
+        stem, extension = name, ""
+    unique, counter = name, 1
+    while unique in names:
+        counter += 1
+        unique = "{}-{}{}{}".format(stem, counter, dot, extension)
+    names.add(unique)
+    return unique
+
+
+def stream_zip(futures: Dict[Future, str]) -> Iterator[bytes]:
+    """
+    The zip of the members the futures produce, in the order they complete; a future
+    may produce None when it has nothing to add. `futures` maps each future to a
+    description of its member, listed in errors.txt if it fails.
+    """
+    sink = _ZipSink()
+    names = set()
+    errors = []
+    try:
+        with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_DEFLATED) as bundle:
+            for future in as_completed(futures):
+                try:
+                    member = future.result()
+                except Exception:
+                    logger.exception("Bundle member failed: %s", futures[future])
+                    errors.append(futures[future])
+                    continue
+                if member is None:
+                    continue
+                name = _unique_name(member.name, names)
+                with member.content, bundle.open(name, "w", force_zip64=True) as entry:
+                    while True:
+                        chunk = member.content.read(COPY_CHUNK_BYTES)
+                        if not chunk:
+                            break
+                        entry.write(chunk)
+                        data = sink.drain()
+                        if data:
+                            yield data
+                yield sink.drain()
+            if errors:
+                bundle.writestr(
+                    "errors.txt",
+                    "These files could not be generated:\n{}\n".format("\n".join(errors)),
+                )
+        yield sink.drain()
+    finally:
+        # when the client goes away: skip the members not started, drop the finished ones
+        for future in futures:
+            future.cancel()
+        for future in futures:
+            if future.done() and not future.cancelled() and future.exception() is None:
+                member = future.result()
+                if member is not None:
+                    member.content.close()
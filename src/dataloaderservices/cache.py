@@ -0,0 +1,85 @@
+"""
+Process-level caches for lookups on the data-stream hot path.
+
+Registration tokens, the result UUIDs of a site and the "hour minute" unit id
+change rarely, but are looked up on every data-stream POST. Entries are evicted
+after a TTL and when the cache is full, and are invalidated by the SiteRegistration
+and SiteSensor signal receivers in `dataloaderinterface.signals`. Those receivers
+only run in the process that saved the object, so the TTL bounds how long other
+worker processes can serve a stale entry.
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable
+
+from django.conf import settings
+
+_MISSING = object()
+
+
+class TTLCache:
+    """Thread-safe LRU mapping whose entries expire `ttl` seconds after being set."""
+
+    def __init__(self, name: str, maxsize: int, ttl: float) -> None:
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._entries.get(key, _MISSING)
+            if entry is not _MISSING and entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not _MISSING:
+                del self._entries[key]
+            self.misses += 1
+            return default
+
+    def set(self, key: Hashable, value: Any) -> None:
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key: Hashable) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+_ttl = getattr(settings, "DATA_STREAM_CACHE_TTL", 300)
+_maxsize = getattr(settings, "DATA_STREAM_CACHE_SIZE", 10000)
+
+# registration token -> {"registration_token", "sampling_feature_id", "sampling_feature_uuid"}
+registration_cache = TTLCache("registrations", _maxsize, _ttl)
+# sampling_feature_id -> {result_uuid: result_id}
+result_uuid_cache = TTLCache("result_uuids", _maxsize, _ttl)
+# unit_name -> unit_id
+unit_cache = TTLCache("units", 100, _ttl)
+
+CACHES = (registration_cache, result_uuid_cache, unit_cache)
+
+
+def get_cache_stats() -> Dict[str, Dict[str, Any]]:
+    return {cache.name: cache.stats() for cache in CACHES}
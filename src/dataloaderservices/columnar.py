@@ -0,0 +1,128 @@
+"""
+Parquet and Arrow IPC writers for time series exports.
+
+Both take the typed wide rows of `export.iter_data_rows` and write them in batches
+of `ROW_GROUP_ROWS`, each batch going out as soon as it is written (a Parquet row
+group, an Arrow record batch), so a download never holds more than one batch.
+Columns are typed: the UTC and local datetimes as timestamps, the UTC offset as an
+integer and one float column per result, with nulls where a result has no value.
+The metadata header of the CSV download is stored in the file-level key/value
+metadata under `odm2_metadata`.
+
+They need the optional `pyarrow` package; `available` tells whether it is installed.
+"""
+from typing import Iterable, Iterator, List
+
+from django.conf import settings
+
+from dataloaderservices.metadata import MetadataRecords
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # optional, only needed for Parquet and Arrow downloads
+    pa = pq = None
+
+available = pa is not None
+
+ROW_GROUP_ROWS = getattr(settings, "COLUMNAR_EXPORT_ROW_GROUP_ROWS", 65536)
+
+
+class _ChunkSink:
+    """Write-only file collecting what pyarrow writes, to be sent on in chunks."""
+
+    def __init__(self) -> None:
+        self.chunks = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self.chunks.append(data)
+        self.position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self.position
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        self.closed = True
+
+    def drain(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def export_schema(metadata: str, headers: List[str]) -> "pa.Schema":
+    datetime_utc, utc_offset, datetime_local, *value_columns = headers
+    return pa.schema(
+        [
+            pa.field(datetime_utc, pa.timestamp("us"), nullable=False),
+            pa.field(utc_offset, pa.int16(), nullable=False),
+            pa.field(datetime_local, pa.timestamp("us"), nullable=False),
+        ]
+        + [pa.field(column, pa.float64()) for column in value_columns],
+        metadata={"odm2_metadata": metadata},
+    )
+
+
+def record_batches(schema: "pa.Schema", rows: Iterable[list]) -> Iterator["pa.RecordBatch"]:
+    columns = [[] for _ in schema]
+    for row in rows:
+        for column, value in zip(columns, row):
+            column.append(value)
+        if len(columns[0]) >= ROW_GROUP_ROWS:
+            yield _record_batch(schema, columns)
+            columns = [[] for _ in schema]
+    if columns[0]:
+        yield _record_batch(schema, columns)
+
+
+def _record_batch(schema: "pa.Schema", columns: List[list]) -> "pa.RecordBatch":
+    # from_pandas turns the merge's nan placeholders into nulls
+    return pa.RecordBatch.from_arrays(
+        [
+            pa.array(column, type=field.type, from_pandas=True)
+            for field, column in zip(schema, columns)
+        ],
+        schema=schema,
+    )
+
+
+def stream_parquet(
+    metadata: str,
+    headers: List[str],
+    rows: Iterable[list],
+    records: MetadataRecords = None,
+    aggregation=None,
+) -> Iterator[bytes]:
+    schema = export_schema(metadata, headers)
+    sink = _ChunkSink()
+    with pq.ParquetWriter(sink, schema, compression="snappy") as writer:
+        for batch in record_batches(schema, rows):
+            writer.write_batch(batch, row_group_size=ROW_GROUP_ROWS)
+            yield sink.drain()
+    # the footer, written on close
+    yield sink.drain()
+
+
+def stream_arrow(
+    metadata: str,
+    headers: List[str],
+    rows: Iterable[list],
+    records: MetadataRecords = None,
+    aggregation=None,
+) -> Iterator[bytes]:
+    """The Arrow IPC streaming format, readable with `pyarrow.ipc.open_stream`."""
+    schema = export_schema(metadata, headers)
+    sink = _ChunkSink()
+    with pa.ipc.new_stream(sink, schema) as writer:
+        yield sink.drain()
+        for batch in record_batches(schema, rows):
+            writer.write_batch(batch)
+            yield sink.drain()
+    yield sink.drain()
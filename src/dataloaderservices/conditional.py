@@ -0,0 +1,85 @@
+"""
+Validators for conditional GETs of time series downloads.
+
+The values of a download only change when values are added to one of its results,
+which every ingestion path (data-stream posts, batches, spooled posts and file
+uploads) records in `odm2.results` as a higher `valuecount` and, for new latest
+values, a later `resultdatetime` (see `dataloaderservices.summary`). A path that
+writes values without those summaries would let clients keep a stale download.
+`export_validators` hashes those of the requested results together with the query
+parameters (window, format, aggregation) into an ETag, with one small query, so
+`CSVDataApi` can answer `If-None-Match` with a 304 before reading any value.
+
+The ETag is weak, as the metadata header can change (e.g. site notes) while the
+values don't. `Last-Modified` is the latest `resultdatetime`, which doesn't move
+when older values are backfilled, so clients should prefer the ETag; Django's
+precondition handling ignores `If-Modified-Since` when `If-None-Match` is sent.
+"""
+import calendar
+import hashlib
+import time
+from typing import List, Optional, Tuple
+
+from django.http import HttpResponse, QueryDict
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+
+from dataloader.models import Result
+
+# part of every ETag, bump it when the layout of downloads changes
+VALIDATOR_VERSION = "1"
+
+
+def export_validators(
+    result_ids: List[int], query_params: QueryDict
+) -> Tuple[Optional[str], Optional[int]]:
+    """The ETag and Last-Modified timestamp of a download, None when no result exists."""
+    summaries = list(
+        Result.objects.filter(result_id__in=result_ids)
+        .order_by("result_id")
+        .values_list("result_id", "result_datetime", "value_count")
+    )
+    if not summaries:
+        return None, None
+
+    digest = hashlib.sha1(VALIDATOR_VERSION.encode())
+    digest.update(repr(summaries).encode())
+    digest.update(repr(sorted(query_params.lists())).encode())
+    etag = 'W/"{}"'.format(digest.hexdigest())
+
+    result_datetimes = [
+        result_datetime for _, result_datetime, _ in summaries if result_datetime
+    ]
+    last_modified = None
+    if result_datetimes:
+        # resultdatetime is the UTC datetime of the latest value, which a logger with a
+        # wrong clock can put in the future
+        last_modified = min(
+            calendar.timegm(max(result_datetimes).utctimetuple()), int(time.time())
+        )
+    return etag, last_modified
+
+
+def set_validator_headers(
+    response: HttpResponse, etag: Optional[str], last_modified: Optional[int]
+) -> HttpResponse:
+    if etag:
+        response["ETag"] = etag
+    if last_modified is not None:
+        response["Last-Modified"] = http_date(last_modified)
+    return response
+
+
+def conditional_response(
+    request, etag: Optional[str], last_modified: Optional[int]
+) -> Optional[HttpResponse]:
+    """
+    A 304 (or 412) response when the request's preconditions are not met by the
+    validators, None when the download should be sent.
+    """
+    # the 304 copies the validators from the response it is given
+    headers = set_validator_headers(HttpResponse(), etag, last_modified)
+    response = get_conditional_response(
+        request, etag=etag, last_modified=last_modified, response=headers
+    )
+    return None if response is headers else response
@@ -0,0 +1,127 @@
+"""
+Pre-filter for file uploads that mostly repeat data already in the database.
+
+Loggers' SD cards are usually uploaded whole, again and again, so most rows of an
+upload already exist and would only be dropped by the writer's ON CONFLICT after
+being shipped to the database. Before the first chunk, `ResultCoverage.load` reads
+each result's existing datetime coverage: its first and last value and the gaps
+longer than `COVERAGE_GAP` in between. Rows of a chunk falling outside that coverage
+are new for sure; for the others, `drop_existing_values` looks up the values that
+exist within the chunk's covered time window and drops exact matches, so a new row
+inside a covered range (e.g. the logger's interval changed) is never lost.
+"""
+from datetime import timedelta
+from typing import Dict, Iterable, Tuple
+
+import numpy as np
+import pandas as pd
+from sqlalchemy.sql import text
+
+from dataloaderservices.writer import WriteResult
+
+# spacing between two existing values above which the time between them counts as
+# not covered; logger intervals are minutes, so this only finds real outages
+COVERAGE_GAP = timedelta(days=1)
+
+
+class ResultCoverage:
+    """Datetime intervals holding values of each result, as (starts, ends) arrays."""
+
+    def __init__(self, intervals: Dict[int, Tuple[np.ndarray, np.ndarray]]) -> None:
+        self.intervals = intervals
+
+    @classmethod
+    def load(cls, connection, result_ids: Iterable[int]) -> "ResultCoverage":
+        result_ids = sorted(set(int(result_id) for result_id in result_ids))
+        if not result_ids:
+            return cls({})
+
+        bounds = connection.execute(
+            text(
+                "SELECT resultid, min(valuedatetime), max(valuedatetime) "
+                "FROM odm2.timeseriesresultvalues "
+                "WHERE resultid = ANY(:result_ids) GROUP BY resultid;"
+            ),
+            {"result_ids": result_ids},
+        ).fetchall()
+        gaps = {}  # result_id -> [(last value before, first value after)]
+        for result_id, before, after in connection.execute(
+            text(
+                "SELECT resultid, previous, valuedatetime FROM ("
+                "SELECT resultid, valuedatetime, lag(valuedatetime) OVER "
+                "(PARTITION BY resultid ORDER BY valuedatetime) AS previous "
+                "FROM odm2.timeseriesresultvalues WHERE resultid = ANY(:result_ids)"
+                ") AS steps WHERE valuedatetime - previous > :gap "
+                "ORDER BY resultid, valuedatetime;"
+            ),
+            {"result_ids": result_ids, "gap": COVERAGE_GAP},
+        ):
+            gaps.setdefault(result_id, []).append((before, after))
+
+        intervals = {}
+        for result_id, first, last in bounds:
+            result_gaps = gaps.get(result_id, [])
+            starts = [first] + [after for _, after in result_gaps]
+            ends = [before for before, _ in result_gaps] + [last]
+            intervals[result_id] = (
+                np.array(starts, dtype="datetime64[ns]"),
+                np.array(ends, dtype="datetime64[ns]"),
+            )
+        return cls(intervals)
+
+    def covered(self, result_ids: np.ndarray, value_datetimes: np.ndarray) -> np.ndarray:
+        """Which of the rows fall within the existing values of their result."""
+        covered = np.zeros(len(result_ids), dtype=bool)
+        for result_id in np.unique(result_ids):
+            if result_id not in self.intervals:
+                continue
+            starts, ends = self.intervals[result_id]
+            rows = np.flatnonzero(result_ids == result_id)
+            datetimes = value_datetimes[rows]
+            interval = np.searchsorted(starts, datetimes, side="right") - 1
+            inside = interval >= 0
+            inside[inside] = datetimes[inside] <= ends[interval[inside]]
+            covered[rows] = inside
+        return covered
+
+
+def drop_existing_values(
+    result_values: pd.DataFrame, connection, coverage: ResultCoverage
+) -> Tuple[pd.DataFrame, WriteResult]:
+    """
+    The rows of `result_values` that don't exist yet, and a WriteResult counting the
+    ones dropped as already present.
+    """
+    result_ids = result_values["result_id"].to_numpy()
+    value_datetimes = result_values["value_datetime"].to_numpy()
+    covered = coverage.covered(result_ids, value_datetimes)
+    if not covered.any():
+        return result_values, WriteResult()
+
+    existing = connection.execute(
+        text(
+            "SELECT resultid, valuedatetime FROM odm2.timeseriesresultvalues "
+            "WHERE resultid = ANY(:result_ids) "
+            "AND valuedatetime BETWEEN :start AND :end;"
+        ),
+        {
+            "result_ids": [int(result_id) for result_id in np.unique(result_ids[covered])],
+            "start": pd.Timestamp(value_datetimes[covered].min()).to_pydatetime(),
+            "end": pd.Timestamp(value_datetimes[covered].max()).to_pydatetime(),
+        },
+    ).fetchall()
+    if not existing:
+        return result_values, WriteResult()
+
+    existing_keys = pd.MultiIndex.from_arrays(
+        [
+            np.array([result_id for result_id, _ in existing], dtype=np.int64),
+            pd.to_datetime([value_datetime for _, value_datetime in existing]),
+        ]
+    )
+    keys = pd.MultiIndex.from_arrays([result_ids, value_datetimes])
+    present = covered & keys.isin(existing_keys)
+    present_count = int(present.sum())
+    if not present_count:
+        return result_values, WriteResult()
+    return result_values[~present], WriteResult(present_count)
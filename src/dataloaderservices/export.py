@@ -0,0 +1,268 @@
+"""
+Export of time series result values as wide CSV rows.
+
+Rows come from a k-way merge: every result gets its own server-side cursor ordered
+by `valuedatetime`, and `merge_result_values` merges them on (UTC datetime, UTC
+offset) into one row per timestamp, dropping values outside the requested local
+time window as it goes. Memory is bounded by the number of series times
+the cursors' fetch size, whatever the series lengths, and a timestamp's values are
+never aggregated, so the output is deterministic.
+
+`CSVDataApi` streams the rows with `stream_csv` as a `StreamingHttpResponse`: the
+metadata header goes out first and rows follow as they are merged. Rows are laid
+out as UTC datetime, UTC offset, local datetime, then one value per result (nan
+where a result has none). `EXPORT_FORMATS` lists the other download formats, which
+write typed rows the same way (see `dataloaderservices.columnar` and
+`dataloaderservices.netcdf`).
+"""
+import csv
+import heapq
+from datetime import datetime, timedelta
+from typing import Callable, Iterable, Iterator, List, NamedTuple, Tuple
+
+from django.conf import settings
+
+from dataloaderservices import columnar, netcdf
+from dataloaderservices.metadata import MetadataRecords
+
+FETCH_ROWS = getattr(settings, "CSV_EXPORT_FETCH_ROWS", 10000)
+STREAM_BATCH_ROWS = 1000
+# each series' cursor fetches at least this many rows at a time
+MIN_SERIES_FETCH_ROWS = 500
+
+# UTC bounds a day wider than the local window, so the index narrows the scan; the
+# exact local window is applied while merging
+_SERIES_QUERY = (
+    "SELECT valuedatetime, valuedatetimeutcoffset, datavalue "
+    "FROM odm2.timeseriesresultvalues "
+    "WHERE resultid = %(result_id)s "
+    "AND (%(min_datetime)s::timestamp IS NULL OR "
+    "valuedatetime >= %(min_datetime)s::timestamp - interval '1 day') "
+    "AND (%(max_datetime)s::timestamp IS NULL OR "
+    "valuedatetime <= %(max_datetime)s::timestamp + interval '1 day') "
+    "ORDER BY valuedatetime"
+)
+
+AGGREGATION_INTERVALS = ("hour", "day", "week")
+# statistic -> its SQL aggregate
+AGGREGATION_STATS = {
+    "mean": "avg(datavalue)",
+    "min": "min(datavalue)",
+    "max": "max(datavalue)",
+    "count": "count(datavalue)",
+}
+
+# values grouped by the local time interval they start in, labelled with the UTC
+# datetime of the interval's start so they merge like plain values; the local
+# window applies to the values themselves, and no-data values are left out
+_AGGREGATED_SERIES_QUERY = (
+    "SELECT local_interval - valuedatetimeutcoffset * interval '1 hour', "
+    "valuedatetimeutcoffset, {stats} FROM ("
+    "SELECT date_trunc(%(interval)s, "
+    "valuedatetime + valuedatetimeutcoffset * interval '1 hour') AS local_interval, "
+    "valuedatetime, valuedatetimeutcoffset, datavalue "
+    "FROM odm2.timeseriesresultvalues "
+    "WHERE resultid = %(result_id)s "
+    "AND datavalue IS DISTINCT FROM (SELECT v.nodatavalue FROM odm2.results r "
+    "JOIN odm2.variables v ON v.variableid = r.variableid "
+    "WHERE r.resultid = %(result_id)s) "
+    "AND (%(min_datetime)s::timestamp IS NULL OR "
+    "valuedatetime >= %(min_datetime)s::timestamp - interval '1 day') "
+    "AND (%(max_datetime)s::timestamp IS NULL OR "
+    "valuedatetime <= %(max_datetime)s::timestamp + interval '1 day')"
+    ") AS series_values "
+    "WHERE (%(min_datetime)s::timestamp IS NULL OR "
+    "valuedatetime + valuedatetimeutcoffset * interval '1 hour' >= %(min_datetime)s) "
+    "AND (%(max_datetime)s::timestamp IS NULL OR "
+    "valuedatetime + valuedatetimeutcoffset * interval '1 hour' <= %(max_datetime)s) "
+    "GROUP BY local_interval, valuedatetimeutcoffset "
+    "ORDER BY 1, 2"
+)
+
+# (UTC datetime, UTC offset in hours, data value)
+SeriesValue = Tuple[datetime, int, float]
+
+
+class Aggregation(NamedTuple):
+    # hour, day or week, in local time
+    interval: str
+    # names from AGGREGATION_STATS, each a value column per result in this order
+    stats: List[str]
+
+
+def _with_column(
+    values: Iterable[SeriesValue], column: int
+) -> Iterator[Tuple[datetime, int, int, float]]:
+    for value_datetime, utc_offset, data_value in values:
+        yield value_datetime, utc_offset, column, data_value
+
+
+def _with_columns(values: Iterable[tuple], column: int) -> Iterator[tuple]:
+    for value in values:
+        yield value[0], value[1], column, value[2:]
+
+
+def merge_result_values(
+    series: List[Iterable[SeriesValue]],
+    max_datetime: datetime = None,
+    min_datetime: datetime = None,
+    typed: bool = False,
+    width: int = 1,
+) -> Iterator[list]:
+    """
+    Wide rows from series each ordered by UTC datetime, with one value column per
+    series in the given order, limited to the local time window. Datetimes and
+    offsets are text, unless `typed` asks for the datetime and int values. Series
+    with several values per datetime (e.g. statistics) give `width` columns each.
+    """
+    nan = float("nan")
+    if width == 1:
+        merged = heapq.merge(
+            *(_with_column(values, index) for index, values in enumerate(series, start=3))
+        )
+    else:
+        merged = heapq.merge(
+            *(
+                _with_columns(values, 3 + index * width)
+                for index, values in enumerate(series)
+            )
+        )
+    columns = len(series) * width
+    row, key, in_window = None, None, False
+    for value_datetime, utc_offset, index, data_value in merged:
+        if (value_datetime, utc_offset) != key:
+            if row is not None:
+                yield row
+            key = (value_datetime, utc_offset)
+            local_datetime = value_datetime + timedelta(hours=utc_offset)
+            in_window = not (
+                (max_datetime and local_datetime > max_datetime)
+                or (min_datetime and local_datetime < min_datetime)
+            )
+            if not in_window:
+                row = None
+            elif typed:
+                row = [value_datetime, utc_offset, local_datetime] + [nan] * columns
+            else:
+                row = [str(value_datetime), str(utc_offset), str(local_datetime)] + [
+                    nan
+                ] * columns
+        if not in_window:
+            continue
+        if width == 1:
+            row[index] = data_value
+        else:
+            row[index : index + width] = data_value
+    if row is not None:
+        yield row
+
+
+def iter_data_rows(
+    engine,
+    result_ids: List[int],
+    max_datetime: datetime = None,
+    min_datetime: datetime = None,
+    typed: bool = False,
+    aggregation: Aggregation = None,
+) -> Iterator[list]:
+    """
+    Wide rows of the results' values within the local time window, in time order,
+    or of their statistics per local time interval when given an `aggregation`.
+    """
+    query, width = _SERIES_QUERY, 1
+    if aggregation:
+        query = _AGGREGATED_SERIES_QUERY.format(
+            stats=", ".join(AGGREGATION_STATS[stat] for stat in aggregation.stats)
+        )
+        width = len(aggregation.stats)
+    connection = engine.raw_connection()
+    try:
+        fetch_rows = max(FETCH_ROWS // max(len(result_ids), 1), MIN_SERIES_FETCH_ROWS)
+        cursors = []
+        for result_id in result_ids:
+            # named cursors keep each result set on the server and fetch it in batches
+            cursor = connection.cursor(name=f"csv_export_{result_id}")
+            cursor.itersize = fetch_rows
+            cursor.execute(
+                query,
+                {
+                    "result_id": result_id,
+                    "min_datetime": min_datetime,
+                    "max_datetime": max_datetime,
+                    "interval": aggregation.interval if aggregation else None,
+                },
+            )
+            cursors.append(cursor)
+        if aggregation:
+            # the window was applied to the values, intervals may start before it
+            yield from merge_result_values(cursors, typed=typed, width=width)
+        else:
+            yield from merge_result_values(cursors, max_datetime, min_datetime, typed)
+        for cursor in cursors:
+            cursor.close()
+    finally:
+        # also reached when the client goes away and Django closes the generator
+        connection.close()
+
+
+class _Echo:
+    """File-like object whose write returns the line, so csv.writer yields text."""
+
+    def write(self, value: str) -> str:
+        return value
+
+
+def stream_csv(
+    metadata: str,
+    headers: List[str],
+    rows: Iterable[list],
+    records: MetadataRecords = None,
+    aggregation: Aggregation = None,
+) -> Iterator[str]:
+    writer = csv.writer(_Echo())
+    yield metadata
+    yield writer.writerow(headers)
+    # rows are sent in batches rather than one tiny chunk each
+    batch = []
+    for row in rows:
+        batch.append(writer.writerow(row))
+        if len(batch) >= STREAM_BATCH_ROWS:
+            yield "".join(batch)
+            batch = []
+    if batch:
+        yield "".join(batch)
+
+
+class ExportFormat(NamedTuple):
+    content_type: str
+    extension: str
+    # (metadata, headers, rows, metadata records, aggregation) -> response content
+    write: Callable[
+        [str, List[str], Iterable[list], MetadataRecords, Aggregation], Iterator
+    ]
+    # whether the rows hold datetimes and numbers rather than text
+    typed: bool
+    # whether the packages the format needs are installed
+    available: bool
+
+
+EXPORT_FORMATS = {
+    "csv": ExportFormat("text/csv", "csv", stream_csv, False, True),
+    "parquet": ExportFormat(
+        "application/vnd.apache.parquet",
+        "parquet",
+        columnar.stream_parquet,
+        True,
+        columnar.available,
+    ),
+    "arrow": ExportFormat(
+        "application/vnd.apache.arrow.stream",
+        "arrows",
+        columnar.stream_arrow,
+        True,
+        columnar.available,
+    ),
+    "netcdf": ExportFormat(
+        "application/x-netcdf", "nc", netcdf.stream_netcdf, True, True
+    ),
+}
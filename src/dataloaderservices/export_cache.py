@@ -0,0 +1,227 @@
+"""
+On-disk cache of each result's values for full-history downloads.
+
+HydroShare syncs and downloads without a date window read a result's whole history
+every time, although only its latest values are new. With `EXPORT_CACHE_DIR` set,
+`ExportCache` keeps every result's values under `<EXPORT_CACHE_DIR>/<result id>/`
+as one fixed-width binary file per column (UTC datetime, UTC offset, value) plus a
+`state.json` with the number of rows and the last datetime cached. A refresh only
+reads the rows after that datetime from the database and appends them to the
+column files.
+
+Values are only ever inserted, but not always after the latest one (e.g. an upload
+of an older SD card). After appending, the cached row count is compared with an
+exact count of the result's rows, and a cache missing rows is rebuilt from scratch.
+`results.valuecount` can't stand in for that count, as write-behind summaries
+update it late. The refresh runs in one repeatable read transaction, so the rows
+and the count agree with each other.
+
+Column files are locked with flock: exclusively while they are refreshed, shared
+while a download maps them. Cached rows are never rewritten in place (a rebuild
+replaces the files), so a download keeps reading the rows it mapped while the next
+refresh appends.
+"""
+import fcntl
+import json
+import os
+import shutil
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+from django.conf import settings
+from sqlalchemy.sql import text
+
+from dataloaderservices.export import FETCH_ROWS, SeriesValue, merge_result_values
+
+CACHE_DIR = getattr(settings, "EXPORT_CACHE_DIR", None)
+
+# bumped when the column files change, which makes every cache rebuild
+CACHE_VERSION = 1
+# column file name -> dtype
+COLUMNS = (
+    ("valuedatetime", np.dtype("<M8[us]")),
+    ("valuedatetimeutcoffset", np.dtype("<i4")),
+    ("datavalue", np.dtype("<f8")),
+)
+READ_CHUNK_ROWS = 10000
+
+_NEW_VALUES_QUERY = (
+    "SELECT valuedatetime, valuedatetimeutcoffset, datavalue "
+    "FROM odm2.timeseriesresultvalues "
+    "WHERE resultid = :result_id AND valuedatetime > :after "
+    "ORDER BY valuedatetime"
+)
+_ALL_VALUES_QUERY = (
+    "SELECT valuedatetime, valuedatetimeutcoffset, datavalue "
+    "FROM odm2.timeseriesresultvalues "
+    "WHERE resultid = :result_id "
+    "ORDER BY valuedatetime"
+)
+
+
+class ResultValuesCache:
+    def __init__(self, directory: str, result_id: int) -> None:
+        self.result_id = result_id
+        self.directory = os.path.join(directory, str(result_id))
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    @contextmanager
+    def _locked(self, operation: int) -> Iterator[None]:
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self._path("lock"), "a") as lock:
+            fcntl.flock(lock, operation)
+            yield
+
+    def _read_state(self) -> dict:
+        try:
+            with open(self._path("state.json")) as state_file:
+                state = json.load(state_file)
+        except (FileNotFoundError, ValueError):
+            state = {}
+        if state.get("version") != CACHE_VERSION:
+            state = {"version": CACHE_VERSION, "rows": 0, "last_datetime": None}
+        return state
+
+    def _write_state(self, state: dict) -> None:
+        temp_path = self._path("state.json.tmp")
+        with open(temp_path, "w") as state_file:
+            json.dump(state, state_file)
+        os.replace(temp_path, self._path("state.json"))
+
+    def _append(self, connection, state: dict) -> None:
+        """Appends the values after the last cached one to the column files."""
+        if state["last_datetime"]:
+            result = connection.execute(
+                text(_NEW_VALUES_QUERY),
+                {
+                    "result_id": self.result_id,
+                    "after": datetime.fromisoformat(state["last_datetime"]),
+                },
+            )
+        else:
+            result = connection.execute(text(_ALL_VALUES_QUERY), {"result_id": self.result_id})
+
+        files = []
+        try:
+            for name, dtype in COLUMNS:
+                column_file = open(self._path(name), "a+b")
+                # anything past the cached rows was left by an interrupted refresh,
+                # and no download maps past them
+                column_file.truncate(state["rows"] * dtype.itemsize)
+                files.append(column_file)
+            while True:
+                rows = result.fetchmany(FETCH_ROWS)
+                if not rows:
+                    break
+                for index, ((_, dtype), column_file) in enumerate(zip(COLUMNS, files)):
+                    np.array([row[index] for row in rows], dtype=dtype).tofile(column_file)
+                state["rows"] += len(rows)
+                state["last_datetime"] = rows[-1][0].isoformat()
+        finally:
+            for column_file in files:
+                column_file.close()
+
+    def _is_complete(self, connection, rows: int) -> bool:
+        return rows == connection.execute(
+            text(
+                "SELECT count(*) FROM odm2.timeseriesresultvalues "
+                "WHERE resultid = :result_id"
+            ),
+            {"result_id": self.result_id},
+        ).scalar()
+
+    def refresh(self, connection) -> int:
+        """Brings the cache up to date with the database; returns the rows appended."""
+        with self._locked(fcntl.LOCK_EX):
+            state = self._read_state()
+            cached_rows = state["rows"]
+            if not cached_rows:
+                # new files rather than truncated ones, a download may still map them
+                self._remove_columns()
+            self._append(connection, state)
+            if not self._is_complete(connection, state["rows"]):
+                # values were inserted before the last cached one
+                state = {"version": CACHE_VERSION, "rows": 0, "last_datetime": None}
+                self._remove_columns()
+                self._append(connection, state)
+                cached_rows = 0
+            self._write_state(state)
+            return state["rows"] - cached_rows
+
+    def _remove_columns(self) -> None:
+        for name, _ in COLUMNS:
+            try:
+                os.remove(self._path(name))
+            except FileNotFoundError:
+                pass
+
+    def values(self) -> Iterator[SeriesValue]:
+        """The cached values in time order, read from the column files in chunks."""
+        with self._locked(fcntl.LOCK_SH):
+            rows = self._read_state()["rows"]
+            if not rows:
+                return
+            # mapped under the lock; later appends and rebuilds leave these rows alone
+            columns = [
+                np.memmap(self._path(name), dtype=dtype, mode="r", shape=(rows,))
+                for name, dtype in COLUMNS
+            ]
+        value_datetimes, utc_offsets, data_values = columns
+        for start in range(0, rows, READ_CHUNK_ROWS):
+            end = start + READ_CHUNK_ROWS
+            yield from zip(
+                value_datetimes[start:end].astype(object),
+                utc_offsets[start:end].tolist(),
+                data_values[start:end].tolist(),
+            )
+
+    def remove(self) -> None:
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+class ExportCache:
+    def __init__(self, directory: str) -> None:
+        self.directory = directory
+
+    def result(self, result_id: int) -> ResultValuesCache:
+        return ResultValuesCache(self.directory, int(result_id))
+
+    def cached_result_ids(self) -> List[int]:
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+        return sorted(int(name) for name in names if name.isdigit())
+
+    def refresh(self, engine, result_ids: Iterable[int]) -> List[Tuple[int, int]]:
+        """Refreshes the results' caches; returns (result id, rows appended) pairs."""
+        appended = []
+        with engine.connect().execution_options(
+            isolation_level="REPEATABLE READ", stream_results=True
+        ) as connection:
+            for result_id in result_ids:
+                # one snapshot for a result's new rows and the counts they are checked against
+                with connection.begin():
+                    appended.append(
+                        (result_id, self.result(result_id).refresh(connection))
+                    )
+        return appended
+
+    def iter_data_rows(
+        self, engine, result_ids: List[int], typed: bool = False
+    ) -> Iterator[list]:
+        """
+        Wide rows of the results' whole history, like `export.iter_data_rows`,
+        merged from the refreshed caches.
+        """
+        self.refresh(engine, result_ids)
+        yield from merge_result_values(
+            [self.result(result_id).values() for result_id in result_ids], typed=typed
+        )
+
+
+export_cache: Optional[ExportCache] = ExportCache(CACHE_DIR) if CACHE_DIR else None
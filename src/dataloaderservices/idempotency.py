@@ -0,0 +1,45 @@
+"""
+Replay detection for data-stream posts.
+
+Loggers that time out waiting for a response send the same payload again. The
+status of each accepted post is remembered for `DATA_STREAM_IDEMPOTENCY_WINDOW`
+seconds, keyed on the registration token and either the client's `Idempotency-Key`
+header or a hash of the parsed payload, so a replay is answered with the original
+status without touching the database. The store is per process and bounded, so a
+replay that lands on another worker, or after the entry was evicted, is written
+again; the writer skips rows that already exist, so that is only slower.
+"""
+import hashlib
+import json
+
+from django.conf import settings
+
+from dataloaderservices.cache import TTLCache
+from dataloaderservices.payloads import DataStreamPayload
+
+# idempotency key -> status code of the original response
+replay_cache = TTLCache(
+    "idempotency",
+    getattr(settings, "DATA_STREAM_IDEMPOTENCY_SIZE", 10000),
+    getattr(settings, "DATA_STREAM_IDEMPOTENCY_WINDOW", 600),
+)
+
+
+def idempotency_key(request) -> str:
+    token = request.META.get("HTTP_TOKEN", "")
+    client_key = request.META.get("HTTP_IDEMPOTENCY_KEY")
+    if client_key:
+        return f"{token}:key:{client_key}"
+
+    digest = hashlib.sha256()
+    data = request.data
+    if isinstance(data, DataStreamPayload):
+        digest.update(data.sampling_feature.encode())
+        digest.update(data.value_datetimes.tobytes())
+        digest.update(data.utc_offsets.tobytes())
+        for key in sorted(data.measurement_data):
+            digest.update(key.encode())
+            digest.update(data.measurement_data[key].tobytes())
+    else:
+        digest.update(json.dumps(data, sort_keys=True, default=str).encode())
+    return f"{token}:hash:{digest.hexdigest()}"
@@ -0,0 +1,119 @@
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+from django.core.management.base import BaseCommand
+
+from dataloaderservices.export import merge_result_values
+
+
+def pivot_data_values(df, max_datetime, min_datetime):
+    """The pandas pivot_table path CSVDataApi.get_data_values used before the merge engine."""
+    df["valuedatetime"] = pd.to_datetime(df["valuedatetime"])
+    df["valuedatetime_local"] = df["valuedatetime"] + pd.to_timedelta(
+        df["valuedatetimeutcoffset"], unit="hours"
+    )
+    if max_datetime:
+        df = df[df["valuedatetime_local"] <= max_datetime]
+    if min_datetime:
+        df = df[df["valuedatetime_local"] >= min_datetime]
+
+    piv = pd.pivot_table(
+        df,
+        ["datavalue"],
+        ["valuedatetime", "valuedatetimeutcoffset", "valuedatetime_local"],
+        ["resultid"],
+    )
+    vals = piv.to_numpy()
+    dt = piv.index.get_level_values(0).astype(str)
+    utc_off = piv.index.get_level_values(1).astype(str)
+    dt_utc = piv.index.get_level_values(2).astype(str)
+    z = list(zip(dt, utc_off, dt_utc, vals))
+    return [[i[0], i[1], i[2], *i[3]] for i in z]
+
+
+class Command(BaseCommand):
+    help = (
+        "Compares the k-way merge CSV export engine with the former pandas pivot_table "
+        "path on synthetic series, without touching the database: time, peak memory "
+        "and whether both produce the same rows."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--results', type=int, default=10,
+                            help='Number of series exported together.')
+        parser.add_argument('--days', type=int, default=365,
+                            help='Days of 15 minute values per series; every other series has gaps.')
+        parser.add_argument('--window-days', type=int, default=None,
+                            help='Only export the last N days, in local time.')
+
+    def synthetic_series(self, results, days):
+        start = datetime(2020, 1, 1)
+        steps = days * 24 * 4
+        rng = np.random.default_rng(0)
+        series = []
+        for index in range(results):
+            offsets = np.arange(steps)
+            if index % 2:
+                # a logger that was down now and then
+                offsets = offsets[rng.random(steps) > 0.1]
+            datetimes = [start + timedelta(minutes=15 * int(o)) for o in offsets]
+            values = np.round(rng.normal(10, 2, len(offsets)), 3).tolist()
+            series.append([(dt, -5, value) for dt, value in zip(datetimes, values)])
+        return series
+
+    def measure(self, function):
+        # timed and traced in separate runs, tracing slows Python code down a lot
+        started = time.perf_counter()
+        rows = function()
+        elapsed = time.perf_counter() - started
+        tracemalloc.start()
+        function()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        return rows, elapsed, peak
+
+    def handle(self, *args, **options):
+        series = self.synthetic_series(options['results'], options['days'])
+        max_datetime = min_datetime = None
+        if options['window_days']:
+            max_datetime = datetime(2020, 1, 1) + timedelta(days=options['days'])
+            min_datetime = max_datetime - timedelta(days=options['window_days'])
+        self.stdout.write('{} series, {} values'.format(
+            len(series), sum(len(values) for values in series)))
+
+        def pandas_path():
+            # what the database query handed the pandas path, ordered by time and result
+            frame = pd.DataFrame(
+                [(result_id, value, dt, offset)
+                 for result_id, values in enumerate(series)
+                 for dt, offset, value in values],
+                columns=['resultid', 'datavalue', 'valuedatetime', 'valuedatetimeutcoffset'],
+            ).sort_values(['valuedatetime', 'resultid'])
+            return pivot_data_values(frame, max_datetime, min_datetime)
+
+        def merge_path():
+            # only counts rows, like a streamed download that doesn't keep them
+            count = 0
+            for _ in merge_result_values(series, max_datetime, min_datetime):
+                count += 1
+            return count
+
+        pandas_rows, pandas_time, pandas_peak = self.measure(pandas_path)
+        merge_count, merge_time, merge_peak = self.measure(merge_path)
+        for name, rows, elapsed, peak in (
+            ('pandas pivot_table', len(pandas_rows), pandas_time, pandas_peak),
+            ('k-way merge', merge_count, merge_time, merge_peak),
+        ):
+            self.stdout.write('{:<20} {:>9} rows {:>8.2f} s {:>9.1f} MiB peak'.format(
+                name, rows, elapsed, peak / 2 ** 20))
+
+        merged_rows = list(merge_result_values(series, max_datetime, min_datetime))
+        same = len(merged_rows) == len(pandas_rows) and all(
+            merged[:3] == pivoted[:3] and np.allclose(
+                merged[3:], np.asarray(pivoted[3:], dtype=float), equal_nan=True)
+            for merged, pivoted in zip(merged_rows, pandas_rows)
+        )
+        self.stdout.write('same rows: {}'.format('yes' if same else 'NO'))
@@ -0,0 +1,63 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from dataloaderservices.spool import data_stream_spool
+from dataloaderservices.views import ResultValueBatch, _db_engine
+
+
+class Command(BaseCommand):
+    help = (
+        "Writes data-stream payloads queued in the write-behind spool (DATA_STREAM_SPOOL_PATH) "
+        "to the database in large batches. Segments left by a crashed flusher are replayed "
+        "once their lease expires."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Number of spooled payloads written per transaction.')
+        parser.add_argument('--loop', action='store_true',
+                            help='Keep running and poll the spool instead of exiting once it is empty.')
+        parser.add_argument('--interval', type=float, default=5.0,
+                            help='Seconds to wait between polls of an empty spool when --loop is set.')
+        parser.add_argument('--stats', action='store_true',
+                            help='Print the number of pending payloads and the flush lag, then exit.')
+
+    def flush_segment(self, batch_size):
+        claim_id, records = data_stream_spool.claim(batch_size)
+        if not records:
+            return 0
+
+        batch = ResultValueBatch()
+        for record in records:
+            batch.add_spool_record(record)
+        try:
+            # the lease is renewed until the write is committed, so a slow batch isn't
+            # claimed and written again by another flusher
+            with data_stream_spool.leased(claim_id), _db_engine.begin() as connection:
+                batch.write(connection)
+        except Exception:
+            data_stream_spool.release(claim_id)
+            raise
+        data_stream_spool.ack(claim_id)
+        return len(records)
+
+    def handle(self, *args, **options):
+        if data_stream_spool is None:
+            raise CommandError('DATA_STREAM_SPOOL_PATH is not set, there is no spool to flush.')
+
+        if options['stats']:
+            stats = data_stream_spool.stats()
+            self.stdout.write('pending: {pending}\nlag_seconds: {lag_seconds:.1f}'.format(**stats))
+            return
+
+        while True:
+            flushed = self.flush_segment(options['batch_size'])
+            if flushed:
+                stats = data_stream_spool.stats()
+                self.stdout.write('- flushed {} payloads, {} pending, lag {:.1f}s'.format(
+                    flushed, stats['pending'], stats['lag_seconds']))
+                continue
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,45 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from dataloaderservices.upload_jobs import UploadJob
+from dataloaderservices.views import run_upload_job
+
+
+class Command(BaseCommand):
+    help = (
+        "Processes uploaded data files queued by the data file upload view (UPLOAD_JOB_DIR). "
+        "Needed when UPLOAD_JOB_WORKER is 'command'; otherwise it picks up jobs abandoned "
+        "by a web process that restarted mid-upload, and removes chunked uploads left "
+        "unfinished for UPLOAD_JOB_ABANDONED_SECONDS and finished jobs older than "
+        "UPLOAD_JOB_RETENTION_SECONDS (a week each by default)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true',
+                            help='Keep running and poll for new jobs instead of exiting once none are left.')
+        parser.add_argument('--interval', type=float, default=5.0,
+                            help='Seconds to wait between polls when --loop is set.')
+
+    def handle(self, *args, **options):
+        while True:
+            for job in UploadJob.abandoned():
+                job.remove()
+                self.stdout.write('- removed unfinished upload {} ({})'.format(job.job_id, job.state['file_name']))
+            for job in UploadJob.expired():
+                job.remove()
+                self.stdout.write('- removed finished job {} ({})'.format(job.job_id, job.state['file_name']))
+
+            processed = 0
+            for job in UploadJob.pending():
+                if not run_upload_job(job.job_id):
+                    continue  # claimed by another worker meanwhile
+                job = UploadJob.load(job.job_id)
+                self.stdout.write('- job {job_id} ({file_name}): {status}, {rows_inserted} rows inserted, '
+                                  '{rows_duplicate} duplicates'.format(**job.to_dict()))
+                processed += 1
+            if processed:
+                continue
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from dataloaderinterface.models import SiteSensor
+from dataloaderservices.export_cache import export_cache
+from dataloaderservices.views import _db_engine
+
+
+class Command(BaseCommand):
+    help = (
+        "Appends the values added since the last refresh to the per-result export cache "
+        "(EXPORT_CACHE_DIR), so full-history downloads and HydroShare syncs don't wait for "
+        "it, and removes the caches of results that no longer belong to a site sensor."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true',
+                            help='Cache every site sensor result, not only the ones downloaded before.')
+
+    def handle(self, *args, **options):
+        if export_cache is None:
+            raise CommandError('EXPORT_CACHE_DIR is not set, there is no export cache to refresh.')
+
+        sensor_result_ids = set(SiteSensor.objects.values_list('result_id', flat=True))
+        cached_result_ids = export_cache.cached_result_ids()
+        for result_id in cached_result_ids:
+            if result_id not in sensor_result_ids:
+                export_cache.result(result_id).remove()
+                self.stdout.write('- removed the cache of result {}'.format(result_id))
+
+        if options['all']:
+            result_ids = sorted(sensor_result_ids)
+        else:
+            result_ids = [result_id for result_id in cached_result_ids if result_id in sensor_result_ids]
+        for result_id, appended in export_cache.refresh(_db_engine, result_ids):
+            self.stdout.write('- result {}: {} new rows'.format(result_id, appended))
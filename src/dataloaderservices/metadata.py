@@ -0,0 +1,190 @@
+"""
+Metadata header of time series CSV downloads.
+
+`build_csv_metadata` loads everything the header templates reference for all the
+downloaded series at once (the results with their variables, units, methods and
+annotations, the site sensors, the site and its organization), so the number of
+queries doesn't grow with the number of series. The templates under
+`csv_templates` are read from disk once per process. Other download formats
+describe their series from the same `MetadataRecords`.
+"""
+from functools import lru_cache
+import os
+from types import SimpleNamespace
+from typing import Dict, List, NamedTuple
+
+from django.db.models import Prefetch, QuerySet
+from django.shortcuts import reverse
+
+from dataloader.models import Annotation, Organization, SamplingFeature
+from dataloaderinterface.models import SiteRegistration, SiteSensor
+
+TEMPLATE_DIR = os.path.join(os.path.dirname(__file__), "csv_templates")
+
+
+@lru_cache(maxsize=None)
+def read_template(fname: str) -> str:
+    with open(os.path.join(TEMPLATE_DIR, fname), "r", encoding="utf8") as f:
+        return f.read()
+
+
+def clean_variable_codes(varcodes: List[str]) -> List[str]:
+    """
+    Looks for duplicate variable codes and appends a number if collisions exist.
+
+    Example:
+        codes = clean_variable_codes(['foo', 'bar', 'foo'])
+        print(codes)
+        # ['foo-1', 'bar', 'foo-2']
+    """
+    for varcode in varcodes:
+        count = varcodes.count(varcode)
+        if count > 1:
+            counter = 1
+            for i in range(0, len(varcodes)):
+                if varcodes[i] == varcode:
+                    varcodes[i] = "{}-{}".format(varcode, counter)
+                    counter += 1
+    return varcodes
+
+
+def load_time_series_results(time_series_results: QuerySet) -> list:
+    """The results with every relation the templates use, in one query plus a prefetch."""
+    return list(
+        time_series_results.select_related(
+            "intended_time_spacing_unit",
+            "z_location_unit",
+            "result__variable__variable_type",
+            "result__variable__variable_name",
+            "result__unit",
+            "result__sampled_medium",
+            "result__feature_action__action__method",
+        ).prefetch_related(
+            Prefetch(
+                "result__annotations",
+                queryset=Annotation.objects.select_related("citation").order_by("pk"),
+            )
+        )
+    )
+
+
+class MetadataRecords(NamedTuple):
+    time_series_results: list
+    # result_id -> SiteSensor
+    sensors: Dict[int, SiteSensor]
+    # the site of the first series, as it is the one described
+    registration: SiteRegistration
+    sampling_feature: SamplingFeature
+    organization: Organization
+
+
+def load_metadata_records(time_series_results: QuerySet) -> MetadataRecords:
+    time_series_results = load_time_series_results(time_series_results)
+    sensors = {
+        sensor.result_id: sensor
+        for sensor in SiteSensor.objects.select_related("registration").filter(
+            result_id__in=[tsr.result.result_id for tsr in time_series_results]
+        )
+    }
+
+    # The first TimeSeriesResult's site is used for the "Site Information" block
+    # in the header of the CSV
+    registration = sensors.get(time_series_results[0].result.result_id).registration
+    # SiteRegistration.sampling_feature and .organization query on every access
+    sampling_feature = (
+        SamplingFeature.objects.select_related("site")
+        .filter(pk=registration.sampling_feature_id)
+        .first()
+    )
+    organization = (
+        Organization.objects.select_related("organization_type")
+        .filter(organization_id=registration.organization_id)
+        .first()
+    )
+    return MetadataRecords(
+        time_series_results, sensors, registration, sampling_feature, organization
+    )
+
+
+def site_link(registration: SiteRegistration, request=None) -> str:
+    link = reverse(
+        "site_detail",
+        kwargs={"sampling_feature_code": registration.sampling_feature_code},
+    )
+    return request.build_absolute_uri(link) if request else link
+
+
+def build_csv_metadata(time_series_results: QuerySet, request=None) -> str:
+    return format_csv_metadata(load_metadata_records(time_series_results), request)
+
+
+def format_csv_metadata(
+    records: MetadataRecords, request=None, aggregation=None
+) -> str:
+    time_series_results = records.time_series_results
+    sensors = records.sensors
+    registration = records.registration
+    site_sensor = sensors.get(time_series_results[0].result.result_id)
+
+    metadata = read_template("site_information.txt").format(
+        site=SimpleNamespace(
+            sampling_feature=records.sampling_feature,
+            site_notes=registration.site_notes,
+        )
+    )
+
+    if len(time_series_results) == 1:
+        # If there is only one time series result, use the normal variable and method info template
+        tsr = time_series_results[0]
+        metadata += read_template("variable_and_method_template.txt").format(
+            variable_code=tsr.result.variable,
+            r=tsr.result,
+            v=tsr.result.variable,
+            u=tsr.result.unit,
+            s=site_sensor,
+        )
+    else:
+        # If there are more than one time series result, use the compact
+        # version of the variable and method info template.
+        metadata += "# Variable and Method Information\n#---------------------------\n"
+        template = read_template("variable_and_method_template_compact.txt")
+        # duplicate variable codes get "-#" appended so the columns can be told apart
+        varcodes = clean_variable_codes(
+            [tsr.result.variable for tsr in time_series_results]
+        )
+        for varcode, tsr in zip(varcodes, time_series_results):
+            metadata += template.format(
+                variable_code=varcode,
+                r=tsr.result,
+                v=tsr.result.variable,
+                u=tsr.result.unit,
+                s=sensors.get(tsr.result.result_id),
+            )
+
+    metadata += "#\n"
+
+    if len(time_series_results) == 1:
+        # If there's only one timeseriesresult, add the variable and unit information block.
+        # When there are multiple timeseriesresults, this part of the CSV becomes cluttered
+        # and unreadable.
+        tsr = time_series_results[0]
+        metadata += read_template("variable_and_unit_information.txt").format(
+            variable=tsr.result.variable, unit=tsr.result.unit, sensor=site_sensor
+        )
+
+    # Write Source Information data, citing the last series like it always has
+    annotations = time_series_results[-1].result.annotations.all()
+    annotation = annotations[0] if annotations else None
+    citation = annotation.citation.title if annotation and annotation.citation else ""
+
+    metadata += read_template("source_info_template.txt").format(
+        organization=records.organization,
+        citation=citation,
+        source_link=site_link(registration, request),
+    )
+
+    if aggregation:
+        metadata += read_template("aggregation_information.txt").format(
+            interval=aggregation.interval, stats=", ".join(aggregation.stats)
+        )
+    return metadata
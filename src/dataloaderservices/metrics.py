@@ -0,0 +1,143 @@
+"""
+Per-stage timings of the ingestion endpoints.
+
+Views using `StageTimingMixin` get a `RequestTimer` as `request.timer`. The body
+parse, authentication/throttling, and every `with request.timer.stage(...)` block
+are recorded into process-wide latency histograms named `<view>.<stage>_ms`, along
+with counters of requests, rows and bytes, served by `MetricsApi`. Requests slower
+than `SLOW_REQUEST_THRESHOLD` milliseconds are also logged with their stage breakdown.
+"""
+import logging
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Any, Dict
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+SLOW_REQUEST_THRESHOLD = getattr(settings, "SLOW_REQUEST_THRESHOLD", None)
+
+
+class Histogram:
+    """Counts of observed values per bucket; bucket bounds are upper bounds in milliseconds."""
+
+    BOUNDS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+
+    def __init__(self) -> None:
+        self.buckets = [0] * (len(self.BOUNDS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        self.buckets[bisect_left(self.BOUNDS, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def snapshot(self) -> Dict[str, Any]:
+        buckets = {f"le_{bound}": n for bound, n in zip(self.BOUNDS, self.buckets)}
+        buckets["inf"] = self.buckets[-1]
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 3),
+            "max": round(self.max, 3),
+            "buckets": buckets,
+        }
+
+
+class MetricsRegistry:
+    def __init__(self) -> None:
+        self._histograms = {}
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name: str, value: float) -> None:
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = self._histograms[name] = Histogram()
+            histogram.observe(value)
+
+    def increment(self, name: str, amount: int = 1) -> None:
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + amount
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "histograms": {
+                    name: histogram.snapshot()
+                    for name, histogram in sorted(self._histograms.items())
+                },
+                "counters": dict(sorted(self._counters.items())),
+            }
+
+
+metrics = MetricsRegistry()
+
+
+class RequestTimer:
+    """Stage timings and counts of one request; stages may be timed from several threads."""
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.started = time.perf_counter()
+        self.stages = {}  # stage -> milliseconds
+        self.counts = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, stage: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, (time.perf_counter() - started) * 1000)
+
+    def record(self, stage: str, milliseconds: float) -> None:
+        with self._lock:
+            self.stages[stage] = self.stages.get(stage, 0.0) + milliseconds
+        metrics.observe(f"{self.name}.{stage}_ms", milliseconds)
+
+    def count(self, what: str, amount: int) -> None:
+        with self._lock:
+            self.counts[what] = self.counts.get(what, 0) + amount
+        metrics.increment(f"{self.name}.{what}", amount)
+
+    def finish(self, status_code: int) -> None:
+        total = (time.perf_counter() - self.started) * 1000
+        metrics.observe(f"{self.name}.total_ms", total)
+        metrics.increment(f"{self.name}.requests")
+        metrics.increment(f"{self.name}.status_{status_code}")
+        if SLOW_REQUEST_THRESHOLD is not None and total >= SLOW_REQUEST_THRESHOLD:
+            logger.warning(
+                "slow %s request: %.0f ms, status %s, stages %s, counts %s",
+                self.name,
+                total,
+                status_code,
+                {stage: round(ms, 1) for stage, ms in self.stages.items()},
+                self.counts,
+            )
+
+
+class StageTimingMixin:
+    """Times the body parse and authentication of an APIView, and gives it `request.timer`."""
+
+    def initial(self, request, *args, **kwargs):
+        request.timer = RequestTimer(type(self).__name__)
+        request.timer.count("bytes", int(request.META.get("CONTENT_LENGTH") or 0))
+        with request.timer.stage("parse"):
+            request.data
+        with request.timer.stage("auth"):
+            super().initial(request, *args, **kwargs)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        timer = getattr(request, "timer", None)
+        if timer is not None:
+            timer.finish(response.status_code)
+        return response
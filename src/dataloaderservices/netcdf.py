@@ -0,0 +1,305 @@
+"""
+NetCDF (CF conventions) writer for time series exports.
+
+Files are written in the NetCDF classic 64-bit offset format, which is simple
+enough to produce here without a NetCDF library and is read by every NetCDF tool.
+Each result becomes a `double <variable code>(time)` variable with its units,
+name and vertical position, if the sensor has one (or one per statistic, with
+its `cell_methods`, for aggregated downloads), next to `time` (seconds since 1970
+UTC), `utc_offset` and the site's `lat`/`lon`, as a CF `timeSeries` feature with
+a `station_id`.
+The metadata header of the CSV download is kept as the `odm2_metadata` global
+attribute.
+
+The header states the number of records, so rows are written to a temporary
+file as they are read from the database (in memory up to `SPOOL_MAX_BYTES`) and
+the file is streamed out once they are all in: memory stays bounded by the
+batch size whatever the size of the site.
+"""
+import re
+import struct
+import tempfile
+from typing import Iterable, Iterator, List, NamedTuple, Tuple
+
+import numpy as np
+
+from dataloaderservices.metadata import MetadataRecords
+
+NC_DIMENSION = 0x0A
+NC_VARIABLE = 0x0B
+NC_ATTRIBUTE = 0x0C
+NC_CHAR = 2
+NC_INT = 4
+NC_DOUBLE = 6
+
+BATCH_ROWS = 10000
+SPOOL_MAX_BYTES = 8 * 2 ** 20
+STREAM_CHUNK_BYTES = 2 ** 20
+
+TIME_UNITS = "seconds since 1970-01-01 00:00:00"
+_EPOCH = np.datetime64("1970-01-01T00:00:00", "us")
+_RESERVED_NAMES = {"time", "utc_offset", "lat", "lon", "alt", "station_id", "name_strlen"}
+# aggregation statistic -> CF cell method
+_CELL_METHODS = {"mean": "mean", "min": "minimum", "max": "maximum"}
+
+
+class _Variable(NamedTuple):
+    name: str
+    dimensions: Tuple[int, ...]
+    nc_type: int
+    attributes: dict
+    # the values of non-record variables, None for record (per time step) variables
+    data: bytes = None
+
+    @property
+    def vsize(self) -> int:
+        if self.data is None:
+            return 8 if self.nc_type == NC_DOUBLE else 4
+        return len(_pad(self.data))
+
+
+def _pad(data: bytes) -> bytes:
+    return data + b"\0" * (-len(data) % 4)
+
+
+def _name(name: str) -> bytes:
+    encoded = name.encode("utf8")
+    return struct.pack(">i", len(encoded)) + _pad(encoded)
+
+
+def _attributes(attributes: dict) -> bytes:
+    if not attributes:
+        return b"\0" * 8  # ABSENT
+    header = struct.pack(">ii", NC_ATTRIBUTE, len(attributes))
+    for name, value in attributes.items():
+        if isinstance(value, str):
+            values = value.encode("utf8")
+            header += _name(name) + struct.pack(">ii", NC_CHAR, len(values))
+        elif isinstance(value, int):
+            values = struct.pack(">i", value)
+            header += _name(name) + struct.pack(">ii", NC_INT, 1)
+        else:
+            values = struct.pack(">d", value)
+            header += _name(name) + struct.pack(">ii", NC_DOUBLE, 1)
+        header += _pad(values)
+    return header
+
+
+def _header(
+    record_count: int,
+    dimensions: List[Tuple[str, int]],
+    attributes: dict,
+    variables: List[_Variable],
+    begins: List[int],
+) -> bytes:
+    header = b"CDF\x02" + struct.pack(">i", record_count)
+    header += struct.pack(">ii", NC_DIMENSION, len(dimensions))
+    for name, length in dimensions:
+        header += _name(name) + struct.pack(">i", length)
+    header += _attributes(attributes)
+    header += struct.pack(">ii", NC_VARIABLE, len(variables))
+    for variable, begin in zip(variables, begins):
+        header += _name(variable.name) + struct.pack(">i", len(variable.dimensions))
+        header += b"".join(struct.pack(">i", dimension) for dimension in variable.dimensions)
+        header += _attributes(variable.attributes)
+        header += struct.pack(">iiq", variable.nc_type, variable.vsize, begin)
+    return header
+
+
+def variable_name(column: str) -> str:
+    """A NetCDF variable name for a CSV column, kept clear of the coordinate variables."""
+    name = re.sub(r"[^A-Za-z0-9_.@+-]", "_", column)
+    if not re.match(r"[A-Za-z_]", name):
+        name = "_" + name
+    return name + "_values" if name in _RESERVED_NAMES else name
+
+
+def variable_names(columns: List[str]) -> List[str]:
+    """
+    Unique variable names for the CSV columns, none of them clashing with another's
+    `<name>_z` either: columns that sanitize to a name already taken get a number
+    appended, like `clean_variable_codes` does (e.g. `a b` and `a_b` give `a_b` and `a_b-1`).
+    """
+    taken = set(_RESERVED_NAMES)
+    names = []
+    for column in columns:
+        name = unique = variable_name(column)
+        counter = 0
+        while unique in taken or unique + "_z" in taken:
+            counter += 1
+            unique = "{}-{}".format(name, counter)
+        taken.update((unique, unique + "_z"))
+        names.append(unique)
+    return names
+
+
+def _describe(
+    metadata: str, headers: List[str], records: MetadataRecords, aggregation=None
+) -> Tuple[List[Tuple[str, int]], dict, List[_Variable]]:
+    registration = records.registration
+    sampling_feature = records.sampling_feature
+    site = sampling_feature.site
+    station_id = sampling_feature.sampling_feature_code.encode("utf8")
+
+    dimensions = [("time", 0), ("name_strlen", len(station_id))]
+    attributes = {
+        "Conventions": "CF-1.8",
+        "featureType": "timeSeries",
+        "title": "{} time series".format(sampling_feature.sampling_feature_name),
+        "institution": records.organization.organization_name
+        if records.organization
+        else "",
+        "source": "Monitor My Watershed",
+        "site_code": registration.sampling_feature_code,
+        "odm2_metadata": metadata,
+    }
+
+    station = [
+        _Variable("station_id", (1,), NC_CHAR, {"cf_role": "timeseries_id"}, station_id),
+        _Variable(
+            "lat",
+            (),
+            NC_DOUBLE,
+            {"standard_name": "latitude", "units": "degrees_north"},
+            struct.pack(">d", site.latitude),
+        ),
+        _Variable(
+            "lon",
+            (),
+            NC_DOUBLE,
+            {"standard_name": "longitude", "units": "degrees_east"},
+            struct.pack(">d", site.longitude),
+        ),
+    ]
+    coordinates = "time lat lon"
+    if sampling_feature.elevation_m is not None:
+        station.append(
+            _Variable(
+                "alt",
+                (),
+                NC_DOUBLE,
+                {"standard_name": "height_above_mean_sea_level", "units": "m"},
+                struct.pack(">d", sampling_feature.elevation_m),
+            )
+        )
+        coordinates += " alt"
+
+    series = [
+        _Variable(
+            "time",
+            (0,),
+            NC_DOUBLE,
+            {
+                "standard_name": "time",
+                "long_name": "time (UTC)",
+                "units": TIME_UNITS,
+                "calendar": "standard",
+                "axis": "T",
+            },
+        ),
+        _Variable(
+            "utc_offset",
+            (0,),
+            NC_INT,
+            {"long_name": "UTC offset of the local time", "units": "hours"},
+        ),
+    ]
+    stats = aggregation.stats if aggregation else [None]
+    columns = headers[3:]
+    for index, (column, name) in enumerate(zip(columns, variable_names(columns))):
+        tsr = records.time_series_results[index // len(stats)]
+        stat = stats[index % len(stats)]
+        result = tsr.result
+        variable_coordinates = coordinates
+        # sensors registered without a height have no vertical position
+        if tsr.z_location is not None:
+            z_attributes = {"long_name": "vertical position of {}".format(column), "axis": "Z"}
+            if tsr.z_location_unit:
+                z_attributes["units"] = tsr.z_location_unit.unit_abbreviation
+            station.append(
+                _Variable(name + "_z", (), NC_DOUBLE, z_attributes, struct.pack(">d", tsr.z_location))
+            )
+            variable_coordinates += " {}_z".format(name)
+        variable_attributes = {
+            "long_name": result.variable.variable_name_id,
+            "units": result.unit.unit_abbreviation,
+            "units_name": result.unit.unit_name,
+        }
+        if stat == "count":
+            variable_attributes = {
+                "long_name": "number of {} values".format(result.variable.variable_name_id),
+                "units": "1",
+            }
+        elif stat:
+            variable_attributes["cell_methods"] = "time: {} (interval: 1 {})".format(
+                _CELL_METHODS[stat], aggregation.interval
+            )
+        variable_attributes.update(
+            {
+                "_FillValue": float("nan"),
+                "coordinates": variable_coordinates,
+                "variable_code": result.variable.variable_code,
+                "sampled_medium": result.sampled_medium_id,
+                "result_id": result.result_id,
+                "result_uuid": str(result.result_uuid),
+            }
+        )
+        series.append(_Variable(name, (0,), NC_DOUBLE, variable_attributes))
+    return dimensions, attributes, station + series
+
+
+def _record_batch(dtype: np.dtype, rows: List[list]) -> bytes:
+    records = np.empty(len(rows), dtype=dtype)
+    value_datetimes = np.array([row[0] for row in rows], dtype="datetime64[us]")
+    records["time"] = (value_datetimes - _EPOCH) / np.timedelta64(1, "s")
+    records["utc_offset"] = [row[1] for row in rows]
+    for index, name in enumerate(dtype.names[2:], start=3):
+        records[name] = [row[index] for row in rows]
+    return records.tobytes()
+
+
+def stream_netcdf(
+    metadata: str,
+    headers: List[str],
+    rows: Iterable[list],
+    records: MetadataRecords = None,
+    aggregation=None,
+) -> Iterator[bytes]:
+    dimensions, attributes, variables = _describe(metadata, headers, records, aggregation)
+    record_variables = [variable for variable in variables if variable.data is None]
+    dtype = np.dtype(
+        [
+            (variable.name, ">f8" if variable.nc_type == NC_DOUBLE else ">i4")
+            for variable in record_variables
+        ]
+    )
+
+    with tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES) as spool:
+        record_count = 0
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= BATCH_ROWS:
+                spool.write(_record_batch(dtype, batch))
+                record_count += len(batch)
+                batch = []
+        if batch:
+            spool.write(_record_batch(dtype, batch))
+            record_count += len(batch)
+
+        # data starts right after the header, whose length doesn't depend on the offsets
+        begin = len(_header(record_count, dimensions, attributes, variables, [0] * len(variables)))
+        begins = []
+        # non-record variables come first, then the record variables of one time step
+        for variable in variables:
+            begins.append(begin)
+            begin += variable.vsize
+        yield _header(record_count, dimensions, attributes, variables, begins)
+        yield b"".join(_pad(variable.data) for variable in variables if variable.data is not None)
+
+        spool.seek(0)
+        while True:
+            chunk = spool.read(STREAM_CHUNK_BYTES)
+            if not chunk:
+                break
+            yield chunk
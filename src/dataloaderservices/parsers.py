@@ -0,0 +1,84 @@
+"""
+Request body parsers for the data-stream and upload APIs.
+
+Both parsers accept `Content-Encoding: gzip` bodies. `DataStreamMessagePackParser`
+reads the compact columnar format (MessagePack, epoch-second timestamps, number
+arrays) straight into a `DataStreamPayload`; it needs the optional `msgpack` package.
+`UploadChunkParser` leaves chunks of a resumable upload unread, to be copied to disk.
+"""
+import gzip
+import io
+import zlib
+
+from django.conf import settings
+from rest_framework import exceptions
+from rest_framework.parsers import BaseParser, JSONParser
+
+from dataloaderservices.payloads import columnar_data_stream_payload
+
+try:
+    import msgpack
+except ImportError:  # optional, only needed for MessagePack bodies
+    msgpack = None
+
+
+def decode_content(stream, parser_context):
+    """Returns the request body stream with its Content-Encoding (identity or gzip) removed."""
+    request = parser_context["request"]
+    encoding = request.META.get("HTTP_CONTENT_ENCODING", "").strip().lower()
+    if encoding in ("", "identity"):
+        return stream
+    if encoding != "gzip":
+        raise exceptions.UnsupportedMediaType(
+            encoding, detail=f'Unsupported Content-Encoding "{encoding}".'
+        )
+
+    # bounded like an uncompressed body, so a small gzip bomb can't exhaust memory
+    max_size = settings.DATA_UPLOAD_MAX_MEMORY_SIZE
+    try:
+        with gzip.GzipFile(fileobj=stream, mode="rb") as body:
+            content = body.read(-1 if max_size is None else max_size + 1)
+    except (OSError, EOFError, zlib.error):
+        raise exceptions.ParseError("Request body is not valid gzip data.")
+    if max_size is not None and len(content) > max_size:
+        raise exceptions.ParseError("Decompressed request body is too large.")
+    return io.BytesIO(content)
+
+
+class GzipJSONParser(JSONParser):
+    def parse(self, stream, media_type=None, parser_context=None):
+        return super().parse(
+            decode_content(stream, parser_context), media_type, parser_context
+        )
+
+
+class DataStreamMessagePackParser(BaseParser):
+    """
+    example body, as MessagePack:
+        {"sampling_feature": "<uuid>", "timestamp": [1481233501, 1481233801],
+         "utc_offset": -7, "<result_uuid>": [8.0, 9.0], ...}
+    """
+
+    media_type = "application/msgpack"
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        if msgpack is None:
+            raise exceptions.UnsupportedMediaType(
+                media_type, detail="MessagePack bodies are not supported by this server."
+            )
+        try:
+            data = msgpack.unpackb(
+                decode_content(stream, parser_context).read(), raw=False
+            )
+        except (ValueError, TypeError):
+            raise exceptions.ParseError("Request body is not valid MessagePack.")
+        return columnar_data_stream_payload(data)
+
+
+class UploadChunkParser(BaseParser):
+    """Hands over the raw body stream of an upload chunk instead of reading it into memory."""
+
+    media_type = "application/octet-stream"
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        return stream if stream is not None else io.BytesIO()
@@ -0,0 +1,132 @@
+"""
+Validated data-stream request bodies.
+
+JSON and form bodies carry ISO 8601 timestamp strings and go through
+`parse_data_stream_payload`. MessagePack bodies (see `parsers.DataStreamMessagePackParser`)
+carry epoch-second timestamps and float arrays, and are turned into a
+`DataStreamPayload` directly by `columnar_data_stream_payload`.
+"""
+from typing import Any, Dict, Union
+
+import numpy as np
+from rest_framework import exceptions
+
+from dataloaderservices.timestamps import (
+    MAX_DATETIME,
+    MIN_DATETIME,
+    parse_timestamps,
+)
+
+
+class DataStreamPayload:
+    """Validated contents of a single data-stream POST body, with timestamps as arrays."""
+
+    def __init__(
+        self,
+        sampling_feature: str,
+        value_datetimes: np.ndarray,
+        utc_offsets: np.ndarray,
+        measurement_data: Dict[str, list],
+        latest_measurement_idx: Union[int, None],
+    ) -> None:
+        self.sampling_feature = sampling_feature
+        self.value_datetimes = value_datetimes  # UTC, datetime64[us]
+        self.utc_offsets = utc_offsets  # whole hours
+        self.measurement_data = measurement_data
+        self.latest_measurement_idx = latest_measurement_idx
+
+    @property
+    def num_measurements(self) -> int:
+        return len(self.value_datetimes)
+
+
+def parse_data_stream_payload(data) -> DataStreamPayload:
+    if isinstance(data, DataStreamPayload):
+        return data  # already parsed from a columnar body
+
+    # list-ify all request data
+    measurement_data = {k: v if isinstance(v, list) else [v] for k, v in data.items()}
+    # remove non-UUID keys and process now, leaving measurement UUID keys for later
+    try:
+        sampling_feature = measurement_data.pop("sampling_feature")[0]
+        timestamps = measurement_data.pop("timestamp")
+    except (KeyError, IndexError):
+        raise exceptions.ParseError("Required data not found in request.")
+
+    # ensure each measurement has the same number of data points. there's
+    # one timestamp per point so we use that as the expected number.
+    num_measurements = len(timestamps)
+    if not all(len(m) == num_measurements for m in measurement_data.values()):
+        raise exceptions.ParseError("unequal number of data points")
+
+    value_datetimes, utc_offsets, latest_measurement_idx = parse_timestamps(timestamps)
+    return DataStreamPayload(
+        sampling_feature,
+        value_datetimes,
+        utc_offsets,
+        measurement_data,
+        latest_measurement_idx,
+    )
+
+
+def columnar_data_stream_payload(data: Dict[str, Any]) -> DataStreamPayload:
+    """
+    Builds a payload from a columnar body: `timestamp` is a list of UTC epoch
+    seconds, the optional `utc_offset` is the logger's offset in whole hours (one
+    for all timestamps or one per timestamp), and every other key except
+    `sampling_feature` is a result UUID with a list of numbers.
+    """
+    if not isinstance(data, dict):
+        raise exceptions.ParseError("Required data not found in request.")
+    measurement_data = dict(data)
+    try:
+        sampling_feature = str(measurement_data.pop("sampling_feature"))
+        timestamps = measurement_data.pop("timestamp")
+    except KeyError:
+        raise exceptions.ParseError("Required data not found in request.")
+    utc_offsets = measurement_data.pop("utc_offset", 0)
+
+    try:
+        epoch_seconds = np.asarray(timestamps, dtype=np.float64).reshape(-1)
+    except (TypeError, ValueError):
+        raise exceptions.ParseError("The timestamp value is not valid.")
+    if not np.isfinite(epoch_seconds).all():
+        raise exceptions.ParseError("The timestamp value is not valid.")
+    # checked as floats, before the conversion to microseconds could wrap around
+    if (
+        (epoch_seconds < MIN_DATETIME.astype(np.int64) / 1_000_000)
+        | (epoch_seconds > MAX_DATETIME.astype(np.int64) / 1_000_000)
+    ).any():
+        raise exceptions.ParseError("The timestamp value is out of range.")
+    try:
+        utc_offsets = np.broadcast_to(
+            np.asarray(utc_offsets, dtype=np.int64), epoch_seconds.shape
+        ).copy()
+    except (TypeError, ValueError, OverflowError):
+        raise exceptions.ParseError("The utc_offset value is not valid.")
+    if (np.abs(utc_offsets) >= 24).any():
+        raise exceptions.ParseError("The utc_offset value is not valid.")
+
+    num_measurements = len(epoch_seconds)
+    columns = {}
+    for key, values in measurement_data.items():
+        try:
+            values = np.asarray(values, dtype=np.float64).reshape(-1)
+        except (TypeError, ValueError):
+            raise exceptions.ParseError("Data values must be numbers.")
+        if len(values) != num_measurements:
+            raise exceptions.ParseError("unequal number of data points")
+        if not np.isfinite(values).all():
+            raise exceptions.ParseError("Data values must be finite numbers.")
+        columns[str(key)] = values
+
+    value_datetimes = (
+        np.round(epoch_seconds * 1_000_000).astype(np.int64).astype("datetime64[us]")
+    )
+    return DataStreamPayload(
+        sampling_feature,
+        value_datetimes,
+        utc_offsets,
+        columns,
+        int(np.argmax(value_datetimes)) if num_measurements else None,
+    )
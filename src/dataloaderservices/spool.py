@@ -0,0 +1,153 @@
+"""
+Durable write-behind spool for data-stream ingestion.
+
+When `DATA_STREAM_SPOOL_PATH` is set, validated data-stream payloads are appended
+to a local SQLite journal and acknowledged with 202 Accepted, instead of being
+written to the ODM2 database inside the request. The `flush_data_stream_spool`
+management command drains the journal in large batches.
+
+A flusher claims a segment of records by stamping it with a lease, writes it to
+the database, and only then deletes (acks) it. The lease is renewed while the
+segment is being written, however long that takes, so records only become
+claimable again when their flusher crashed before acking; they are then replayed,
+and the insert ignores rows that already exist.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, Iterator, List, Tuple
+
+from django.conf import settings
+
+DEFAULT_LEASE_SECONDS = 300
+
+
+class DataStreamSpool:
+    def __init__(self, path: str, lease_seconds: float = DEFAULT_LEASE_SECONDS) -> None:
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self._local = threading.local()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        with self._connection() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS payloads ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                "received REAL NOT NULL, "
+                "body TEXT NOT NULL, "
+                "claimed_by TEXT, "
+                "claimed_until REAL)"
+            )
+
+    def _connection(self) -> sqlite3.Connection:
+        # sqlite3 connections can't be shared between threads, keep one per thread
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=FULL")
+            self._local.connection = connection
+        return connection
+
+    def append(self, records: Iterable[Dict[str, Any]]) -> None:
+        """Durably stores the records; returns once they are committed to disk."""
+        now = time.time()
+        rows = [(now, json.dumps(record)) for record in records]
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            connection.executemany(
+                "INSERT INTO payloads (received, body) VALUES (?, ?)", rows
+            )
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+
+    def claim(self, limit: int) -> Tuple[str, List[Dict[str, Any]]]:
+        """
+        Claims up to `limit` of the oldest unclaimed records, or records whose lease
+        expired. Returns a claim id to pass to `ack` and the decoded records.
+        """
+        claim_id = uuid.uuid4().hex
+        now = time.time()
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            connection.execute(
+                "UPDATE payloads SET claimed_by = ?, claimed_until = ? WHERE id IN ("
+                "SELECT id FROM payloads WHERE claimed_until IS NULL OR claimed_until < ? "
+                "ORDER BY id LIMIT ?)",
+                (claim_id, now + self.lease_seconds, now, limit),
+            )
+            rows = connection.execute(
+                "SELECT body FROM payloads WHERE claimed_by = ? ORDER BY id", (claim_id,)
+            ).fetchall()
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+        return claim_id, [json.loads(body) for body, in rows]
+
+    def renew(self, claim_id: str) -> bool:
+        """Extends the lease of a claim; False if it no longer holds any record."""
+        cursor = self._connection().execute(
+            "UPDATE payloads SET claimed_until = ? WHERE claimed_by = ?",
+            (time.time() + self.lease_seconds, claim_id),
+        )
+        return cursor.rowcount > 0
+
+    @contextmanager
+    def leased(self, claim_id: str) -> Iterator[None]:
+        """Renews the claim's lease every third of the lease while the block runs."""
+        stop = threading.Event()
+
+        def renew_lease() -> None:
+            while not stop.wait(self.lease_seconds / 3):
+                self.renew(claim_id)
+
+        renewer = threading.Thread(target=renew_lease, name="spool-lease", daemon=True)
+        renewer.start()
+        try:
+            yield
+        finally:
+            stop.set()
+            renewer.join()
+
+    def ack(self, claim_id: str) -> None:
+        """Deletes the records of a claim once they have been written to the database."""
+        self._connection().execute("DELETE FROM payloads WHERE claimed_by = ?", (claim_id,))
+
+    def release(self, claim_id: str) -> None:
+        """Makes the records of a failed claim available to the next flush."""
+        self._connection().execute(
+            "UPDATE payloads SET claimed_by = NULL, claimed_until = NULL WHERE claimed_by = ?",
+            (claim_id,),
+        )
+
+    def stats(self) -> Dict[str, Any]:
+        """Number of pending records and the age in seconds of the oldest one (the flush lag)."""
+        pending, oldest = self._connection().execute(
+            "SELECT COUNT(*), MIN(received) FROM payloads"
+        ).fetchone()
+        return {
+            "pending": pending,
+            "lag_seconds": time.time() - oldest if oldest is not None else 0.0,
+        }
+
+
+def _get_spool():
+    path = getattr(settings, "DATA_STREAM_SPOOL_PATH", None)
+    if not path:
+        return None
+    return DataStreamSpool(
+        path, getattr(settings, "DATA_STREAM_SPOOL_LEASE", DEFAULT_LEASE_SECONDS)
+    )
+
+
+# None unless the write-behind mode is enabled in settings
+data_stream_spool = _get_spool()
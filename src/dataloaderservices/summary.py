@@ -0,0 +1,147 @@
+"""
+Coalesced updates of the per-result summaries kept next to the result values:
+the latest measurement in `dataloaderinterface_sensormeasurement` and
+`valuecount`/`resultdatetime` in `odm2.results`.
+
+Updating those rows once per post takes a row lock on the same hot results every
+time a gateway posts. `ResultSummaryDeltas` collapses any number of writes into one
+latest value and one count delta per result and applies them with one set-based
+statement per table. With `RESULT_SUMMARY_WINDOW` set, `ResultSummaryWriteBehind`
+collects the deltas of every post in the process and applies them every few seconds
+instead of inside each request.
+"""
+import logging
+import threading
+import time
+from datetime import timedelta
+from typing import Any, Dict, Iterable
+
+from sqlalchemy.sql import text
+
+logger = logging.getLogger(__name__)
+
+
+class ResultSummaryDeltas:
+    """Latest value and number of new rows per result, collapsed from several writes."""
+
+    def __init__(self) -> None:
+        self.latest_values = {}  # result_id -> value at the latest time
+        self.value_counts = {}  # result_id -> rows inserted
+
+    def __bool__(self) -> bool:
+        return bool(self.latest_values or self.value_counts)
+
+    def add_latest(self, result_values: Iterable[Any]) -> None:
+        """
+        Keeps the newest of the given values per result. Like the SensorMeasurement
+        upsert, a value only replaces one with a strictly earlier datetime.
+        """
+        for result_value in result_values:
+            result_id = int(result_value.result_id)
+            latest = self.latest_values.get(result_id)
+            if not latest or result_value.value_datetime > latest.value_datetime:
+                self.latest_values[result_id] = result_value
+
+    def add_counts(self, value_counts: Dict[int, int]) -> None:
+        for result_id, count in value_counts.items():
+            result_id = int(result_id)
+            self.value_counts[result_id] = self.value_counts.get(result_id, 0) + count
+
+    def update(self, other: "ResultSummaryDeltas") -> None:
+        self.add_latest(other.latest_values.values())
+        self.add_counts(other.value_counts)
+
+    def write(self, connection) -> None:
+        # sorted so concurrent writers lock the result rows in the same order
+        latest_values = [self.latest_values[r] for r in sorted(self.latest_values)]
+        if not latest_values:
+            return
+
+        # a missing value still counts and moves resultdatetime, but isn't shown as
+        # the latest measurement
+        measurements = [v for v in latest_values if v.data_value is not None]
+        if measurements:
+            # one row per sensor, or ON CONFLICT would affect a row twice
+            connection.execute(
+                text(
+                    "INSERT INTO public.dataloaderinterface_sensormeasurement AS m "
+                    "(sensor_id, value_datetime, value_datetime_utc_offset, data_value) "
+                    "SELECT DISTINCT ON (s.id) "
+                    "s.id, v.value_datetime, v.utc_offset, v.data_value "
+                    "FROM unnest(CAST(:result_ids AS integer[]), CAST(:datetimes AS timestamp[]), "
+                    "CAST(:utc_offsets AS interval[]), CAST(:data_values AS double precision[])) "
+                    "AS v(result_id, value_datetime, utc_offset, data_value) "
+                    'JOIN public.dataloaderinterface_sitesensor s ON s."ResultID" = v.result_id '
+                    "ORDER BY s.id, v.value_datetime DESC "
+                    "ON CONFLICT (sensor_id) DO UPDATE SET "
+                    "value_datetime = excluded.value_datetime, "
+                    "value_datetime_utc_offset = excluded.value_datetime_utc_offset, "
+                    "data_value = excluded.data_value "
+                    "WHERE m.value_datetime < excluded.value_datetime;"
+                ),
+                result_ids=[int(v.result_id) for v in measurements],
+                datetimes=[v.value_datetime for v in measurements],
+                utc_offsets=[timedelta(hours=int(v.utc_offset)) for v in measurements],
+                data_values=[float(v.data_value) for v in measurements],
+            )
+        connection.execute(
+            text(
+                "UPDATE odm2.results AS r "
+                "SET valuecount = r.valuecount + v.num_measurements, "
+                "resultdatetime = GREATEST(v.result_datetime, r.resultdatetime) "
+                "FROM unnest(CAST(:result_ids AS bigint[]), CAST(:datetimes AS timestamp[]), "
+                "CAST(:counts AS integer[])) AS v(result_id, result_datetime, num_measurements) "
+                "WHERE r.resultid = v.result_id;"
+            ),
+            result_ids=[int(v.result_id) for v in latest_values],
+            datetimes=[v.value_datetime for v in latest_values],
+            counts=[self.value_counts.get(v.result_id, 0) for v in latest_values],
+        )
+
+
+class ResultSummaryWriteBehind:
+    """
+    Collects summary deltas from every request of this process and applies them
+    from a background thread every `window` seconds. Deltas of a failed flush are
+    kept for the next one; deltas still pending when the process dies are lost,
+    so the summaries can lag the result values until the next post for that result.
+    """
+
+    def __init__(self, engine, window: float) -> None:
+        self.engine = engine
+        self.window = window
+        self._lock = threading.Lock()
+        self._pending = ResultSummaryDeltas()
+        self._thread = None
+
+    def add(self, deltas: ResultSummaryDeltas) -> None:
+        with self._lock:
+            self._pending.update(deltas)
+            if self._thread is None:
+                # started lazily so only processes that ingest data run a flusher
+                self._thread = threading.Thread(
+                    target=self._run, name="result-summary-write-behind", daemon=True
+                )
+                self._thread.start()
+
+    def flush(self) -> None:
+        with self._lock:
+            deltas, self._pending = self._pending, ResultSummaryDeltas()
+        if not deltas:
+            return
+        try:
+            with self.engine.begin() as connection:
+                deltas.write(connection)
+        except Exception:
+            with self._lock:
+                deltas.update(self._pending)
+                self._pending = deltas
+            raise
+
+    def _run(self) -> None:
+        while True:
+            time.sleep(self.window)
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Failed to write result summaries, retrying next window")
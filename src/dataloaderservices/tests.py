@@ -0,0 +1,1945 @@
+import fcntl
+import gzip
+import hashlib
+import io
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+import zipfile
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+from unittest import mock, skipIf
+
+import numpy as np
+import pandas as pd
+import sqlalchemy
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.http import QueryDict
+from django.test import (
+    SimpleTestCase,
+    TestCase,
+    TransactionTestCase,
+    override_settings,
+)
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework import exceptions
+from rest_framework.test import APIRequestFactory, force_authenticate
+from sqlalchemy.pool import StaticPool
+from sqlalchemy.sql import text
+
+from dataloader.models import (
+    Action,
+    ActionType,
+    AggregationStatistic,
+    CensorCode,
+    FeatureAction,
+    Medium,
+    Method,
+    MethodType,
+    Organization,
+    OrganizationType,
+    ProcessingLevel,
+    QualityCode,
+    Result,
+    ResultType,
+    SamplingFeature,
+    SamplingFeatureType,
+    Site,
+    SiteType,
+    SpatialReference,
+    Status,
+    TimeSeriesResult,
+    TimeSeriesResultValue,
+    Unit,
+    UnitsType,
+    Variable,
+    VariableName,
+    VariableType,
+)
+from dataloaderinterface.models import SensorOutput, SiteRegistration, SiteSensor
+from dataloaderservices import cache, columnar, metrics, spool, throttling, upload_jobs, views
+from dataloaderservices.bundle import spooled_member, stream_zip
+from dataloaderservices.cache import (
+    TTLCache,
+    registration_cache,
+    result_uuid_cache,
+    unit_cache,
+)
+from dataloaderservices.conditional import export_validators
+from dataloaderservices.coverage import ResultCoverage, drop_existing_values
+from dataloaderservices.export import Aggregation, iter_data_rows, merge_result_values
+from dataloaderservices.export_cache import ExportCache
+from dataloaderservices.management.commands import flush_data_stream_spool
+from dataloaderservices.management.commands.benchmark_csv_export import (
+    pivot_data_values,
+)
+from dataloaderservices.metadata import MetadataRecords, build_csv_metadata
+from dataloaderservices.metrics import MetricsRegistry, RequestTimer
+from dataloaderservices.netcdf import stream_netcdf, variable_names
+from dataloaderservices.parsers import (
+    DataStreamMessagePackParser,
+    GzipJSONParser,
+    msgpack,
+)
+from dataloaderservices.payloads import columnar_data_stream_payload
+from dataloaderservices.spool import DataStreamSpool
+from dataloaderservices.summary import ResultSummaryDeltas
+from dataloaderservices.throttling import RegistrationTokenThrottle
+from dataloaderservices.timestamps import parse_timestamp, parse_timestamps
+from dataloaderservices.uploads import SensorDataFileParser
+from dataloaderservices.upload_jobs import UploadJob
+from dataloaderservices.writer import (
+    PartitionWriteError,
+    WriteResult,
+    partition_by_result,
+    result_values_columns,
+    write_partitioned,
+    write_result_values,
+)
+
+try:
+    from scipy.io import netcdf_file
+except ImportError:
+    netcdf_file = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+
+def controlled_term(model, name):
+    return model.objects.create(term=name.lower(), name=name)
+
+
+def database_engine():
+    """An engine on the test database, for the views that bypass the Django connection."""
+    settings_dict = connection.settings_dict
+    url = sqlalchemy.engine.URL.create(
+        "postgresql",
+        username=settings_dict["USER"],
+        password=settings_dict["PASSWORD"] or None,
+        host=settings_dict["HOST"],
+        port=settings_dict["PORT"] or None,
+        database=settings_dict["NAME"],
+    )
+    return sqlalchemy.create_engine(url, connect_args=settings_dict["OPTIONS"])
+
+
+def match_odm2_schema():
+    """
+    Aligns the result values table Django built with the ODM2 database, which the raw
+    SQL relies on: naive datetimes and one value per result and datetime.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "ALTER TABLE odm2.timeseriesresultvalues "
+            "ALTER COLUMN valuedatetime TYPE timestamp;"
+            "ALTER TABLE odm2.results ALTER COLUMN resultdatetime TYPE timestamp;"
+            "CREATE UNIQUE INDEX IF NOT EXISTS timeseriesresultvalues_resultid_datetime "
+            "ON odm2.timeseriesresultvalues (resultid, valuedatetime);"
+        )
+
+
+class SiteFixtureMixin:
+    """
+    A site with time series results, created row by row. The registration and its
+    sensors are bulk created, as their signal receivers would create the ODM2 rows a
+    second time (and rely on columns being nullable in the ODM2 database).
+    """
+
+    def create_site(self):
+        sampling_feature = SamplingFeature.objects.create(
+            sampling_feature_type=controlled_term(SamplingFeatureType, "Site"),
+            sampling_feature_code="RB_KF_C",
+            sampling_feature_name="Knowlton Fork Climate",
+        )
+        Site.objects.create(
+            sampling_feature=sampling_feature,
+            site_type=controlled_term(SiteType, "Stream"),
+            latitude=41.7,
+            longitude=-111.8,
+            spatial_reference=SpatialReference.objects.create(srs_name="WGS84"),
+        )
+        organization = Organization.objects.create(
+            organization_type=controlled_term(OrganizationType, "Research institute"),
+            organization_code="USU",
+            organization_name="Utah State University",
+        )
+        SiteRegistration.objects.bulk_create(
+            [
+                SiteRegistration(
+                    sampling_feature_id=sampling_feature.pk,
+                    sampling_feature_code=sampling_feature.sampling_feature_code,
+                    sampling_feature_name=sampling_feature.sampling_feature_name,
+                    organization_id=organization.pk,
+                    latitude=41.7,
+                    longitude=-111.8,
+                    site_type="Stream",
+                )
+            ]
+        )
+        self.registration = SiteRegistration.objects.get(
+            sampling_feature_id=sampling_feature.pk
+        )
+
+        method = Method.objects.create(
+            method_type=controlled_term(MethodType, "Instrument deployment"),
+            method_code="Deployment",
+            method_name="Deployment",
+        )
+        action = Action.objects.create(
+            action_type=controlled_term(ActionType, "Instrument deployment"),
+            method=method,
+            begin_datetime="2020-01-01 00:00",
+            begin_datetime_utc_offset=-7,
+        )
+        self.feature_action = FeatureAction.objects.create(
+            sampling_feature=sampling_feature, action=action
+        )
+        self.unit = Unit.objects.create(
+            unit_type=controlled_term(UnitsType, "Temperature"),
+            unit_abbreviation="degC",
+            unit_name="degree celsius",
+        )
+        self.variable_type = controlled_term(VariableType, "Climate")
+        self.variable_name = controlled_term(VariableName, "Temperature")
+        self.result_type = controlled_term(ResultType, "Time series coverage")
+        self.processing_level = ProcessingLevel.objects.create(
+            processing_level_code="Raw"
+        )
+        self.status = controlled_term(Status, "Ongoing")
+        self.medium = controlled_term(Medium, "Air")
+        self.aggregation_statistic = controlled_term(AggregationStatistic, "Continuous")
+
+    def create_series(self, count):
+        sensors = []
+        for index in range(count):
+            result = Result.objects.create(
+                feature_action=self.feature_action,
+                result_type=self.result_type,
+                variable=Variable.objects.create(
+                    variable_type=self.variable_type,
+                    variable_code="AirTemp_{}".format(index),
+                    variable_name=self.variable_name,
+                    no_data_value=-9999,
+                ),
+                unit=self.unit,
+                processing_level=self.processing_level,
+                status=self.status,
+                sampled_medium=self.medium,
+            )
+            TimeSeriesResult.objects.create(
+                result=result,
+                aggregation_statistic=self.aggregation_statistic,
+                x_location=0,
+                y_location=0,
+                z_location=0,
+                intended_time_spacing=15,
+                intended_time_spacing_unit=self.unit,
+            )
+            sensors.append(
+                SiteSensor(
+                    registration=self.registration,
+                    result_id=result.pk,
+                    result_uuid=result.result_uuid,
+                )
+            )
+        SiteSensor.objects.bulk_create(sensors)
+        return TimeSeriesResult.objects.filter(
+            result__feature_action=self.feature_action
+        ).order_by("pk")
+
+
+class TestCSVMetadata(SiteFixtureMixin, TestCase):
+    def setUp(self):
+        self.create_site()
+
+    def count_metadata_queries(self, time_series_results):
+        with CaptureQueriesContext(connection) as queries:
+            metadata = build_csv_metadata(time_series_results)
+        self.assertIn("RB_KF_C", metadata)
+        return len(queries)
+
+    def test_query_count_does_not_grow_with_series(self):
+        two_series = self.create_series(2)
+        queries_for_two = self.count_metadata_queries(two_series)
+
+        many_series = self.create_series(10)
+        self.assertEqual(many_series.count(), 12)
+        self.assertEqual(self.count_metadata_queries(many_series), queries_for_two)
+
+    def test_compact_template_lists_every_series(self):
+        metadata = build_csv_metadata(self.create_series(3))
+        for index in range(3):
+            self.assertIn("VariableCode: AirTemp_{}".format(index), metadata)
+
+
+class UploadSiteMixin(SiteFixtureMixin):
+    """
+    A site with one series, for uploads. They write their values over `views._db_engine`,
+    outside the Django connection, so the tests using it can't run in a transaction.
+    """
+
+    def create_upload_site(self):
+        match_odm2_schema()
+        self.create_site()
+        Unit.objects.create(
+            unit_type=controlled_term(UnitsType, "Time"),
+            unit_abbreviation="hh:mm",
+            unit_name="hour minute",
+        )
+        unit_cache.clear()
+        # the controlled terms every written value refers to
+        controlled_term(CensorCode, "Not censored")
+        controlled_term(QualityCode, "None")
+        self.result = self.create_series(1).get().result
+
+        engine = database_engine()
+        self.addCleanup(engine.dispose)
+        patcher = mock.patch.object(views, "_db_engine", engine)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def data_file(self, *rows):
+        lines = [
+            "Sampling Feature UUID: {}".format(
+                self.registration.sampling_feature.sampling_feature_uuid
+            ),
+            "Result UUID:,{}".format(self.result.result_uuid),
+            "Date and Time in UTC-7,AirTemp_0",
+        ] + list(rows)
+        return "".join(line + "\n" for line in lines).encode()
+
+
+class TestTTLCache(SimpleTestCase):
+    def setUp(self):
+        self.now = 0.0
+        clock = SimpleNamespace(monotonic=lambda: self.now)
+        patcher = mock.patch.object(cache, "time", clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_entries_expire_after_the_ttl(self):
+        entries = TTLCache("test", maxsize=10, ttl=60)
+        entries.set("token", 1)
+        self.now = 59.9
+        self.assertEqual(entries.get("token"), 1)
+        self.now = 60
+        self.assertIsNone(entries.get("token"))
+        self.assertEqual(
+            entries.stats(), {"size": 0, "maxsize": 10, "ttl": 60, "hits": 1, "misses": 1}
+        )
+
+    def test_setting_an_entry_again_restarts_its_ttl(self):
+        entries = TTLCache("test", maxsize=10, ttl=60)
+        entries.set("token", 1)
+        self.now = 50
+        entries.set("token", 2)
+        self.now = 100
+        self.assertEqual(entries.get("token"), 2)
+
+    def test_least_recently_used_entry_is_evicted(self):
+        entries = TTLCache("test", maxsize=2, ttl=60)
+        entries.set("a", 1)
+        entries.set("b", 2)
+        entries.get("a")
+        entries.set("c", 3)
+        self.assertEqual(
+            [entries.get(key, "missing") for key in "abc"], [1, "missing", 3]
+        )
+
+    def test_invalidate_and_clear(self):
+        entries = TTLCache("test", maxsize=10, ttl=60)
+        entries.set("a", 1)
+        entries.set("b", 2)
+        entries.invalidate("a")
+        entries.invalidate("unknown")
+        self.assertIsNone(entries.get("a"))
+        self.assertEqual(entries.get("b"), 2)
+        entries.clear()
+        self.assertEqual(entries.stats()["size"], 0)
+
+
+class TestCacheInvalidation(SiteFixtureMixin, TestCase):
+    """The signal receivers drop the cached lookups of a site when it changes."""
+
+    def setUp(self):
+        self.create_site()
+        self.create_series(1)
+        self.sensor = SiteSensor.objects.get()
+        self.token = str(self.registration.registration_token)
+        self.sampling_feature_id = self.registration.sampling_feature_id
+
+        registration_cache.set(self.token, {"sampling_feature_id": self.sampling_feature_id})
+        result_uuid_cache.set(
+            self.sampling_feature_id, {str(self.sensor.result_uuid): self.sensor.result_id}
+        )
+        self.addCleanup(registration_cache.clear)
+        self.addCleanup(result_uuid_cache.clear)
+
+    def assertCached(self, registration, result_uuids):
+        self.assertEqual(registration_cache.get(self.token) is not None, registration)
+        self.assertEqual(
+            result_uuid_cache.get(self.sampling_feature_id) is not None, result_uuids
+        )
+
+    def test_registration_saved(self):
+        self.registration.sampling_feature_name = "Knowlton Fork"
+        self.registration.save()
+        self.assertCached(registration=False, result_uuids=False)
+
+    def test_sensor_saved(self):
+        result = self.sensor.result
+        self.sensor.sensor_output = SensorOutput.objects.create(
+            instrument_output_variable_id=1,
+            model_id=1,
+            model_name="5TM",
+            model_manufacturer="METER",
+            variable_id=result.variable_id,
+            variable_name="Temperature",
+            variable_code=result.variable.variable_code,
+            unit_id=result.unit_id,
+            unit_name="degree celsius",
+            unit_abbreviation="degC",
+            sampled_medium="Air",
+        )
+        self.sensor.height = 2.0
+        self.sensor.save()
+        self.assertCached(registration=True, result_uuids=False)
+        self.assertEqual(TimeSeriesResult.objects.get(pk=result.pk).z_location, 2.0)
+
+    def test_sensor_deleted(self):
+        self.sensor.delete()
+        self.assertCached(registration=True, result_uuids=False)
+
+
+class TestUploadValidators(UploadSiteMixin, TransactionTestCase):
+    def setUp(self):
+        self.create_upload_site()
+
+    def upload(self, *rows):
+        return views.import_sensor_data_file(
+            self.registration, io.BytesIO(self.data_file(*rows)), RequestTimer("upload")
+        )
+
+    def validators(self):
+        return export_validators([self.result.pk], QueryDict("format=csv"))
+
+    def test_upload_changes_the_etag(self):
+        self.upload("2021-06-01 10:00:00,20.5", "2021-06-01 10:15:00,21")
+        etag, last_modified = self.validators()
+
+        _, written = self.upload("2021-06-01 10:15:00,21", "2021-06-01 10:30:00,21.5")
+        self.assertEqual(written.inserted_count, 1)
+        new_etag, new_last_modified = self.validators()
+        self.assertNotEqual(new_etag, etag)
+        self.assertEqual(new_last_modified - last_modified, 15 * 60)
+
+        result = Result.objects.get(pk=self.result.pk)
+        self.assertEqual(result.value_count, 3)
+        self.assertEqual(result.result_datetime, datetime(2021, 6, 1, 17, 30))
+        measurement = self.registration.sensors.get().last_measurement
+        self.assertEqual(measurement.data_value, 21.5)
+
+    def test_reupload_keeps_the_etag(self):
+        rows = ("2021-06-01 10:00:00,20.5", "2021-06-01 10:15:00,21")
+        self.upload(*rows)
+        validators = self.validators()
+
+        _, written = self.upload(*rows)
+        self.assertEqual(written.inserted_count, 0)
+        self.assertEqual(self.validators(), validators)
+
+
+class TestWriteResultValues(UploadSiteMixin, TransactionTestCase):
+    def setUp(self):
+        self.create_upload_site()
+        self.create_series(1)
+        self.first, self.second = TimeSeriesResult.objects.order_by("pk").values_list(
+            "pk", flat=True
+        )
+
+    def values(self, result_id, hours):
+        return result_values_columns(
+            [result_id] * len(hours),
+            np.array(hours, dtype=float),
+            [datetime(2021, 6, 1) + timedelta(hours=hour) for hour in hours],
+            [-7] * len(hours),
+            views.get_unit_id("hour minute"),
+        )
+
+    def write(self, copy_threshold, *frames):
+        with views._db_engine.begin() as connection:
+            return write_result_values(pd.concat(frames), connection, copy_threshold)
+
+    def check_overlapping_writes(self, copy_threshold):
+        self.write(
+            copy_threshold, self.values(self.first, [0, 1, 2]), self.values(self.second, [0, 1])
+        )
+        # hour 5 twice in the same batch, and everything of the second result again
+        written = self.write(
+            copy_threshold,
+            self.values(self.first, [1, 2, 3, 4, 5, 5]),
+            self.values(self.second, [0, 1]),
+        )
+        self.assertEqual(written.total, 8)
+        self.assertEqual(written.inserted, {self.first: 3})
+        self.assertEqual(written.conflicting_count, 5)
+        self.assertEqual(
+            list(
+                TimeSeriesResultValue.objects.filter(result_id=self.first).values_list(
+                    "data_value", flat=True
+                )
+            ),
+            [0, 1, 2, 3, 4, 5],
+        )
+
+    def test_insert(self):
+        self.check_overlapping_writes(copy_threshold=100)
+
+    def test_copy_through_a_temporary_table(self):
+        self.check_overlapping_writes(copy_threshold=0)
+
+    def test_several_copies_in_one_transaction(self):
+        with views._db_engine.begin() as connection:
+            for hours in ([0, 1], [1, 2]):
+                written = write_result_values(self.values(self.first, hours), connection, 0)
+        self.assertEqual(written.inserted, {self.first: 1})
+        self.assertEqual(TimeSeriesResultValue.objects.count(), 3)
+
+
+class TestAggregatedExport(UploadSiteMixin, TransactionTestCase):
+    aggregation = Aggregation("day", ["mean", "count"])
+
+    def setUp(self):
+        self.create_upload_site()
+        self.create_series(1)
+        self.first, self.second = TimeSeriesResult.objects.order_by("pk").values_list(
+            "pk", flat=True
+        )
+        unit_id = views.get_unit_id("hour minute")
+        # UTC-7: hours 0 to 6 are in the local day of May 31, 7 to 10 in June 1
+        hours = list(range(11))
+        data_values = [float(hour) for hour in hours[:-1]] + [-9999.0]  # no data at 10
+        with views._db_engine.begin() as connection:
+            write_result_values(
+                pd.concat(
+                    [
+                        result_values_columns(
+                            [self.first] * len(hours),
+                            np.array(data_values),
+                            [datetime(2021, 6, 1) + timedelta(hours=hour) for hour in hours],
+                            [-7] * len(hours),
+                            unit_id,
+                        ),
+                        result_values_columns(
+                            [self.second], np.array([100.0]), [datetime(2021, 6, 1, 8)], [-7], unit_id
+                        ),
+                    ]
+                ),
+                connection,
+            )
+        patcher = mock.patch.object(views, "_export_engine", views._db_engine)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_statistics_per_local_day(self):
+        rows = list(
+            iter_data_rows(
+                views._db_engine, [self.first, self.second], typed=True, aggregation=self.aggregation
+            )
+        )
+        # each interval is labelled with the UTC datetime of its local start
+        self.assertEqual(
+            [row[:3] for row in rows],
+            [
+                [datetime(2021, 5, 31, 7), -7, datetime(2021, 5, 31)],
+                [datetime(2021, 6, 1, 7), -7, datetime(2021, 6, 1)],
+            ],
+        )
+        self.assertEqual(rows[0][3:5], [3.0, 7])
+        self.assertTrue(np.isnan(rows[0][5]) and np.isnan(rows[0][6]))
+        # the no-data value is left out of the statistics
+        self.assertEqual(rows[1][3:], [8.0, 3, 100.0, 1])
+
+    def test_local_window_applies_to_the_values(self):
+        rows = list(
+            iter_data_rows(
+                views._db_engine,
+                [self.first],
+                max_datetime=datetime(2021, 5, 31, 20),
+                typed=True,
+                aggregation=self.aggregation,
+            )
+        )
+        self.assertEqual(rows, [[datetime(2021, 5, 31, 7), -7, datetime(2021, 5, 31), 1.5, 4]])
+
+    def download(self, query):
+        request = APIRequestFactory().get(reverse("csv_data_service"), query)
+        response = views.CSVDataApi.as_view()(request)
+        if response.status_code != 200:
+            return response, None
+        return response, b"".join(response.streaming_content).decode().splitlines()
+
+    def test_csv_headers(self):
+        with mock.patch.object(views, "export_cache", None):
+            response, lines = self.download(
+                {
+                    "result_ids": "{},{}".format(self.first, self.second),
+                    "aggregate": "day",
+                    "stat": "mean,count",
+                }
+            )
+        data_lines = [line for line in lines if not line.startswith("#")]
+        # both series measure AirTemp_0, told apart as the plain download does
+        self.assertEqual(
+            data_lines[0],
+            "DateTimeUTC,UTCOffset,DateTimeLocalized,"
+            "AirTemp_0-1_mean,AirTemp_0-1_count,AirTemp_0-2_mean,AirTemp_0-2_count",
+        )
+        self.assertEqual(
+            data_lines[2], "2021-06-01 07:00:00,-7,2021-06-01 00:00:00,8.0,3,100.0,1"
+        )
+        self.assertEqual(len(data_lines), 3)
+
+    def test_invalid_aggregation(self):
+        for query, message in (
+            ({"stat": "mean"}, "stat requires an aggregate interval."),
+            ({"aggregate": "month"}, "aggregate must be one of: hour, day, week."),
+            ({"aggregate": "day", "stat": "mean,mean"}, "stat must be a list of distinct"),
+            ({"aggregate": "day", "stat": "median"}, "stat must be a list of distinct"),
+        ):
+            response, _ = self.download(dict(query, result_ids=str(self.first)))
+            self.assertEqual(response.status_code, 400)
+            self.assertTrue(str(response.data["message"]).startswith(message), response.data)
+
+
+class TestDropExistingValues(UploadSiteMixin, TransactionTestCase):
+    def setUp(self):
+        self.create_upload_site()
+        self.create_series(1)
+        self.first, self.second = TimeSeriesResult.objects.order_by("pk").values_list(
+            "pk", flat=True
+        )
+
+    def values(self, result_id, minutes):
+        return result_values_columns(
+            [result_id] * len(minutes),
+            np.zeros(len(minutes)),
+            [datetime(2021, 6, 1) + timedelta(minutes=minute) for minute in minutes],
+            [-7] * len(minutes),
+            views.get_unit_id("hour minute"),
+        )
+
+    def drop_existing(self, result_values):
+        with views._db_engine.begin() as connection:
+            coverage = ResultCoverage.load(connection, [self.first, self.second])
+            return drop_existing_values(result_values, connection, coverage)
+
+    def test_only_exact_matches_are_dropped(self):
+        with views._db_engine.begin() as connection:
+            write_result_values(self.values(self.first, range(0, 121, 15)), connection)
+
+        # the logger switched to 5 minute intervals in the covered hours, and the
+        # second result has no values at all
+        upload = pd.concat(
+            [self.values(self.first, range(0, 181, 5)), self.values(self.second, [0, 15])]
+        )
+        remaining, present = self.drop_existing(upload)
+        self.assertEqual(present.total, 9)
+        self.assertEqual(present.inserted, {})
+        self.assertEqual(len(remaining), len(upload) - 9)
+        first_minutes = (
+            remaining[remaining["result_id"] == self.first]["value_datetime"]
+            - datetime(2021, 6, 1)
+        ) // timedelta(minutes=1)
+        self.assertEqual(
+            first_minutes.tolist(),
+            [minute for minute in range(0, 181, 5) if minute % 15 or minute > 120],
+        )
+        self.assertEqual((remaining["result_id"] == self.second).sum(), 2)
+
+    def test_values_in_a_gap_are_not_covered(self):
+        day = 24 * 60
+        with views._db_engine.begin() as connection:
+            write_result_values(self.values(self.first, [0, 15, 3 * day]), connection)
+            coverage = ResultCoverage.load(connection, [self.first])
+        minutes = [0, 15, 30, day, 3 * day]
+        upload = self.values(self.first, minutes)
+        covered = coverage.covered(
+            upload["result_id"].to_numpy(), upload["value_datetime"].to_numpy()
+        )
+        self.assertEqual(covered.tolist(), [True, True, False, False, True])
+
+        remaining, present = self.drop_existing(upload)
+        self.assertEqual(present.total, 3)
+        self.assertEqual(len(remaining), 2)
+
+    def test_nothing_stored_yet(self):
+        upload = self.values(self.first, [0, 15])
+        remaining, present = self.drop_existing(upload)
+        self.assertIs(remaining, upload)
+        self.assertEqual(present.total, 0)
+
+
+class TestParseTimestamps(SimpleTestCase):
+    valid_timestamps = [
+        "2020-01-01T00:00:00Z",
+        "2020-01-01T00:00:00-05:00",
+        "2020-01-01 12:30:15.5+0130",
+        "2020-01-01T00:00:00+05:30",
+        "2020-01-01T00:00:00-00:30",
+        # local time past what pandas represents, the UTC time is not
+        "2262-04-12T01:00:00+05:00",
+    ]
+    invalid_timestamps = [
+        "2020-02-30T00:00:00Z",
+        "2020-01-01T24:00:00Z",
+        "2020-01-01T00:00:00+25:00",
+        "2020-01-01T00:00:00",
+        "not a timestamp",
+        5,
+        None,
+    ]
+    out_of_range_timestamps = [
+        "3000-01-01T00:00:00Z",
+        "1500-01-01T00:00:00+00:00",
+        "0001-01-01T00:00:00+05:00",
+        "9999-12-31T23:00:00-05:00",
+        "2262-04-11T23:00:00-05:00",
+        "1677-09-21T00:30:00+01:00",
+    ]
+
+    def scalar_error(self, timestamp):
+        with self.assertRaises(exceptions.ParseError) as raised:
+            parse_timestamp(timestamp)
+        return raised.exception.detail
+
+    def columnar_error(self, timestamps):
+        with self.assertRaises(exceptions.ParseError) as raised:
+            parse_timestamps(timestamps)
+        return raised.exception.detail
+
+    def test_matches_scalar_parse(self):
+        utc_datetimes, utc_offsets, latest = parse_timestamps(self.valid_timestamps)
+        expected = [parse_timestamp(timestamp) for timestamp in self.valid_timestamps]
+        self.assertEqual(utc_datetimes.dtype, np.dtype("datetime64[us]"))
+        self.assertEqual(list(utc_datetimes), [p[0] for p in expected])
+        self.assertEqual(list(utc_offsets), [p[1] for p in expected])
+        self.assertEqual(latest, 5)
+
+    def test_same_errors_as_scalar_parse(self):
+        for timestamp in self.invalid_timestamps + self.out_of_range_timestamps:
+            with self.subTest(timestamp=timestamp):
+                self.assertEqual(
+                    self.columnar_error(self.valid_timestamps + [timestamp]),
+                    self.scalar_error(timestamp),
+                )
+
+    def test_out_of_range_is_a_parse_error(self):
+        for timestamp in self.out_of_range_timestamps:
+            with self.subTest(timestamp=timestamp):
+                self.assertEqual(
+                    self.scalar_error(timestamp), "The timestamp value is out of range."
+                )
+
+    def test_reports_first_bad_timestamp(self):
+        self.assertEqual(
+            self.columnar_error(["3000-01-01T00:00:00Z", "not a timestamp"]),
+            "The timestamp value is out of range.",
+        )
+        self.assertEqual(
+            self.columnar_error(["not a timestamp", "3000-01-01T00:00:00Z"]),
+            "The timestamp value is not well formatted.",
+        )
+
+    def test_empty(self):
+        utc_datetimes, utc_offsets, latest = parse_timestamps([])
+        self.assertEqual(len(utc_datetimes), 0)
+        self.assertIsNone(latest)
+
+
+@skipIf(netcdf_file is None, "scipy is not installed")
+class TestNetCDFExport(SimpleTestCase):
+    def metadata_records(self, variable_codes):
+        sampling_feature = SimpleNamespace(
+            sampling_feature_code="RB_KF_C",
+            sampling_feature_name="Knowlton Fork Climate",
+            elevation_m=2100.5,
+            site=SimpleNamespace(latitude=41.7, longitude=-111.8),
+        )
+        time_series_results = [
+            SimpleNamespace(
+                z_location=index + 0.5,
+                z_location_unit=SimpleNamespace(unit_abbreviation="m"),
+                result=SimpleNamespace(
+                    result_id=100 + index,
+                    result_uuid=uuid.uuid4(),
+                    sampled_medium_id="Air",
+                    variable=SimpleNamespace(
+                        variable_code=variable_code, variable_name_id="Temperature"
+                    ),
+                    unit=SimpleNamespace(
+                        unit_abbreviation="degC", unit_name="degree celsius"
+                    ),
+                ),
+            )
+            for index, variable_code in enumerate(variable_codes)
+        ]
+        return MetadataRecords(
+            time_series_results=time_series_results,
+            sensors=[],
+            registration=SimpleNamespace(sampling_feature_code="RB_KF_C"),
+            sampling_feature=sampling_feature,
+            organization=SimpleNamespace(organization_name="Utah State University"),
+        )
+
+    def read_back(self, headers, rows, records, aggregation=None):
+        data = b"".join(stream_netcdf("# metadata", headers, rows, records, aggregation))
+        return netcdf_file(io.BytesIO(data), mmap=False)
+
+    def test_round_trip(self):
+        records = self.metadata_records(["AirTemp", "time"])
+        headers = ["DateTimeUTC", "UTCOffset", "DateTimeLocalized", "AirTemp", "time"]
+        rows = [
+            [datetime(2020, 1, 1, 7), -7, datetime(2020, 1, 1), 1.5, float("nan")],
+            [datetime(2020, 1, 1, 8), -7, datetime(2020, 1, 1, 1), 2.5, 3.0],
+        ]
+        with self.read_back(headers, rows, records) as dataset:
+            self.assertEqual(dataset.Conventions, b"CF-1.8")
+            self.assertEqual(dataset.odm2_metadata, b"# metadata")
+            self.assertEqual(dataset.variables["station_id"][:].tobytes(), b"RB_KF_C")
+            self.assertEqual(dataset.variables["lat"].getValue(), 41.7)
+            self.assertEqual(dataset.variables["alt"].getValue(), 2100.5)
+            self.assertEqual(
+                list(dataset.variables["time"][:]), [1577862000.0, 1577865600.0]
+            )
+            self.assertEqual(list(dataset.variables["utc_offset"][:]), [-7, -7])
+            self.assertEqual(list(dataset.variables["AirTemp"][:]), [1.5, 2.5])
+            self.assertEqual(dataset.variables["AirTemp"].units, b"degC")
+            self.assertEqual(dataset.variables["AirTemp"].result_id, 100)
+            self.assertEqual(dataset.variables["AirTemp_z"].getValue(), 0.5)
+            # a column named like a coordinate variable is renamed
+            values = dataset.variables["time_values"][:]
+            self.assertTrue(np.isnan(values[0]))
+            self.assertEqual(values[1], 3.0)
+            self.assertEqual(dataset.variables["time_values_z"].getValue(), 1.5)
+
+    def test_aggregated_cell_methods(self):
+        records = self.metadata_records(["AirTemp"])
+        headers = ["DateTimeUTC", "UTCOffset", "DateTimeLocalized"]
+        headers += ["AirTemp_mean", "AirTemp_count"]
+        rows = [[datetime(2020, 1, 1, 7), -7, datetime(2020, 1, 1), 1.5, 4.0]]
+        aggregation = Aggregation("day", ["mean", "count"])
+        with self.read_back(headers, rows, records, aggregation) as dataset:
+            self.assertEqual(
+                dataset.variables["AirTemp_mean"].cell_methods,
+                b"time: mean (interval: 1 day)",
+            )
+            self.assertEqual(dataset.variables["AirTemp_count"].units, b"1")
+            self.assertEqual(list(dataset.variables["AirTemp_count"][:]), [4.0])
+
+    def test_unique_names(self):
+        self.assertEqual(
+            variable_names(["a b", "a_b", "a_z", "a", "lat"]),
+            ["a_b", "a_b-1", "a_z", "a-1", "lat_values"],
+        )
+        records = self.metadata_records(["a b", "a_b", "a_z", "a"])
+        headers = ["DateTimeUTC", "UTCOffset", "DateTimeLocalized"]
+        headers += ["a b", "a_b", "a_z", "a"]
+        rows = [[datetime(2020, 1, 1, 7), -7, datetime(2020, 1, 1), 1.0, 2.0, 3.0, 4.0]]
+        with self.read_back(headers, rows, records) as dataset:
+            for name, value in (("a_b", 1.0), ("a_b-1", 2.0), ("a_z", 3.0), ("a-1", 4.0)):
+                self.assertEqual(list(dataset.variables[name][:]), [value])
+            self.assertEqual(dataset.variables["a_z_z"].getValue(), 2.5)
+
+    def test_sensor_without_height(self):
+        records = self.metadata_records(["AirTemp", "RH"])
+        records.time_series_results[0].z_location = None
+        headers = ["DateTimeUTC", "UTCOffset", "DateTimeLocalized", "AirTemp", "RH"]
+        rows = [[datetime(2020, 1, 1, 7), -7, datetime(2020, 1, 1), 1.5, 80.0]]
+        with self.read_back(headers, rows, records) as dataset:
+            self.assertNotIn("AirTemp_z", dataset.variables)
+            self.assertEqual(dataset.variables["AirTemp"].coordinates, b"time lat lon alt")
+            self.assertEqual(list(dataset.variables["AirTemp"][:]), [1.5])
+            self.assertEqual(
+                dataset.variables["RH"].coordinates, b"time lat lon alt RH_z"
+            )
+
+
+@skipIf(not columnar.available, "pyarrow is not installed")
+class TestColumnarExport(SimpleTestCase):
+    headers = ["DateTime", "UTCOffset", "DateTimeLocal", "AirTemp_0", "RH_1"]
+    rows = [
+        [datetime(2021, 6, 1, 17, minute), -7, datetime(2021, 6, 1, 10, minute), value, 50.0]
+        for minute, value in ((0, 20.5), (15, float("nan")), (30, 21.5))
+    ]
+
+    def setUp(self):
+        # a batch of two rows, so the rows span several of them
+        patcher = mock.patch.object(columnar, "ROW_GROUP_ROWS", 2)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def assertRoundTrip(self, table):
+        self.assertEqual(table.schema.names, self.headers)
+        self.assertEqual(table.schema.field("DateTime").type, pa.timestamp("us"))
+        self.assertEqual(table.schema.field("UTCOffset").type, pa.int16())
+        self.assertEqual(table.schema.field("AirTemp_0").type, pa.float64())
+        self.assertEqual(table.schema.metadata[b"odm2_metadata"], b"# metadata")
+        self.assertEqual(
+            table.to_pydict(),
+            {
+                "DateTime": [row[0] for row in self.rows],
+                "UTCOffset": [-7, -7, -7],
+                "DateTimeLocal": [row[2] for row in self.rows],
+                # the nan placeholder of a missing value is a null
+                "AirTemp_0": [20.5, None, 21.5],
+                "RH_1": [50.0, 50.0, 50.0],
+            },
+        )
+
+    def test_parquet_round_trip(self):
+        chunks = list(columnar.stream_parquet("# metadata", self.headers, iter(self.rows)))
+        parquet_file = pq.ParquetFile(io.BytesIO(b"".join(chunks)))
+        self.assertEqual(parquet_file.metadata.num_row_groups, 2)
+        self.assertRoundTrip(parquet_file.read())
+
+    def test_arrow_round_trip(self):
+        chunks = list(columnar.stream_arrow("# metadata", self.headers, iter(self.rows)))
+        reader = pa.ipc.open_stream(io.BytesIO(b"".join(chunks)))
+        batches = list(reader)
+        self.assertEqual([batch.num_rows for batch in batches], [2, 1])
+        self.assertRoundTrip(pa.Table.from_batches(batches))
+
+    def test_no_rows(self):
+        chunks = list(columnar.stream_parquet("# metadata", self.headers, iter([])))
+        table = pq.read_table(io.BytesIO(b"".join(chunks)))
+        self.assertEqual(table.num_rows, 0)
+        self.assertEqual(table.schema.names, self.headers)
+
+
+class TestMergeResultValues(SimpleTestCase):
+    start = datetime(2020, 1, 1)
+
+    def series(self, steps, utc_offset=-5, skip=()):
+        return [
+            (self.start + timedelta(minutes=15 * step), utc_offset, float(step))
+            for step in range(steps)
+            if step not in skip
+        ]
+
+    def pivoted(self, series, max_datetime=None, min_datetime=None):
+        frame = pd.DataFrame(
+            [
+                (result_id, value, value_datetime, utc_offset)
+                for result_id, values in enumerate(series)
+                for value_datetime, utc_offset, value in values
+            ],
+            columns=["resultid", "datavalue", "valuedatetime", "valuedatetimeutcoffset"],
+        )
+        return pivot_data_values(frame, max_datetime, min_datetime)
+
+    def assertSameRows(self, merged, pivoted):
+        self.assertEqual(len(merged), len(pivoted))
+        for merged_row, pivoted_row in zip(merged, pivoted):
+            self.assertEqual(merged_row[:3], pivoted_row[:3])
+            np.testing.assert_array_equal(
+                np.asarray(merged_row[3:], dtype=float),
+                np.asarray(pivoted_row[3:], dtype=float),
+            )
+
+    def test_gaps_in_one_series(self):
+        series = [self.series(8), self.series(8, skip={2, 3, 6})]
+        merged = list(merge_result_values(series))
+        self.assertSameRows(merged, self.pivoted(series))
+        self.assertEqual(len(merged), 8)
+        self.assertTrue(np.isnan(merged[2][4]))
+        self.assertEqual(merged[4][3:], [4.0, 4.0])
+
+    def test_different_offsets_at_the_same_utc_datetime(self):
+        series = [self.series(2, utc_offset=-5), self.series(2, utc_offset=-4)]
+        merged = list(merge_result_values(series))
+        self.assertSameRows(merged, self.pivoted(series))
+        # one row per (UTC datetime, UTC offset), offsets in numeric order
+        self.assertEqual([row[1] for row in merged], ["-5", "-4", "-5", "-4"])
+        self.assertEqual(merged[0][2], "2019-12-31 19:00:00")
+        self.assertEqual(merged[1][2], "2019-12-31 20:00:00")
+        # each row only has the value of the series with its offset
+        self.assertEqual(merged[0][3], 0.0)
+        self.assertTrue(np.isnan(merged[0][4]) and np.isnan(merged[1][3]))
+        self.assertEqual(merged[1][4], 0.0)
+
+    def test_duplicate_timestamps(self):
+        duplicated = self.series(3)
+        duplicated.insert(2, (duplicated[1][0], duplicated[1][1], 10.0))
+        merged = list(merge_result_values([duplicated, self.series(3)]))
+        # values sharing a timestamp are never averaged, the last one read is kept
+        self.assertEqual([row[3] for row in merged], [0.0, 10.0, 2.0])
+        self.assertEqual([row[4] for row in merged], [0.0, 1.0, 2.0])
+
+    def test_local_window_edges(self):
+        series = [self.series(12), self.series(12, utc_offset=-4)]
+        # local times from 2019-12-31 19:00 (-5) and 20:00 (-4), every 15 minutes
+        min_datetime = datetime(2019, 12, 31, 20, 0)
+        max_datetime = datetime(2019, 12, 31, 21, 0)
+        merged = list(merge_result_values(series, max_datetime, min_datetime))
+        self.assertSameRows(merged, self.pivoted(series, max_datetime, min_datetime))
+        local_datetimes = [row[2] for row in merged]
+        # both edges are included, in local time whatever the UTC datetime
+        self.assertEqual(local_datetimes[0], "2019-12-31 20:00:00")
+        self.assertEqual(local_datetimes[-1], "2019-12-31 21:00:00")
+        self.assertEqual(len(merged), 10)
+
+    def test_result_without_values_keeps_its_column(self):
+        series = [self.series(2), [], self.series(2, skip={0})]
+        merged = list(merge_result_values(series))
+        self.assertEqual(len(merged[0]), 6)
+        self.assertEqual(merged[0][3], 0.0)
+        self.assertTrue(np.isnan(merged[0][4]) and np.isnan(merged[0][5]))
+        self.assertEqual(merged[1][3], 1.0)
+        self.assertTrue(np.isnan(merged[1][4]))
+        self.assertEqual(merged[1][5], 1.0)
+
+    def test_typed_rows(self):
+        merged = list(merge_result_values([self.series(1)], typed=True))
+        self.assertEqual(
+            merged, [[self.start, -5, self.start - timedelta(hours=5), 0.0]]
+        )
+
+
+class TestExportCache(SimpleTestCase):
+    """The cache's queries are plain SQL, run here on SQLite with an attached odm2 schema."""
+
+    start = datetime(2020, 1, 1)
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        self.export_cache = ExportCache(self.directory)
+        self.cache = self.export_cache.result(100)
+
+        engine = sqlalchemy.create_engine(
+            "sqlite://",
+            poolclass=StaticPool,
+            connect_args={"detect_types": sqlite3.PARSE_DECLTYPES},
+        )
+        self.connection = engine.connect()
+        self.addCleanup(self.connection.close)
+        self.connection.exec_driver_sql("ATTACH DATABASE ':memory:' AS odm2")
+        self.connection.exec_driver_sql(
+            "CREATE TABLE odm2.timeseriesresultvalues (resultid INTEGER, "
+            "valuedatetime TIMESTAMP, valuedatetimeutcoffset INTEGER, datavalue REAL)"
+        )
+
+    def insert(self, hours, result_id=100):
+        self.connection.execute(
+            text(
+                "INSERT INTO odm2.timeseriesresultvalues VALUES "
+                "(:result_id, :value_datetime, -5, :data_value)"
+            ),
+            [
+                {
+                    "result_id": result_id,
+                    "value_datetime": self.start + timedelta(hours=hour),
+                    "data_value": float(hour),
+                }
+                for hour in hours
+            ],
+        )
+
+    def expected(self, hours):
+        return [
+            (self.start + timedelta(hours=hour), -5, float(hour))
+            for hour in sorted(hours)
+        ]
+
+    def test_first_refresh_caches_every_value(self):
+        self.insert(range(5))
+        self.insert(range(3), result_id=101)
+        self.assertEqual(self.cache.refresh(self.connection), 5)
+        self.assertEqual(list(self.cache.values()), self.expected(range(5)))
+        self.assertEqual(self.export_cache.cached_result_ids(), [100])
+
+    def test_refresh_appends_new_values(self):
+        self.insert(range(5))
+        self.cache.refresh(self.connection)
+        self.insert(range(5, 8))
+        self.assertEqual(self.cache.refresh(self.connection), 3)
+        self.assertEqual(self.cache.refresh(self.connection), 0)
+        self.assertEqual(list(self.cache.values()), self.expected(range(8)))
+
+    def test_older_values_rebuild_the_cache(self):
+        # e.g. an SD card backfill, whatever results.valuecount says yet
+        self.insert([0, 2, 4])
+        self.cache.refresh(self.connection)
+        self.insert([1, 3])
+        self.assertEqual(self.cache.refresh(self.connection), 5)
+        self.assertEqual(list(self.cache.values()), self.expected(range(5)))
+
+    def test_mapped_rows_outlive_a_rebuild(self):
+        self.insert(range(3))
+        self.cache.refresh(self.connection)
+        values = self.cache.values()
+        first = next(values)
+        self.insert([-1])
+        self.cache.refresh(self.connection)
+        self.assertEqual([first] + list(values), self.expected(range(3)))
+        self.assertEqual(list(self.cache.values()), self.expected(range(-1, 3)))
+
+    def test_interrupted_refresh_leftovers_are_dropped(self):
+        self.insert(range(3))
+        self.cache.refresh(self.connection)
+        for name in ("valuedatetime", "valuedatetimeutcoffset", "datavalue"):
+            with open(os.path.join(self.cache.directory, name), "ab") as column_file:
+                column_file.write(b"\xff" * 12)
+        self.insert([3])
+        self.cache.refresh(self.connection)
+        self.assertEqual(list(self.cache.values()), self.expected(range(4)))
+
+    def test_downloads_wait_for_a_refresh(self):
+        self.insert(range(3))
+        self.cache.refresh(self.connection)
+        values = []
+        reader = threading.Thread(target=lambda: values.extend(self.cache.values()))
+        with self.cache._locked(fcntl.LOCK_EX):
+            reader.start()
+            reader.join(0.2)
+            self.assertTrue(reader.is_alive())
+        reader.join(5)
+        self.assertEqual(values, self.expected(range(3)))
+
+    def test_remove(self):
+        self.insert(range(3))
+        self.cache.refresh(self.connection)
+        self.cache.remove()
+        self.assertEqual(self.export_cache.cached_result_ids(), [])
+        self.assertEqual(list(self.cache.values()), [])
+
+
+class TestStreamZip(SimpleTestCase):
+    @staticmethod
+    def done(member):
+        future = Future()
+        future.set_result(member)
+        return future
+
+    @staticmethod
+    def read(data):
+        with zipfile.ZipFile(io.BytesIO(data)) as bundle:
+            return {name: bundle.read(name).decode() for name in bundle.namelist()}
+
+    def test_members_in_completion_order(self):
+        first, second = Future(), Future()
+        chunks = stream_zip({first: "first", second: "second"})
+        second.set_result(spooled_member("b.csv", ["b" * 10]))
+        data = next(chunks)
+        first.set_result(spooled_member("a.csv", ["a", "a"]))
+        data += b"".join(chunks)
+        with zipfile.ZipFile(io.BytesIO(data)) as bundle:
+            self.assertEqual(bundle.namelist(), ["b.csv", "a.csv"])
+        self.assertEqual(self.read(data), {"b.csv": "b" * 10, "a.csv": "aa"})
+
+    def test_duplicate_names_and_empty_members(self):
+        futures = {
+            self.done(spooled_member("a.csv", ["1"])): "one",
+            self.done(spooled_member("a.csv", ["2"])): "two",
+            self.done(None): "nothing",
+        }
+        files = self.read(b"".join(stream_zip(futures)))
+        self.assertEqual(sorted(files), ["a-2.csv", "a.csv"])
+        self.assertEqual(sorted(files.values()), ["1", "2"])
+
+    def test_failed_members_are_listed_without_the_error(self):
+        failed = Future()
+        failed.set_exception(ValueError("password=secret at /srv/app"))
+        futures = {self.done(spooled_member("a.csv", ["1"])): "one", failed: "leaf pack 7"}
+        with self.assertLogs("dataloaderservices.bundle", "ERROR"):
+            files = self.read(b"".join(stream_zip(futures)))
+        self.assertEqual(files["a.csv"], "1")
+        self.assertIn("leaf pack 7", files["errors.txt"])
+        self.assertNotIn("secret", files["errors.txt"])
+
+    def test_disconnect_cancels_pending_members(self):
+        pending, finished = Future(), Future()
+        chunks = stream_zip(
+            {self.done(spooled_member("a.csv", ["1"])): "one", pending: "two", finished: "three"}
+        )
+        next(chunks)
+        member = spooled_member("c.csv", ["3"])
+        finished.set_result(member)
+        chunks.close()
+        self.assertTrue(pending.cancelled())
+        self.assertTrue(member.content.closed)
+
+
+class TestResultSummaryDeltas(SimpleTestCase):
+    class Connection:
+        def __init__(self):
+            self.statements = []
+
+        def execute(self, statement, **params):
+            self.statements.append((str(statement), params))
+
+    @staticmethod
+    def value(result_id, hour, data_value):
+        return SimpleNamespace(
+            result_id=result_id,
+            value_datetime=datetime(2020, 1, 1, hour),
+            utc_offset=-5,
+            data_value=data_value,
+        )
+
+    def test_one_row_per_result(self):
+        deltas = ResultSummaryDeltas()
+        deltas.add_latest([self.value(np.int64(5), 1, 1.0), self.value(5, 2, 2.0)])
+        deltas.add_counts({np.int64(5): 2})
+        deltas.add_counts({5: 1})
+        connection = self.Connection()
+        deltas.write(connection)
+        (_, measurements), (_, results) = connection.statements
+        self.assertEqual(measurements["result_ids"], [5])
+        self.assertEqual(measurements["data_values"], [2.0])
+        self.assertEqual(results["counts"], [3])
+
+    def test_missing_values_only_update_the_result(self):
+        deltas = ResultSummaryDeltas()
+        deltas.add_latest([self.value(5, 1, None), self.value(6, 1, "1.5")])
+        deltas.add_counts({5: 1, 6: 1})
+        connection = self.Connection()
+        deltas.write(connection)
+        (measurement_sql, measurements), (_, results) = connection.statements
+        self.assertIn("DISTINCT ON (s.id)", measurement_sql)
+        self.assertEqual(measurements["result_ids"], [6])
+        self.assertEqual(measurements["data_values"], [1.5])
+        self.assertEqual(results["result_ids"], [5, 6])
+
+        deltas = ResultSummaryDeltas()
+        deltas.add_latest([self.value(5, 1, None)])
+        connection = self.Connection()
+        deltas.write(connection)
+        self.assertEqual(len(connection.statements), 1)
+        self.assertIn("odm2.results", connection.statements[0][0])
+
+
+class TestDataStreamBodies(SimpleTestCase):
+    body = {
+        "sampling_feature": "site",
+        "timestamp": [1481233501, 1481233801.5],
+        "utc_offset": -7,
+        "result": [8.0, 9],
+    }
+
+    @staticmethod
+    def context(encoding=""):
+        return {"request": SimpleNamespace(META={"HTTP_CONTENT_ENCODING": encoding})}
+
+    def test_columnar_body(self):
+        payload = columnar_data_stream_payload(self.body)
+        self.assertEqual(payload.sampling_feature, "site")
+        self.assertEqual(
+            list(payload.value_datetimes),
+            [
+                np.datetime64("2016-12-08T21:45:01", "us"),
+                np.datetime64("2016-12-08T21:50:01.5", "us"),
+            ],
+        )
+        self.assertEqual(list(payload.utc_offsets), [-7, -7])
+        self.assertEqual(list(payload.measurement_data["result"]), [8.0, 9.0])
+        self.assertEqual(payload.latest_measurement_idx, 1)
+
+    def test_invalid_columnar_bodies(self):
+        for change in (
+            {"timestamp": [1e12, 1481233801]},
+            {"timestamp": [-1e10, 1481233801]},
+            {"timestamp": [2 ** 63, 1481233801]},
+            {"timestamp": [float("nan"), 1481233801]},
+            {"timestamp": ["yesterday", 1481233801]},
+            {"utc_offset": 24},
+            {"utc_offset": [1, 2, 3]},
+            {"result": [8.0]},
+            {"result": [8.0, "high"]},
+            {"result": [8.0, float("inf")]},
+        ):
+            with self.subTest(change=change), self.assertRaises(exceptions.ParseError):
+                columnar_data_stream_payload({**self.body, **change})
+        for body in ([], {"timestamp": [1481233501]}):
+            with self.subTest(body=body), self.assertRaises(exceptions.ParseError):
+                columnar_data_stream_payload(body)
+
+    def test_gzip_json_body(self):
+        stream = io.BytesIO(gzip.compress(json.dumps(self.body).encode()))
+        data = GzipJSONParser().parse(stream, parser_context=self.context("gzip"))
+        self.assertEqual(data, self.body)
+        stream = io.BytesIO(json.dumps(self.body).encode())
+        data = GzipJSONParser().parse(stream, parser_context=self.context())
+        self.assertEqual(data, self.body)
+
+    def test_invalid_gzip_bodies(self):
+        parser = GzipJSONParser()
+        with override_settings(DATA_UPLOAD_MAX_MEMORY_SIZE=100):
+            stream = io.BytesIO(gzip.compress(b"[" + b"0," * 100 + b"0]"))
+            with self.assertRaisesMessage(exceptions.ParseError, "too large"):
+                parser.parse(stream, parser_context=self.context("gzip"))
+        with self.assertRaises(exceptions.ParseError):
+            parser.parse(io.BytesIO(b"not gzip"), parser_context=self.context("gzip"))
+        with self.assertRaises(exceptions.UnsupportedMediaType):
+            parser.parse(io.BytesIO(b"{}"), parser_context=self.context("br"))
+
+    @skipIf(msgpack is None, "msgpack is not installed")
+    def test_msgpack_body(self):
+        parser = DataStreamMessagePackParser()
+        stream = io.BytesIO(gzip.compress(msgpack.packb(self.body)))
+        payload = parser.parse(stream, parser_context=self.context("gzip"))
+        self.assertEqual(list(payload.measurement_data["result"]), [8.0, 9.0])
+        self.assertEqual(payload.num_measurements, 2)
+        with self.assertRaises(exceptions.ParseError):
+            parser.parse(io.BytesIO(b"\xc1"), parser_context=self.context())
+
+
+class TestBatchThrottling(SimpleTestCase):
+    token = "batch-token"
+    sampling_feature = str(uuid.uuid4())
+    result_uuid = str(uuid.uuid4())
+
+    def setUp(self):
+        registration_cache.set(
+            self.token,
+            {
+                "registration_token": self.token,
+                "sampling_feature_id": 1,
+                "sampling_feature_uuid": self.sampling_feature,
+            },
+        )
+        unit_cache.set("hour minute", 1)
+        self.addCleanup(registration_cache.clear)
+        self.addCleanup(unit_cache.clear)
+        for patcher in (
+            mock.patch.object(throttling, "bucket_store", throttling.LocalBucketStore()),
+            mock.patch.object(RegistrationTokenThrottle, "burst", 2),
+            mock.patch.object(views, "data_stream_spool", None),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def envelope(self, values=()):
+        return {
+            "token": self.token,
+            "sampling_feature": self.sampling_feature,
+            "timestamp": ["2021-06-01T10:00:00-07:00"] * len(values),
+            self.result_uuid: list(values),
+        }
+
+    def post(self, envelopes):
+        request = APIRequestFactory().post("/api/data-stream/batch/", envelopes, format="json")
+        return views.TimeSeriesValuesBatchApi.as_view()(request)
+
+    def test_envelopes_over_the_token_rate_are_rejected(self):
+        # envelopes without values are charged without touching the database
+        response = self.post([self.envelope(), self.envelope(), self.envelope()])
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual([s["status"] for s in response.data], [201, 201, 429])
+        self.assertIn("Expected available in 2 seconds", response.data[2]["detail"])
+        self.assertEqual(response["Retry-After"], "2")
+
+    def test_batches_share_the_bucket_of_single_posts(self):
+        self.assertEqual(RegistrationTokenThrottle.charge(self.token), 0)
+        response = self.post([self.envelope(), self.envelope()])
+        self.assertEqual([s["status"] for s in response.data], [201, 429])
+
+    def test_busy_database_sheds_the_batch(self):
+        gate = throttling.ConcurrencyGate(1, timeout=0)
+        with mock.patch.object(views, "data_stream_gate", gate), gate:
+            response = self.post([self.envelope([21.5])])
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response["Retry-After"], "1")
+        self.assertEqual(gate.shed, 1)
+
+
+class UploadJobsMixin:
+    """Upload jobs kept in a temporary UPLOAD_JOB_DIR, requested by a site administrator."""
+
+    user = SimpleNamespace(is_authenticated=True, can_administer_site=lambda _: True)
+
+    def use_job_dir(self):
+        job_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, job_dir, ignore_errors=True)
+        for patcher in (
+            mock.patch.object(upload_jobs, "JOB_DIR", job_dir),
+            # queued jobs are run by the tests themselves
+            mock.patch.object(views, "upload_executor", None),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def call(self, view, request, **kwargs):
+        force_authenticate(request, user=self.user)
+        return view.as_view()(request, **kwargs)
+
+    @staticmethod
+    def age(job, seconds):
+        """Moves the last update of the job `seconds` back, as save() would overwrite it."""
+        job.state["updated"] -= seconds
+        with open(os.path.join(job.directory, "job.json"), "w") as state_file:
+            json.dump(job.state, state_file)
+
+
+class TestResumableUploads(UploadJobsMixin, SimpleTestCase):
+    data = b"Date and Time in UTC-7,AirTemp\n" + b"2021-06-01 10:00:00,21.5\n" * 100
+
+    def setUp(self):
+        self.use_job_dir()
+        self.job = self.start_upload(hashlib.sha256(self.data).hexdigest())
+
+    def start_upload(self, sha256):
+        return UploadJob.start_upload(1, 2, "data.csv", len(self.data), sha256)
+
+    def put(self, offset, chunk, sha256=None, job=None):
+        headers = {"HTTP_CONTENT_SHA256": sha256} if sha256 else {}
+        request = APIRequestFactory().put(
+            "/api/upload-jobs/data/?offset={}".format(offset),
+            chunk,
+            content_type="application/octet-stream",
+            **headers
+        )
+        job_id = (job or self.job).job_id
+        return self.call(views.UploadJobDataApi, request, job_id=job_id)
+
+    def finalize(self, job=None):
+        request = APIRequestFactory().post("/api/upload-jobs/finalize/")
+        job_id = (job or self.job).job_id
+        return self.call(views.UploadJobFinalizeApi, request, job_id=job_id)
+
+    def test_chunk_at_another_offset_is_answered_with_the_resume_offset(self):
+        self.assertEqual(self.put(0, self.data[:100]).data, {"offset": 100})
+        # a retry of a chunk whose response was lost
+        response = self.put(0, self.data[:100])
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.data["offset"], 100)
+        self.assertEqual(self.put(100, self.data[100:]).data, {"offset": len(self.data)})
+        self.assertEqual(self.finalize().status_code, 202)
+        with open(self.job.data_path, "rb") as data_file:
+            self.assertEqual(data_file.read(), self.data)
+
+    def test_corrupted_chunk_is_dropped(self):
+        chunk = self.data[:100]
+        response = self.put(0, chunk, sha256=hashlib.sha256(b"corrupted").hexdigest())
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data["offset"], 0)
+        self.assertEqual(self.job.received, 0)
+
+        response = self.put(0, chunk, sha256=hashlib.sha256(chunk).hexdigest().upper())
+        self.assertEqual(response.data, {"offset": 100})
+
+    def test_chunk_past_the_declared_size(self):
+        self.put(0, self.data[:100])
+        response = self.put(100, self.data[100:] + b"extra")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data["offset"], 100)
+        self.assertEqual(self.job.received, 100)
+
+    def test_finalize_before_every_byte_arrived(self):
+        self.put(0, self.data[:100])
+        response = self.finalize()
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(
+            response.data, {"error": "Received 100 of {} bytes.".format(len(self.data)), "offset": 100}
+        )
+        # the client can still send the rest
+        self.assertEqual(UploadJob.load(self.job.job_id).state["status"], upload_jobs.RECEIVING)
+
+    def test_finalize_with_another_file_checksum(self):
+        job = self.start_upload(hashlib.sha256(b"another file").hexdigest())
+        self.put(0, self.data, job=job)
+        response = self.finalize(job)
+        self.assertEqual(response.status_code, 400)
+        job = UploadJob.load(job.job_id)
+        self.assertEqual(job.state["status"], upload_jobs.FAILED)
+        self.assertFalse(os.path.exists(job.data_path))
+        self.assertEqual(self.finalize(job).status_code, 409)
+
+    def test_stale_uploads_are_removed(self):
+        unfinished = self.start_upload(None)
+        self.put(0, self.data[:100], job=unfinished)
+        self.age(unfinished, upload_jobs.ABANDONED_UPLOAD_SECONDS + 1)
+        finished = self.start_upload(None)
+        finished.finish()
+        self.age(finished, upload_jobs.FINISHED_JOB_SECONDS + 1)
+
+        output = io.StringIO()
+        call_command("process_upload_jobs", stdout=output)
+        self.assertIn("removed unfinished upload {}".format(unfinished.job_id), output.getvalue())
+        self.assertIn("removed finished job {}".format(finished.job_id), output.getvalue())
+        self.assertEqual(os.listdir(upload_jobs.JOB_DIR), [self.job.job_id])
+
+
+class TestUploadJobClaims(UploadJobsMixin, SimpleTestCase):
+    def setUp(self):
+        self.use_job_dir()
+        self.job = UploadJob.create(1, 2, SimpleUploadedFile("data.csv", b"data"))
+
+    def test_one_worker_claims_a_job(self):
+        self.assertEqual(list(UploadJob.pending())[0].job_id, self.job.job_id)
+        self.assertTrue(self.job.claim())
+        self.assertEqual(UploadJob.load(self.job.job_id).state["status"], upload_jobs.RUNNING)
+        # another worker finds it running under a fresh claim
+        self.assertFalse(UploadJob.load(self.job.job_id).claim())
+        self.assertEqual(list(UploadJob.pending()), [])
+
+    def test_stale_claims_are_taken_over(self):
+        self.assertTrue(self.job.claim())
+        stale = time.time() - upload_jobs.STALE_SECONDS - 1
+        os.utime(os.path.join(self.job.directory, "claim"), (stale, stale))
+
+        pending = list(UploadJob.pending())
+        self.assertEqual([job.job_id for job in pending], [self.job.job_id])
+        self.assertTrue(pending[0].claim())
+        self.assertFalse(self.job.is_stale())
+
+    def test_finished_jobs_are_not_claimed(self):
+        self.assertTrue(self.job.claim())
+        self.job.finish()
+        stale = time.time() - upload_jobs.STALE_SECONDS - 1
+        os.utime(os.path.join(self.job.directory, "claim"), (stale, stale))
+        self.assertEqual(list(UploadJob.pending()), [])
+        # a worker that found the job before it finished
+        self.assertFalse(UploadJob(self.job.job_id, {}).claim())
+        self.assertFalse(os.path.exists(self.job.data_path))
+
+
+class TestUploadJobs(UploadSiteMixin, UploadJobsMixin, TransactionTestCase):
+    def setUp(self):
+        self.create_upload_site()
+        self.use_job_dir()
+
+    def upload(self, data):
+        request = APIRequestFactory().post(
+            "/api/data-file-upload/",
+            {"data_file": SimpleUploadedFile("data.csv", data)},
+            format="multipart",
+        )
+        return self.call(
+            views.SensorDataUploadView, request, registration_id=self.registration.pk
+        )
+
+    def job_status(self, job_id):
+        request = APIRequestFactory().get(reverse("upload_job_status", args=[job_id]))
+        return self.call(views.UploadJobStatusApi, request, job_id=job_id)
+
+    def test_upload_is_processed_in_the_background(self):
+        response = self.upload(
+            self.data_file("2021-06-01 10:00:00,20.5", "2021-06-01 10:15:00,", "not a date,21")
+        )
+        self.assertEqual(response.status_code, 202)
+        job_id = response.data["job_id"]
+        self.assertEqual(response.data["status_url"], reverse("upload_job_status", args=[job_id]))
+
+        status = self.job_status(job_id).data
+        self.assertEqual(status["status"], upload_jobs.QUEUED)
+        self.assertEqual(status["file_name"], "data.csv")
+        self.assertEqual(status["rows_parsed"], 0)
+
+        self.assertTrue(views.run_upload_job(job_id))
+        status = self.job_status(job_id).data
+        self.assertEqual(status["status"], upload_jobs.DONE)
+        self.assertEqual(status["rows_parsed"], 2)
+        self.assertEqual(status["rows_inserted"], 1)
+        self.assertEqual(status["warnings"], ["Unrecognized date format: not a date"])
+        self.assertIsNone(status["error"])
+        self.assertFalse(views.run_upload_job(job_id))
+
+    def test_file_of_another_site(self):
+        data = self.data_file("2021-06-01 10:00:00,20.5")
+        data = data.replace(
+            str(self.registration.sampling_feature.sampling_feature_uuid).encode(),
+            str(uuid.uuid4()).encode(),
+        )
+        self.assertEqual(self.upload(data).status_code, 406)
+        self.assertEqual(os.listdir(upload_jobs.JOB_DIR), [])
+
+    def test_unknown_job(self):
+        self.assertEqual(self.job_status(uuid.uuid4().hex).status_code, 404)
+
+
+class TestUploadDryRun(UploadSiteMixin, UploadJobsMixin, TransactionTestCase):
+    def setUp(self):
+        self.create_upload_site()
+        self.use_job_dir()
+        SiteSensor.objects.filter(result_id=self.result.pk).update(
+            sensor_output=SensorOutput.objects.create(
+                instrument_output_variable_id=1,
+                model_id=1,
+                model_name="5TM",
+                model_manufacturer="METER",
+                variable_id=self.result.variable_id,
+                variable_name="Temperature",
+                variable_code="AirTemp_0",
+                unit_id=self.result.unit_id,
+                unit_name="degree celsius",
+                unit_abbreviation="degC",
+                sampled_medium="Air",
+            )
+        )
+        # a sensor the file has no column for
+        self.missing_result = self.create_series(1).last().result
+
+    def dry_run(self, data):
+        request = APIRequestFactory().post(
+            "/api/data-file-upload/?dry_run=1",
+            {"data_file": SimpleUploadedFile("data.csv", data)},
+            format="multipart",
+        )
+        return self.call(
+            views.SensorDataUploadView, request, registration_id=self.registration.pk
+        )
+
+    def test_summary(self):
+        unknown_uuid = str(uuid.uuid4())
+        data = self.data_file(
+            "2021-06-01 10:00:00,20.5,1",
+            "not a date,21,2",
+            "2021-06-01 10:15:00,,3",
+            "2021-06-01 10:30:00,21.5,4",
+            "2021-06-01 10:45:00,22,5",
+        ).replace(
+            b"Result UUID:," + str(self.result.result_uuid).encode(),
+            b"Result UUID:," + str(self.result.result_uuid).encode() + b"," + unknown_uuid.encode(),
+        )
+        # only the first three data rows are parsed, the rest is counted
+        with mock.patch.object(views, "DRY_RUN_SAMPLE_ROWS", 3):
+            response = self.dry_run(data)
+
+        self.assertEqual(response.status_code, 200)
+        summary = response.data
+        self.assertTrue(summary["dry_run"])
+        self.assertEqual(summary["utc_offset"], -7)
+        self.assertEqual(summary["rows"], 5)
+        self.assertEqual(summary["rows_sampled"], 3)
+        self.assertEqual(summary["rows_parsed"], 2)
+        self.assertEqual(summary["first_datetime"], datetime(2021, 6, 1, 10))
+        self.assertEqual(summary["last_datetime"], datetime(2021, 6, 1, 10, 45))
+        self.assertEqual(
+            summary["columns"],
+            [
+                {
+                    "column": 1,
+                    "result_uuid": str(self.result.result_uuid),
+                    "variable_code": "AirTemp_0",
+                    "variable_name": "Temperature",
+                    "unit": "degC",
+                    "values": 1,
+                },
+                {
+                    "column": 2,
+                    "result_uuid": unknown_uuid,
+                    "variable_code": None,
+                    "variable_name": None,
+                    "unit": None,
+                    "values": 0,
+                },
+            ],
+        )
+        self.assertEqual(summary["unrecognized_uuids"], [unknown_uuid])
+        self.assertEqual(
+            summary["sensors_not_in_file"], [str(self.missing_result.result_uuid)]
+        )
+        self.assertEqual(summary["bad_timestamp_count"], 1)
+        self.assertEqual(summary["bad_timestamps"], ["Unrecognized date format: not a date"])
+
+        # nothing is queued or written
+        self.assertEqual(os.listdir(upload_jobs.JOB_DIR), [])
+        self.assertFalse(TimeSeriesResultValue.objects.exists())
+
+
+class TestDataStreamSpool(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        self.now = 1000.0
+        patcher = mock.patch.object(spool, "time", SimpleNamespace(time=lambda: self.now))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.spool = DataStreamSpool(os.path.join(directory, "spool.sqlite3"), lease_seconds=60)
+
+    @staticmethod
+    def record(hour):
+        return {
+            "sampling_feature_id": 1,
+            "unit_id": 1,
+            "values": [[10, 21.5, "2021-06-01T{:02d}:00:00.000000".format(hour), -7]],
+        }
+
+    def test_records_are_claimed_once_until_acked(self):
+        self.spool.append([self.record(hour) for hour in range(3)])
+        claim_id, records = self.spool.claim(2)
+        self.assertEqual(records, [self.record(0), self.record(1)])
+        self.assertEqual(self.spool.claim(10)[1], [self.record(2)])
+        self.assertEqual(self.spool.claim(10)[1], [])
+
+        self.spool.ack(claim_id)
+        self.assertEqual(self.spool.stats()["pending"], 1)
+
+    def test_expired_lease_is_replayed(self):
+        self.spool.append([self.record(0)])
+        claim_id, _ = self.spool.claim(10)
+        self.now += 61
+        replay_id, records = self.spool.claim(10)
+        self.assertEqual(records, [self.record(0)])
+
+        # the crashed flusher can't renew or ack what was replayed
+        self.assertFalse(self.spool.renew(claim_id))
+        self.spool.ack(claim_id)
+        self.assertEqual(self.spool.stats()["pending"], 1)
+        self.spool.ack(replay_id)
+        self.assertEqual(self.spool.stats()["pending"], 0)
+
+    def test_renewed_lease_is_not_replayed(self):
+        self.spool.append([self.record(0)])
+        claim_id, _ = self.spool.claim(10)
+        self.now += 50
+        self.assertTrue(self.spool.renew(claim_id))
+        self.now += 50
+        self.assertEqual(self.spool.claim(10)[1], [])
+
+    def test_released_records_are_claimed_again(self):
+        self.spool.append([self.record(0)])
+        claim_id, _ = self.spool.claim(10)
+        self.spool.release(claim_id)
+        self.assertEqual(self.spool.claim(10)[1], [self.record(0)])
+
+    def flush(self, *args):
+        output = io.StringIO()
+        with mock.patch.object(flush_data_stream_spool, "data_stream_spool", self.spool):
+            call_command("flush_data_stream_spool", *args, stdout=output)
+        return output.getvalue()
+
+    def test_stats(self):
+        self.spool.append([self.record(0)])
+        self.now += 30
+        self.spool.append([self.record(1)])
+        self.assertEqual(self.flush("--stats"), "pending: 2\nlag_seconds: 30.0\n")
+
+    def test_flush_writes_and_acks_each_segment(self):
+        self.spool.append([self.record(hour) for hour in range(3)])
+        batches = []
+        write = mock.patch.object(
+            views.ResultValueBatch,
+            "write",
+            autospec=True,
+            side_effect=lambda batch, connection: batches.append(batch),
+        )
+        with mock.patch.object(flush_data_stream_spool, "_db_engine"), write:
+            output = self.flush("--batch-size", "2")
+        self.assertEqual([len(batch.result_values) for batch in batches], [2, 1])
+        self.assertIn("flushed 2 payloads, 1 pending", output)
+        self.assertEqual(self.spool.stats()["pending"], 0)
+
+    def test_failed_flush_releases_the_segment(self):
+        self.spool.append([self.record(0)])
+        write = mock.patch.object(
+            views.ResultValueBatch, "write", side_effect=RuntimeError("database is down")
+        )
+        with mock.patch.object(flush_data_stream_spool, "_db_engine"), write:
+            with self.assertRaises(RuntimeError):
+                self.flush()
+        self.assertEqual(self.spool.claim(10)[1], [self.record(0)])
+
+
+class TestWritePartitioned(SimpleTestCase):
+    @staticmethod
+    def values(rows_per_result):
+        result_ids = [
+            result_id for result_id, rows in rows_per_result.items() for _ in range(rows)
+        ]
+        return result_values_columns(
+            result_ids,
+            np.zeros(len(result_ids)),
+            [datetime(2021, 6, 1)] * len(result_ids),
+            [0] * len(result_ids),
+            1,
+        )
+
+    @staticmethod
+    def partition_results(frames):
+        return [sorted(frame["result_id"].unique().tolist()) for frame in frames]
+
+    def test_partitions_are_balanced_by_rows(self):
+        frames = partition_by_result(self.values({1: 10, 2: 7, 3: 4, 4: 3, 5: 1}), 3)
+        self.assertEqual(self.partition_results(frames), [[1], [2, 5], [3, 4]])
+        self.assertEqual([len(frame) for frame in frames], [10, 8, 7])
+
+    def test_no_more_partitions_than_results(self):
+        frames = partition_by_result(self.values({7: 3, 8: 3}), 4)
+        self.assertEqual(self.partition_results(frames), [[7], [8]])
+        self.assertEqual(len(partition_by_result(self.values({7: 3}), 4)), 1)
+
+    def test_failed_partitions_are_reported_in_partition_order(self):
+        executor = ThreadPoolExecutor(3)
+        self.addCleanup(executor.shutdown)
+        second_failed = threading.Event()
+
+        def write(frame, connection):
+            result_ids = sorted(frame["result_id"].unique().tolist())
+            if result_ids == [1]:
+                # fails after the other failing partition
+                second_failed.wait(5)
+                raise ValueError("first")
+            if result_ids == [3]:
+                second_failed.set()
+                raise ValueError("third")
+            return WriteResult(len(frame), {result_ids[0]: len(frame)})
+
+        with self.assertRaises(PartitionWriteError) as raised:
+            write_partitioned(
+                self.values({1: 3, 2: 2, 3: 1}), mock.MagicMock(), executor, 3, write
+            )
+        self.assertEqual(
+            [(result_ids, str(error)) for result_ids, error in raised.exception.errors],
+            [([1], "first"), ([3], "third")],
+        )
+        self.assertEqual(str(raised.exception), "results 1: first; results 3: third")
+
+    def test_written_counts_are_summed(self):
+        executor = ThreadPoolExecutor(2)
+        self.addCleanup(executor.shutdown)
+
+        def write(frame, connection):
+            return WriteResult(len(frame), {int(frame["result_id"].iloc[0]): 1})
+
+        written = write_partitioned(
+            self.values({1: 3, 2: 2}), mock.MagicMock(), executor, 2, write
+        )
+        self.assertEqual((written.total, written.inserted), (5, {1: 1, 2: 1}))
+
+
+class TestRequestTimer(SimpleTestCase):
+    def setUp(self):
+        self.now = 100.0
+        self.registry = MetricsRegistry()
+        for patcher in (
+            mock.patch.object(metrics, "time", SimpleNamespace(perf_counter=lambda: self.now)),
+            mock.patch.object(metrics, "metrics", self.registry),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_stages_and_counts(self):
+        timer = RequestTimer("TimeSeriesValuesApi")
+        for milliseconds in (12.5, 2.5):
+            with timer.stage("write"):
+                self.now += milliseconds / 1000
+        # a failing stage is timed too
+        with self.assertRaises(ValueError), timer.stage("parse"):
+            self.now += 0.001
+            raise ValueError
+        timer.count("rows", 3)
+        timer.count("rows", 2)
+        timer.finish(201)
+
+        self.assertAlmostEqual(timer.stages["write"], 15.0)
+        self.assertEqual(timer.counts, {"rows": 5})
+        snapshot = self.registry.snapshot()
+        write = snapshot["histograms"]["TimeSeriesValuesApi.write_ms"]
+        self.assertEqual((write["count"], write["sum"], write["max"]), (2, 15.0, 12.5))
+        self.assertEqual((write["buckets"]["le_5"], write["buckets"]["le_25"]), (1, 1))
+        self.assertEqual(snapshot["histograms"]["TimeSeriesValuesApi.total_ms"]["sum"], 16.0)
+        self.assertEqual(
+            snapshot["counters"],
+            {
+                "TimeSeriesValuesApi.requests": 1,
+                "TimeSeriesValuesApi.rows": 5,
+                "TimeSeriesValuesApi.status_201": 1,
+            },
+        )
+
+    def test_slow_requests_are_logged(self):
+        timer = RequestTimer("SensorDataUploadView")
+        with timer.stage("insert"):
+            self.now += 2
+        with mock.patch.object(metrics, "SLOW_REQUEST_THRESHOLD", 1000):
+            with self.assertLogs("dataloaderservices.metrics", "WARNING") as logs:
+                timer.finish(202)
+        self.assertIn("slow SensorDataUploadView request: 2000 ms", logs.output[0])
+        self.assertIn("'insert': 2000.0", logs.output[0])
+
+
+class TestSensorDataFileParser(SimpleTestCase):
+    site_uuid = str(uuid.uuid4())
+    result_uuids = [str(uuid.uuid4()), str(uuid.uuid4())]
+
+    def parser(self, *rows, chunk_rows=2):
+        lines = [
+            "Sampling Feature UUID: {}".format(self.site_uuid),
+            "Result UUID:,{},{},".format(*self.result_uuids),
+            "Date and Time in UTC-7,AirTemp,RH",
+        ] + list(rows)
+        return SensorDataFileParser(
+            [(line + "\r\n").encode() for line in lines], chunk_rows=chunk_rows
+        )
+
+    def test_header(self):
+        parser = self.parser()
+        self.assertEqual(parser.site_uuid, self.site_uuid)
+        self.assertEqual(parser.utc_offset, -7)
+        # the empty cell at the end of the header row is no result
+        self.assertEqual(parser.result_columns, {self.result_uuids[0]: 1, self.result_uuids[1]: 2})
+
+    def test_ragged_and_blank_rows(self):
+        parser = self.parser(
+            "2021-06-01 10:00:00,1,2",
+            "",
+            "2021-06-01 10:15:00,3",
+            "2021-06-01 10:30:00,,4",
+            "Date and Time in UTC-7,AirTemp,RH",
+            "2021-06-01 10:45:00,5,6,7",
+            "June 1st,8,9",
+            ",",
+        )
+        column_results = parser.map_columns(
+            {self.result_uuids[0]: 10, self.result_uuids[1]: 20}
+        )
+        values = pd.concat(list(parser.chunks(column_results, unit_id=1)))
+
+        utc = [datetime(2021, 6, 1, 17, minute) for minute in (0, 15, 30, 45)]
+        for result_id, rows in (
+            (10, [(utc[0], "1"), (utc[1], "3"), (utc[3], "5")]),
+            (20, [(utc[0], "2"), (utc[2], "4"), (utc[3], "6")]),
+        ):
+            result_values = values[values["result_id"] == result_id]
+            self.assertEqual(
+                list(zip(result_values["value_datetime"], result_values["data_value"])), rows
+            )
+        self.assertEqual(set(values["utc_offset"]), {-7})
+        self.assertEqual(parser.rows_parsed, 4)
+        self.assertEqual(
+            parser.warnings,
+            ["Unrecognized date format: June 1st", "Unrecognized date format: "],
+        )
+        self.assertEqual(parser.latest_values, {10: (utc[3], "5"), 20: (utc[3], "6")})
+        self.assertEqual(
+            (parser.first_datetime, parser.last_datetime),
+            (datetime(2021, 6, 1, 10), datetime(2021, 6, 1, 10, 45)),
+        )
+
+    def test_unmapped_columns_are_skipped(self):
+        parser = self.parser("2021-06-01 10:00:00,1,2")
+        values = pd.concat(list(parser.chunks({2: 20}, unit_id=1)))
+        self.assertEqual(values["result_id"].tolist(), [20])
+        self.assertEqual(parser.count_rows(), (0, None))
+
+    def test_dry_run_reads_a_sample(self):
+        parser = self.parser(*("2021-06-01 10:{:02d}:00,1,2".format(m) for m in range(5)))
+        sample = pd.concat(list(parser.chunks({1: 10}, unit_id=1, max_rows=3)))
+        self.assertEqual(len(sample), 3)
+        self.assertEqual(parser.count_rows(), (2, ["2021-06-01 10:04:00", "1", "2"]))
@@ -0,0 +1,164 @@
+"""
+Rate limiting and backpressure for data-stream posts.
+
+`RegistrationTokenThrottle` gives each registration token a token bucket: a logger
+can burst up to `DATA_STREAM_THROTTLE_BURST` posts, refilled at
+`DATA_STREAM_THROTTLE_RATE` posts per minute, and gets 429 with Retry-After
+beyond that. Buckets live in this process unless `DATA_STREAM_THROTTLE_CACHE`
+names a Django cache shared by all workers; updates to a shared bucket are not
+atomic, so concurrent posts from one token can slip a few extra requests through.
+Each envelope of a batch post is charged to its token like a post of its own.
+
+`data_stream_gate` caps the data-stream posts using the database at once, below
+the `_db_engine` pool size, and sheds the rest with 503 instead of letting them
+queue for a connection.
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Tuple
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework import exceptions, status
+from rest_framework.throttling import BaseThrottle
+
+from dataloaderservices.auth import get_registration
+
+
+class ServiceBusy(exceptions.APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = "Too many data-stream requests are in progress, try again later."
+    default_code = "service_busy"
+
+    def __init__(self, wait: float, detail=None, code=None) -> None:
+        super().__init__(detail, code)
+        self.wait = wait  # sent as Retry-After by the DRF exception handler
+
+
+class LocalBucketStore:
+    """Token buckets of this process, the least recently used dropped past `maxsize`."""
+
+    def __init__(self, maxsize: int = 10000) -> None:
+        self.maxsize = maxsize
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key: Hashable, rate: float, burst: float) -> float:
+        """Takes a token from the bucket; returns 0 or the seconds until one is available."""
+        with self._lock:
+            now = time.monotonic()
+            tokens, updated = self._buckets.get(key, (burst, now))
+            tokens, wait = _take(tokens, updated, now, rate, burst)
+            self._buckets[key] = (tokens, now)
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.maxsize:
+                self._buckets.popitem(last=False)
+            return wait
+
+
+class CacheBucketStore:
+    """Token buckets kept in a Django cache, so every worker shares them."""
+
+    def __init__(self, alias: str) -> None:
+        self.cache = caches[alias]
+
+    def take(self, key: Hashable, rate: float, burst: float) -> float:
+        cache_key = f"data-stream-throttle:{key}"
+        now = time.time()
+        tokens, updated = self.cache.get(cache_key, (burst, now))
+        tokens, wait = _take(tokens, updated, now, rate, burst)
+        # an idle bucket refills completely, so it can expire once it would be full
+        self.cache.set(cache_key, (tokens, now), timeout=int(burst / rate) + 1)
+        return wait
+
+
+def _take(
+    tokens: float, updated: float, now: float, rate: float, burst: float
+) -> Tuple[float, float]:
+    tokens = min(burst, tokens + (now - updated) * rate)
+    if tokens >= 1:
+        return tokens - 1, 0.0
+    return tokens, (1 - tokens) / rate
+
+
+class ThrottleCounters:
+    """Number of rejected posts per site (sampling_feature_id), for ops."""
+
+    def __init__(self) -> None:
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def increment(self, key: Any) -> None:
+        with self._lock:
+            self._counts[key] = self._counts.get(key, 0) + 1
+
+    def stats(self) -> Dict[Any, int]:
+        with self._lock:
+            return dict(self._counts)
+
+
+class ConcurrencyGate:
+    """Lets at most `limit` callers in at once; others wait up to `timeout` seconds, then get 503."""
+
+    def __init__(self, limit: int, timeout: float) -> None:
+        self.limit = limit
+        self.timeout = timeout
+        self.shed = 0
+        self._semaphore = threading.BoundedSemaphore(limit)
+        self._lock = threading.Lock()
+
+    def __enter__(self) -> "ConcurrencyGate":
+        if not self._semaphore.acquire(timeout=self.timeout):
+            with self._lock:
+                self.shed += 1
+            raise ServiceBusy(wait=1)
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self._semaphore.release()
+
+
+_throttle_cache = getattr(settings, "DATA_STREAM_THROTTLE_CACHE", None)
+bucket_store = CacheBucketStore(_throttle_cache) if _throttle_cache else LocalBucketStore()
+throttled_sites = ThrottleCounters()
+data_stream_gate = ConcurrencyGate(
+    getattr(settings, "DATA_STREAM_MAX_CONCURRENT", 8),
+    getattr(settings, "DATA_STREAM_CONCURRENCY_TIMEOUT", 1.0),
+)
+
+
+class RegistrationTokenThrottle(BaseThrottle):
+    """Token bucket per registration token (the TOKEN header) of the data-stream API."""
+
+    rate = getattr(settings, "DATA_STREAM_THROTTLE_RATE", 30) / 60  # per second
+    burst = getattr(settings, "DATA_STREAM_THROTTLE_BURST", 60)
+
+    @classmethod
+    def charge(cls, token: str) -> float:
+        """Takes one post of `token` from its bucket; returns 0 or the seconds until one is available."""
+        if not cls.rate:
+            return 0.0
+        wait = bucket_store.take(token, cls.rate, cls.burst)
+        if wait:
+            registration = get_registration(token)
+            throttled_sites.increment(registration["sampling_feature_id"] if registration else None)
+        return wait
+
+    def allow_request(self, request, view) -> bool:
+        token = request.META.get("HTTP_TOKEN")
+        if not token:
+            return True
+        self.wait_seconds = self.charge(token)
+        return not self.wait_seconds
+
+    def wait(self) -> float:
+        return self.wait_seconds
+
+
+def get_throttle_stats() -> Dict[str, Any]:
+    return {
+        "throttled_by_site": throttled_sites.stats(),
+        "concurrency_limit": data_stream_gate.limit,
+        "shed": data_stream_gate.shed,
+    }
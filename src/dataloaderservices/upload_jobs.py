@@ -0,0 +1,351 @@
+"""
+Background jobs for sensor data file uploads.
+
+`SensorDataUploadView` stores the uploaded file under `UPLOAD_JOB_DIR/<job id>/`
+next to a `job.json` holding the job's state and progress, and answers right away
+with the job id. The file is then processed by a thread pool in the web process
+(`UPLOAD_JOB_WORKER = "thread"`, the default) or by the `process_upload_jobs`
+management command (`"command"`). Clients poll `UploadJobStatusApi` for progress.
+
+A job is claimed with a lock file before it is processed; the lock is touched as
+the job makes progress, and the management command takes over jobs whose lock went
+stale (e.g. the web process restarted mid-upload). Re-running a job is safe since
+the writer skips rows that already exist. Finished jobs keep their status for
+`UPLOAD_JOB_RETENTION_SECONDS`, then `process_upload_jobs` removes them.
+
+Large files can also be sent in pieces: `start_upload` creates a job in the
+"receiving" state, `write_chunk` appends each piece at the offset the client
+claims (so an interrupted upload resumes from `received`), and `complete_upload`
+checks the size and SHA-256 before queueing the job like a regular upload. Uploads
+left unfinished for `UPLOAD_JOB_ABANDONED_SECONDS` are removed by `process_upload_jobs`.
+"""
+import fcntl
+import hashlib
+import json
+import os
+import re
+import shutil
+import tempfile
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterator, Union
+
+from django.conf import settings
+
+RECEIVING = "receiving"
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+# warnings kept in job.json; the total is reported as warning_count
+MAX_STORED_WARNINGS = 1000
+
+# outside the source tree, which deployments replace; with UPLOAD_JOB_WORKER = "command"
+# it has to be a directory the web and process_upload_jobs processes both see
+JOB_DIR = getattr(settings, "UPLOAD_JOB_DIR", None) or os.path.join(
+    tempfile.gettempdir(), "websdl-upload-jobs"
+)
+STALE_SECONDS = getattr(settings, "UPLOAD_JOB_STALE_SECONDS", 600)
+
+ABANDONED_UPLOAD_SECONDS = getattr(settings, "UPLOAD_JOB_ABANDONED_SECONDS", 7 * 24 * 3600)
+FINISHED_JOB_SECONDS = getattr(settings, "UPLOAD_JOB_RETENTION_SECONDS", 7 * 24 * 3600)
+
+_job_id_re = re.compile(r"^[0-9a-f]{32}$")
+
+
+class UploadChunkError(Exception):
+    """A chunk that can't be stored; `received` is where the client should resume."""
+
+    def __init__(self, message: str, received: int) -> None:
+        super().__init__(message)
+        self.received = received
+
+
+class UploadOffsetError(UploadChunkError):
+    pass
+
+
+class UploadJob:
+    def __init__(self, job_id: str, state: Dict[str, Any]) -> None:
+        self.job_id = job_id
+        self.state = state
+
+    @property
+    def directory(self) -> str:
+        return os.path.join(JOB_DIR, self.job_id)
+
+    @property
+    def data_path(self) -> str:
+        return os.path.join(self.directory, "data.csv")
+
+    @property
+    def _state_path(self) -> str:
+        return os.path.join(self.directory, "job.json")
+
+    @property
+    def _lock_path(self) -> str:
+        return os.path.join(self.directory, "claim")
+
+    @classmethod
+    def _new(
+        cls, registration_id: int, sampling_feature_id: int, file_name: str, **state
+    ) -> "UploadJob":
+        job = cls(
+            uuid.uuid4().hex,
+            {
+                "registration_id": registration_id,
+                "sampling_feature_id": sampling_feature_id,
+                "file_name": file_name,
+                "status": QUEUED,
+                "created": time.time(),
+                "updated": time.time(),
+                "rows_parsed": 0,
+                "rows_inserted": 0,
+                "rows_duplicate": 0,
+                "warning_count": 0,
+                "warnings": [],
+                "error": None,
+                **state,
+            },
+        )
+        # uploaded files are only for this service to read
+        os.makedirs(JOB_DIR, mode=0o700, exist_ok=True)
+        os.mkdir(job.directory)
+        return job
+
+    @classmethod
+    def create(cls, registration_id: int, sampling_feature_id: int, data_file) -> "UploadJob":
+        """Stores an uploaded file (a Django UploadedFile) as a new queued job."""
+        job = cls._new(registration_id, sampling_feature_id, data_file.name)
+        with open(job.data_path, "wb") as stored_file:
+            for chunk in data_file.chunks():
+                stored_file.write(chunk)
+        job.save()
+        return job
+
+    @classmethod
+    def start_upload(
+        cls,
+        registration_id: int,
+        sampling_feature_id: int,
+        file_name: str,
+        size: int,
+        sha256: str = None,
+    ) -> "UploadJob":
+        """Creates a job whose file is sent in chunks with `write_chunk`."""
+        job = cls._new(
+            registration_id,
+            sampling_feature_id,
+            file_name,
+            status=RECEIVING,
+            size=size,
+            sha256=sha256,
+        )
+        open(job.data_path, "wb").close()
+        job.save()
+        return job
+
+    @classmethod
+    def load(cls, job_id: str) -> Union["UploadJob", None]:
+        if not _job_id_re.match(job_id):
+            return None
+        try:
+            with open(os.path.join(JOB_DIR, job_id, "job.json")) as state_file:
+                return cls(job_id, json.load(state_file))
+        except FileNotFoundError:
+            return None
+
+    @classmethod
+    def _all(cls) -> Iterator["UploadJob"]:
+        if not os.path.isdir(JOB_DIR):
+            return
+        for job_id in os.listdir(JOB_DIR):
+            job = cls.load(job_id)
+            if job:
+                yield job
+
+    @classmethod
+    def pending(cls) -> Iterator["UploadJob"]:
+        """Queued and stale running jobs, oldest first."""
+        jobs = [job for job in cls._all() if job.state["status"] in (QUEUED, RUNNING)]
+        for job in sorted(jobs, key=lambda job: job.state["created"]):
+            if job.state["status"] == QUEUED or job.is_stale():
+                yield job
+
+    @classmethod
+    def abandoned(cls) -> Iterator["UploadJob"]:
+        """Chunked uploads the client stopped sending long ago."""
+        for job in cls._all():
+            if (
+                job.state["status"] == RECEIVING
+                and time.time() - job.state["updated"] > ABANDONED_UPLOAD_SECONDS
+            ):
+                yield job
+
+    @classmethod
+    def expired(cls) -> Iterator["UploadJob"]:
+        """Finished jobs whose status has been kept for FINISHED_JOB_SECONDS."""
+        for job in cls._all():
+            if (
+                job.state["status"] in (DONE, FAILED)
+                and time.time() - job.state["updated"] > FINISHED_JOB_SECONDS
+            ):
+                yield job
+
+    @property
+    def received(self) -> int:
+        try:
+            return os.path.getsize(self.data_path)
+        except FileNotFoundError:
+            return 0
+
+    def write_chunk(self, offset: int, chunk, sha256: str = None) -> int:
+        """
+        Appends the file-like `chunk` at `offset`, which must be the number of bytes
+        received so far; returns the new count. A chunk whose SHA-256 doesn't match
+        `sha256` (hex) is discarded.
+        """
+        with open(self.data_path, "r+b") as data_file:
+            # concurrent retries of the same chunk must not interleave their writes
+            fcntl.flock(data_file, fcntl.LOCK_EX)
+            received = data_file.seek(0, os.SEEK_END)
+            if offset != received:
+                raise UploadOffsetError(
+                    f"Expected a chunk at offset {received}, not {offset}.", received
+                )
+
+            # reads at most one byte past the declared size, so an oversized chunk is
+            # refused without storing the rest of it
+            remaining = self.state["size"] - received
+            digest = hashlib.sha256()
+            error = None
+            while True:
+                block = chunk.read(min(1024 * 1024, remaining + 1))
+                if not block:
+                    break
+                if len(block) > remaining:
+                    error = "Chunk goes past the declared file size."
+                    break
+                remaining -= len(block)
+                digest.update(block)
+                data_file.write(block)
+            end = data_file.tell()
+
+            if not error and sha256 and digest.hexdigest() != sha256.lower():
+                error = "Chunk checksum does not match, send it again."
+            if error:
+                data_file.truncate(received)
+                raise UploadChunkError(error, received)
+
+        self.save()
+        return end
+
+    def complete_upload(self) -> None:
+        """Checks the received file against its declared size and checksum, and queues it."""
+        received = self.received
+        if received != self.state["size"]:
+            raise UploadChunkError(
+                f"Received {received} of {self.state['size']} bytes.", received
+            )
+        if self.state["sha256"]:
+            digest = hashlib.sha256()
+            with open(self.data_path, "rb") as data_file:
+                for block in iter(lambda: data_file.read(1024 * 1024), b""):
+                    digest.update(block)
+            if digest.hexdigest() != self.state["sha256"].lower():
+                self.finish("File checksum does not match, upload it again.")
+                raise UploadChunkError(self.state["error"], 0)
+        self.state["status"] = QUEUED
+        self.save()
+
+    def remove(self) -> None:
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def save(self) -> None:
+        self.state["updated"] = time.time()
+        temp_path = self._state_path + ".tmp"
+        with open(temp_path, "w") as state_file:
+            json.dump(self.state, state_file)
+        os.replace(temp_path, self._state_path)
+
+    def is_stale(self) -> bool:
+        try:
+            return time.time() - os.path.getmtime(self._lock_path) > STALE_SECONDS
+        except FileNotFoundError:
+            return True
+
+    def claim(self) -> bool:
+        """
+        Takes the job for processing; False if another worker holds a fresh claim or
+        the job is over.
+        """
+        with open(self._lock_path, "a+") as lock_file:
+            # checked and taken under the lock, so of the workers finding the claim
+            # missing or stale only the first one takes the job
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            lock_file.seek(0)
+            if lock_file.read() and not self.is_stale():
+                return False
+            job = UploadJob.load(self.job_id)
+            if not job or job.state["status"] not in (QUEUED, RUNNING):
+                return False  # finished by the worker whose claim went stale
+            lock_file.truncate(0)
+            lock_file.write(str(os.getpid()))
+            lock_file.flush()
+            os.utime(self._lock_path)
+            self.state = job.state
+            self.state["status"] = RUNNING
+            self.save()
+        return True
+
+    def report_progress(self, rows_parsed: int, written, warnings: list) -> None:
+        """Records progress after a chunk; `written` is the WriteResult so far."""
+        self.state.update(
+            rows_parsed=rows_parsed,
+            rows_inserted=written.inserted_count,
+            rows_duplicate=written.conflicting_count,
+            warning_count=len(warnings),
+            warnings=warnings[:MAX_STORED_WARNINGS],
+        )
+        self.save()
+        os.utime(self._lock_path)
+
+    def finish(self, error: str = None) -> None:
+        self.state.update(status=FAILED if error else DONE, error=error)
+        self.save()
+        # the data isn't needed once the job is over, only its state is kept
+        try:
+            os.remove(self.data_path)
+        except FileNotFoundError:
+            pass
+
+    def to_dict(self) -> Dict[str, Any]:
+        fields = (
+            "status",
+            "file_name",
+            "rows_parsed",
+            "rows_inserted",
+            "rows_duplicate",
+            "warning_count",
+            "warnings",
+            "error",
+        )
+        job = {"job_id": self.job_id, **{field: self.state[field] for field in fields}}
+        if "size" in self.state:
+            # chunked uploads also report how much of the file arrived
+            job["size"] = self.state["size"]
+            receiving = self.state["status"] == RECEIVING
+            job["received"] = self.received if receiving else self.state["size"]
+        return job
+
+
+# None when jobs are left to the process_upload_jobs management command
+upload_executor = (
+    ThreadPoolExecutor(
+        getattr(settings, "UPLOAD_JOB_THREADS", 2), thread_name_prefix="upload-job"
+    )
+    if getattr(settings, "UPLOAD_JOB_WORKER", "thread") == "thread"
+    else None
+)
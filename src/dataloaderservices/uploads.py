@@ -0,0 +1,210 @@
+"""
+Single-pass parser for sensor data files uploaded through `SensorDataUploadView`.
+
+Logger CSV files start with header rows (site and result UUIDs, the UTC offset of
+the timestamps) followed by one row per timestamp with a column per result. The
+header is read first, the file's result columns are mapped to result ids once, and
+data rows are then read in chunks of `UPLOAD_CHUNK_ROWS`, each turned into a column
+buffer of result values for the writer. Timestamps are parsed per chunk, with the
+common "YYYY-MM-DD HH:MM:SS" layout vectorized and anything else parsed row by row.
+"""
+import csv
+from itertools import chain, islice
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+import numpy as np
+import pandas as pd
+from django.conf import settings
+from django.utils.dateparse import parse_datetime
+
+from dataloaderservices.writer import result_values_columns
+
+HEADER_ROW_INDICATORS = (
+    "Data Logger",
+    "Sampling Feature",
+    "Sensor",
+    "Variable",
+    "Result",
+    "Date and Time",
+    "Code",
+)
+
+CHUNK_ROWS = getattr(settings, "UPLOAD_CHUNK_ROWS", 10000)
+
+
+def parse_local_datetime(value: str):
+    """Parses one timestamp the way uploads always have, dropping any timezone; NaT if it can't."""
+    try:
+        measurement_datetime = parse_datetime(value)
+        if not measurement_datetime:
+            measurement_datetime = pd.to_datetime(value)
+        if not measurement_datetime or measurement_datetime is pd.NaT:
+            return pd.NaT
+        timestamp = pd.Timestamp(measurement_datetime.replace(tzinfo=None))
+        # newer pandas parse dates the writer's nanosecond datetimes can't hold, like
+        # year 1 for "June 1st"
+        if not pd.Timestamp.min <= timestamp <= pd.Timestamp.max:
+            return pd.NaT
+        return timestamp
+    except (ValueError, TypeError, OverflowError):
+        return pd.NaT
+
+
+def parse_local_datetimes(values: pd.Series) -> pd.Series:
+    parsed = pd.to_datetime(values, format="%Y-%m-%d %H:%M:%S", errors="coerce")
+    unparsed = parsed.isna()
+    if unparsed.any():
+        parsed = parsed.astype(object)
+        parsed[unparsed] = [parse_local_datetime(v) for v in values[unparsed]]
+        parsed = pd.to_datetime(parsed)
+    return parsed
+
+
+def _result_columns(row: List[str]) -> Dict[str, int]:
+    # loggers often leave empty cells at the end of the header rows
+    return {
+        uuid: index for index, uuid in enumerate(row[1:], start=1) if uuid.strip()
+    }
+
+
+class SensorDataFileParser:
+    """
+    Reads the header of an uploaded file on construction; `chunks` then yields the
+    data rows as result value column buffers, in file order.
+    """
+
+    def __init__(self, data_file: Iterable[bytes], chunk_rows: int = None) -> None:
+        self.chunk_rows = chunk_rows or CHUNK_ROWS
+        self.site_uuid = ""
+        self.utc_offset = 0
+        self.result_columns = {}  # result uuid -> column index
+        self.warnings = []
+        self.rows_parsed = 0
+        self.latest_values = {}  # result_id -> (UTC datetime, data value) of its last row
+        self.first_datetime = None  # earliest and latest local timestamps of the data rows
+        self.last_datetime = None
+        self._rows = csv.reader(line.decode("utf-8-sig") for line in data_file)
+        self._first_data_row = None
+        self._data = None
+        self._read_header()
+
+    def _read_header(self) -> None:
+        got_feature_uuid = False
+        got_result_uuids = False
+        got_utc_offset = False
+        for row in self._rows:
+            if not row:
+                continue
+            if not row[0].startswith(HEADER_ROW_INDICATORS):
+                self._first_data_row = row
+                return
+
+            if row[0].startswith("Sampling Feature") and not got_feature_uuid:
+                self.site_uuid = (
+                    row[0]
+                    .replace("Sampling Feature UUID: ", "")
+                    .replace("Sampling Feature: ", "")
+                )
+                got_feature_uuid = True
+
+                # oldest csv's from modular sensors have the result UUID's
+                # in the same row as the sampling feature UUID
+                if len(row) > 1 and row[1] != "" and not got_result_uuids:
+                    self.result_columns = _result_columns(row)
+                    got_result_uuids = True
+
+            elif row[0].startswith("Result UUID:") and not got_result_uuids:
+                self.result_columns = _result_columns(row)
+                got_result_uuids = True
+
+            elif row[0].startswith("Date and Time") and not got_utc_offset:
+                self.utc_offset = int(
+                    row[0].replace("Date and Time in UTC", "").replace("+", "")
+                )
+                got_utc_offset = True
+
+    def map_columns(self, result_ids: Dict[str, int]) -> Dict[int, int]:
+        """Column index -> result_id of the file's result UUIDs found in `result_ids` (uuid -> id)."""
+        return {
+            index: result_ids[uuid]
+            for uuid, index in self.result_columns.items()
+            if uuid in result_ids
+        }
+
+    def _data_rows(self) -> Iterator[List[str]]:
+        if self._data is None:
+            rows = self._rows
+            if self._first_data_row is not None:
+                rows = chain([self._first_data_row], rows)
+            # header rows can repeat further down when files were concatenated
+            self._data = (
+                row for row in rows if row and not row[0].startswith(HEADER_ROW_INDICATORS)
+            )
+        return self._data
+
+    def count_rows(self) -> Tuple[int, List[str]]:
+        """
+        Reads the data rows left with the csv tokenizer only: how many there are and
+        the last one (None if there are none).
+        """
+        count, last_row = 0, None
+        for last_row in self._data_rows():
+            count += 1
+        return count, last_row
+
+    def chunks(
+        self, column_results: Dict[int, int], unit_id: int, max_rows: int = None
+    ) -> Iterator[pd.DataFrame]:
+        """Parses the data rows left, or only the next `max_rows` of them."""
+        data_rows = self._data_rows()
+        if max_rows is not None:
+            data_rows = islice(data_rows, max_rows)
+        utc_offset = np.timedelta64(self.utc_offset, "h")
+        while True:
+            rows = list(islice(data_rows, self.chunk_rows))
+            if not rows:
+                return
+            frame = pd.DataFrame(rows, dtype=object).fillna("")
+
+            timestamps = frame[0]
+            local_datetimes = parse_local_datetimes(timestamps)
+            valid = local_datetimes.notna().to_numpy()
+            for timestamp in timestamps[~valid]:
+                self.warnings.append("Unrecognized date format: {}".format(timestamp))
+            self.rows_parsed += int(valid.sum())
+            if valid.any():
+                first, last = local_datetimes[valid].min(), local_datetimes[valid].max()
+                if self.first_datetime is None or first < self.first_datetime:
+                    self.first_datetime = first
+                if self.last_datetime is None or last > self.last_datetime:
+                    self.last_datetime = last
+            utc_datetimes = local_datetimes.to_numpy() - utc_offset
+
+            result_ids, data_values, value_datetimes = [], [], []
+            for index, result_id in column_results.items():
+                if index >= frame.shape[1]:
+                    continue
+                values = frame[index].to_numpy()
+                has_value = valid & (values != "")
+                if not has_value.any():
+                    continue
+                result_ids.append(np.full(has_value.sum(), result_id))
+                data_values.append(values[has_value])
+                value_datetimes.append(utc_datetimes[has_value])
+
+                last = len(has_value) - 1 - int(np.argmax(has_value[::-1]))
+                self.latest_values[result_id] = (
+                    pd.Timestamp(utc_datetimes[last]).to_pydatetime(),
+                    values[last],
+                )
+
+            if not result_ids:
+                continue
+            value_datetimes = np.concatenate(value_datetimes)
+            yield result_values_columns(
+                np.concatenate(result_ids),
+                np.concatenate(data_values),
+                value_datetimes,
+                np.full(len(value_datetimes), self.utc_offset),
+                unit_id,
+            )
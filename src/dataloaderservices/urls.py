@@ -20,7 +20,12 @@ from dataloaderservices import views
 
 urlpatterns = [
     url(r'^api/data-stream/$', views.TimeSeriesValuesApi.as_view(), name='api_post'),
+    url(r'^api/data-stream/batch/$', views.TimeSeriesValuesBatchApi.as_view(), name='api_post_batch'),
+    url(r'^api/data-stream/cache-stats/$', views.DataStreamCacheStatsApi.as_view(), name='api_post_cache_stats'),
+    url(r'^api/data-stream/throttle-stats/$', views.DataStreamThrottleStatsApi.as_view(), name='api_post_throttle_stats'),
+    url(r'^api/metrics/$', views.MetricsApi.as_view(), name='api_metrics'),
     url(r'^api/csv-values/$', views.CSVDataApi.as_view(), name='csv_data_service'),
+    url(r'^api/site-bundle/(?P<sampling_feature_code>[^/]+)/$', views.SiteBundleApi.as_view(), name='site_bundle'),
     url(r'^api/follow-site/$', views.FollowSiteApi.as_view(), name='follow_site'),
     url(r'^api/register-sensor/$', views.RegisterSensorApi.as_view(), name='register_sensor_service'),
     url(r'^api/edit-sensor/$', views.EditSensorApi.as_view(), name='edit_sensor_service'),
@@ -28,6 +33,10 @@ urlpatterns = [
     url(r'^api/delete-leafpack/$', views.DeleteLeafpackApi.as_view(), name='delete_leafpack_service'),
     url(r'^api/organization/$', views.OrganizationApi.as_view(), name='organization_service'),
     url(r'^api/output-variables/$', views.OutputVariablesApi.as_view(), name='output_variables_service'),
+    url(r'^api/upload-jobs/(?P<job_id>[0-9a-f]{32})/$', views.UploadJobStatusApi.as_view(), name='upload_job_status'),
+    url(r'^api/upload-jobs/(?P<job_id>[0-9a-f]{32})/data/$', views.UploadJobDataApi.as_view(), name='upload_job_data'),
+    url(r'^api/upload-jobs/(?P<job_id>[0-9a-f]{32})/finalize/$', views.UploadJobFinalizeApi.as_view(), name='upload_job_finalize'),
+    url(r'^api/resumable-upload/(?P<registration_id>[0-9]+)/$', views.ResumableUploadApi.as_view(), name='resumable_upload'),
     url(r'^api/data-file-upload/(?P<registration_id>.*?)$', views.SensorDataUploadView.as_view(), name='data_file_upload'),
     url(r'^api/organizations/$', views.Organizations.as_view(), name='organizations'),
 ]
@@ -1,46 +1,150 @@
 import csv
-from datetime import timedelta, datetime
+import logging
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
 from io import StringIO
-import os
+import time
+from types import SimpleNamespace
 from typing import Union, Dict, Iterable, List, Tuple, Iterator
 
+from django import db
 from django.conf import settings
 from django.forms.models import model_to_dict
-from django.http import HttpResponse, HttpRequest
+from django.http import HttpResponse, HttpRequest, StreamingHttpResponse
 from django.views.generic.base import View
 from django.db.models import QuerySet
 from django.shortcuts import reverse
-from django.utils.dateparse import parse_datetime
 from django.core.handlers.wsgi import WSGIRequest
 
 from rest_framework import exceptions
 from rest_framework import status
 from rest_framework.authentication import SessionAuthentication
+from rest_framework.negotiation import DefaultContentNegotiation
+from rest_framework.parsers import FormParser, MultiPartParser
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
+import numpy as np
 import pandas as pd
 import sqlalchemy
 import sqlalchemy.exc
 from sqlalchemy.sql import text
 
-from dataloader.models import SamplingFeature, Unit, EquipmentModel, TimeSeriesResult
+from dataloader.models import Unit, EquipmentModel, TimeSeriesResult
 from dataloaderinterface.forms import SiteSensorForm, SensorDataForm
 from dataloaderinterface.models import (
     SiteSensor,
     SiteRegistration,
     SensorOutput,
-    SensorMeasurement,
 )
-from dataloaderservices.auth import UUIDAuthentication
+from dataloaderservices.auth import (
+    UUIDAuthentication,
+    get_registration,
+    get_registrations,
+    verify_registration,
+)
+from dataloaderservices.bundle import BundleMember, spooled_member, stream_zip
+from dataloaderservices.cache import (
+    get_cache_stats,
+    result_uuid_cache,
+    unit_cache,
+)
+from dataloaderservices.conditional import (
+    conditional_response,
+    export_validators,
+    set_validator_headers,
+)
+from dataloaderservices.coverage import ResultCoverage, drop_existing_values
+from dataloaderservices.export import (
+    AGGREGATION_INTERVALS,
+    AGGREGATION_STATS,
+    EXPORT_FORMATS,
+    Aggregation,
+    iter_data_rows,
+)
+from dataloaderservices.export_cache import export_cache
+from dataloaderservices.idempotency import idempotency_key, replay_cache
+from dataloaderservices.metadata import (
+    build_csv_metadata,
+    clean_variable_codes,
+    format_csv_metadata,
+    load_metadata_records,
+    read_template,
+)
+from dataloaderservices.metrics import RequestTimer, StageTimingMixin, metrics
+from dataloaderservices.parsers import (
+    DataStreamMessagePackParser,
+    GzipJSONParser,
+    UploadChunkParser,
+)
+from dataloaderservices.payloads import DataStreamPayload, parse_data_stream_payload
 from dataloaderservices.serializers import OrganizationSerializer
+from dataloaderservices.spool import data_stream_spool
+from dataloaderservices.throttling import (
+    RegistrationTokenThrottle,
+    data_stream_gate,
+    get_throttle_stats,
+)
+from dataloaderservices.summary import ResultSummaryDeltas, ResultSummaryWriteBehind
+from dataloaderservices.upload_jobs import (
+    RECEIVING as UPLOAD_RECEIVING,
+    UploadChunkError,
+    UploadJob,
+    UploadOffsetError,
+    upload_executor,
+)
+from dataloaderservices.uploads import SensorDataFileParser, parse_local_datetime
+from dataloaderservices.writer import (
+    WriteResult,
+    result_values_columns,
+    write_partitioned,
+    write_result_values,
+)
 from leafpack.models import LeafPack
+from leafpack.views import get_leafpack_csv
 from odm2 import odm2datamodels
 from odm2.crud.public import site_registration_followed_by as srfb_crud
+from streamwatch.models import samplingfeature_assessment_ids
+from streamwatch.views import get_streamwatch_csv
+
+logger = logging.getLogger(__name__)
 
 _dbsettings = settings.DATABASES["default"]
 _connection_str = f"postgresql://{_dbsettings['USER']}:{_dbsettings['PASSWORD']}@{_dbsettings['HOST']}:{_dbsettings['PORT']}/{_dbsettings['NAME']}"
 _db_engine = sqlalchemy.create_engine(_connection_str, pool_size=10, pool_recycle=1800)
+# downloads hold a connection for as long as they stream, so they get a small pool of
+# their own instead of taking the connections of data-stream posts and uploads; a
+# download finding every export connection in use waits for one to be returned
+_export_engine = sqlalchemy.create_engine(
+    _connection_str,
+    pool_size=getattr(settings, "EXPORT_DB_POOL_SIZE", 5),
+    max_overflow=0,
+    pool_timeout=getattr(settings, "EXPORT_DB_POOL_TIMEOUT", 30),
+    pool_recycle=1800,
+)
+
+# None unless result summary updates are deferred to a background flush (RESULT_SUMMARY_WINDOW)
+_result_summary_window = getattr(settings, "RESULT_SUMMARY_WINDOW", 0)
+result_summary_write_behind = (
+    ResultSummaryWriteBehind(_db_engine, _result_summary_window)
+    if _result_summary_window
+    else None
+)
+
+# uploads write each chunk split by result over this many connections at once; the
+# pool is shared by all uploads of the process, bounding the connections they hold
+UPLOAD_WRITE_PARALLELISM = getattr(settings, "UPLOAD_WRITE_PARALLELISM", 1)
+upload_write_executor = (
+    ThreadPoolExecutor(UPLOAD_WRITE_PARALLELISM, thread_name_prefix="upload-write")
+    if UPLOAD_WRITE_PARALLELISM > 1
+    else None
+)
+
+# site bundles generate their files in this pool, shared by all the bundle downloads
+# of the process; each member holds an export connection while it is generated
+SITE_BUNDLE_THREADS = getattr(settings, "SITE_BUNDLE_THREADS", 4)
+site_bundle_executor = ThreadPoolExecutor(SITE_BUNDLE_THREADS, thread_name_prefix="site-bundle")
 
 odm2_engine = odm2datamodels.odm2_engine
 odm2_models = odm2datamodels.models
@@ -227,69 +331,8 @@ class FollowSiteApi(APIView):
         return Response({}, status.HTTP_200_OK)
 
 
-class SensorDataUploadView(APIView):
+class SensorDataUploadView(StageTimingMixin, APIView):
     authentication_classes = (SessionAuthentication,)
-    header_row_indicators = (
-        "Data Logger",
-        "Sampling Feature",
-        "Sensor",
-        "Variable",
-        "Result",
-        "Date and Time",
-        "Code",
-    )
-
-    def should_skip_row(self, row):
-        if row[0].startswith(self.header_row_indicators):
-            return True
-
-    def decode_utf8_sig(self, input_iterator: Iterable[bytes]) -> Iterator[str]:
-        for item in input_iterator:
-            yield item.decode("utf-8-sig")
-
-    def build_results_dict(self, data_file):
-        results = {"utc_offset": 0, "site_uuid": "", "results": {}}
-        got_feature_uuid = False
-        got_result_uuids = False
-        got_UTC_offset = False
-
-        for row in csv.reader(self.decode_utf8_sig(data_file)):
-            if row[0].startswith("Sampling Feature") and not got_feature_uuid:
-                results["site_uuid"] = (
-                    row[0]
-                    .replace("Sampling Feature UUID: ", "")
-                    .replace("Sampling Feature: ", "")
-                )
-                got_feature_uuid = True
-
-                # oldest csv's from modular sensors have the result UUID's
-                # in the same row as the sampling feature UUID
-                # build dict with the rest of the columns
-                if len(row) > 1:
-                    if row[1] != "" and not got_result_uuids:
-                        results["results"] = {
-                            uuid: {"index": uuid_index, "values": []}
-                            for uuid_index, uuid in enumerate(row[1:], start=1)
-                        }
-                        got_result_uuids = True
-
-            elif row[0].startswith("Result UUID:") and not got_result_uuids:
-                results["results"] = {
-                    uuid: {"index": uuid_index, "values": []}
-                    for uuid_index, uuid in enumerate(row[1:], start=1)
-                }
-                got_result_uuids = True
-
-            elif row[0].startswith("Date and Time"):
-                results["utc_offset"] = int(
-                    row[0].replace("Date and Time in UTC", "").replace("+", "")
-                )
-                got_UTC_offset = True
-
-            if got_feature_uuid and got_result_uuids and got_UTC_offset:
-                break
-
-        return results
 
     def post(self, request, *args, **kwargs):
         if "registration_id" not in kwargs:
@@ -298,21 +341,11 @@ class SensorDataUploadView(APIView):
                 status=status.HTTP_400_BAD_REQUEST,
             )
 
-        registration = (
-            SiteRegistration.objects.prefetch_related("sensors")
-            .filter(pk=kwargs["registration_id"])
-            .first()
+        registration, error_response = get_administered_registration(
+            request, kwargs["registration_id"]
         )
-        if not registration:
-            return Response(
-                {"error:": "Registration not found"}, status=status.HTTP_404_NOT_FOUND
-            )
-
-        if not request.user.can_administer_site(registration.sampling_feature_id):
-            return Response(
-                {"error": "Not allowed to edit this site"},
-                status=status.HTTP_403_FORBIDDEN,
-            )
+        if error_response:
+            return error_response
 
         form = SensorDataForm(request.POST, request.FILES)
 
@@ -321,111 +354,421 @@ class SensorDataUploadView(APIView):
             return Response(error_data, status=status.HTTP_206_PARTIAL_CONTENT)
 
         data_file = request.FILES["data_file"]
-        results_mapping = self.build_results_dict(data_file)
-
-        if (
-            str(registration.sampling_feature.sampling_feature_uuid)
-            != results_mapping["site_uuid"]
-        ):
+        # only the header is read here, to reject files of another site right away
+        with request.timer.stage("header"):
+            parser = SensorDataFileParser(data_file)
+        if str(registration.sampling_feature.sampling_feature_uuid) != parser.site_uuid:
             return Response(
                 {"error": "This file corresponds to another site."},
                 status=status.HTTP_406_NOT_ACCEPTABLE,
             )
 
-        data_value_units = Unit.objects.get(unit_name="hour minute")
-        sensors = registration.sensors.all()
+        if is_dry_run(request):
+            with request.timer.stage("dry_run"):
+                summary = summarize_sensor_data_file(registration, parser)
+            return Response(summary, status.HTTP_200_OK)
 
-        result_values = []
-        warnings = []
-        for row in csv.reader(self.decode_utf8_sig(data_file)):
-            if self.should_skip_row(row):
-                continue
-            else:
-                try:
-                    measurement_datetime = parse_datetime(row[0])
-                    if not measurement_datetime:
-                        measurement_datetime = pd.to_datetime(row[0])
-                    if not measurement_datetime:
-                        raise ValueError
-                except (ValueError, TypeError):
-                    warnings.append("Unrecognized date format: {}".format(row[0]))
-                    continue
-                measurement_datetime = measurement_datetime.replace(
-                    tzinfo=None
-                ) - timedelta(hours=results_mapping["utc_offset"])
-
-                for sensor in sensors:
-                    uuid = str(sensor.result_uuid)
-                    if uuid not in results_mapping["results"]:
-                        # TODO - consider revised approach where we loop over column in CSV and not all sensors
-                        # this would allow us to return warning that result uuid is not recognized.
-                        continue
-
-                    data_value = row[results_mapping["results"][uuid]["index"]]
-                    if len(data_value) == 0:
-                        continue
-                    result_value = TimeseriesResultValueTechDebt(
-                        result_id=sensor.result_id,
-                        data_value=data_value,
-                        utc_offset=results_mapping["utc_offset"],
-                        value_datetime=measurement_datetime,
-                        censor_code="Not censored",
-                        quality_code="None",
-                        time_aggregation_interval=1,
-                        time_aggregation_interval_unit=data_value_units.unit_id,
-                    )
-                    result_values.append(result_value)
+        # the file is processed in the background, see upload_jobs
+        job = UploadJob.create(
+            registration.registration_id, registration.sampling_feature_id, data_file
+        )
+        return queue_upload_job(job)
 
-            if len(result_values) > 100000:
-                with _db_engine.begin() as connection:
-                    insert_timeseries_result_values_bulk(result_values, connection)
-                result_values = []
 
-        if len(result_values) > 0:
-            with _db_engine.begin() as connection:
-                insert_timeseries_result_values_bulk(result_values, connection)
-            result_values = []
-
-        # block is responsible for keeping separate dataloader database metadata in sync
-        # long term plan is to eliminate this, but need to keep for the now
-        for sensor in sensors:
-            uuid = str(sensor.result_uuid)
-            if uuid not in results_mapping["results"]:
-                print(
-                    "uuid {} in file does not correspond to a measured variable in {}".format(
-                        uuid, registration.sampling_feature_code
-                    )
-                )
-                continue
-            last_data_value = row[results_mapping["results"][uuid]["index"]]
-            last_measurement = SensorMeasurement.objects.filter(sensor=sensor).first()
-            if not last_measurement:
-                SensorMeasurement.objects.create(
-                    sensor=sensor,
-                    value_datetime=measurement_datetime,
-                    value_datetime_utc_offset=timedelta(
-                        hours=results_mapping["utc_offset"]
-                    ),
-                    data_value=last_data_value,
-                )
-        # end meta data syncing block
-
-        # TODO: Decouple email from this method by having email sender class
-        # subject = 'Data Sharing Portal data upload completed'
-        # message = 'Your data upload for site {} is complete.'.format(registration.sampling_feature_code)
-        # sender = "\"Data Sharing Portal Upload\" <data-upload@usu.edu>"
-        # addresses = [request.user.email]
-        # if send_mail(subject, message, sender, addresses, fail_silently=True):
-        #    print('email sent!')
-        if warnings:
-            return Response({"warnings": warnings}, status.HTTP_206_PARTIAL_CONTENT)
+def get_administered_registration(
+    request, registration_id
+) -> Tuple[SiteRegistration, Response]:
+    """The registration to upload data to, or an error response if the user can't."""
+    registration = (
+        SiteRegistration.objects.prefetch_related("sensors")
+        .filter(pk=registration_id)
+        .first()
+    )
+    if not registration:
+        return None, Response(
+            {"error": "Registration not found"}, status=status.HTTP_404_NOT_FOUND
+        )
+    if not request.user.can_administer_site(registration.sampling_feature_id):
+        return None, Response(
+            {"error": "Not allowed to edit this site"},
+            status=status.HTTP_403_FORBIDDEN,
+        )
+    return registration, None
+
+
+def get_administered_upload_job(request, job_id: str) -> Tuple[UploadJob, Response]:
+    job = UploadJob.load(job_id)
+    if not job:
+        return None, Response(
+            {"error": "Upload job not found"}, status=status.HTTP_404_NOT_FOUND
+        )
+    if not request.user.can_administer_site(job.state["sampling_feature_id"]):
+        return None, Response(
+            {"error": "Not allowed to view this upload"},
+            status=status.HTTP_403_FORBIDDEN,
+        )
+    return job, None
+
+
+def queue_upload_job(job: UploadJob) -> Response:
+    if upload_executor is not None:
+        upload_executor.submit(run_upload_job, job.job_id)
+    return Response(
+        {
+            "job_id": job.job_id,
+            "status_url": reverse("upload_job_status", args=[job.job_id]),
+        },
+        status.HTTP_202_ACCEPTED,
+    )
+
+
+class UploadJobStatusApi(APIView):
+    """Progress of a background data file upload started by SensorDataUploadView."""
+
+    authentication_classes = (SessionAuthentication,)
+
+    def get(self, request, job_id, format=None):
+        job, error_response = get_administered_upload_job(request, job_id)
+        if error_response:
+            return error_response
+        return Response(job.to_dict(), status.HTTP_200_OK)
+
+
+class ResumableUploadApi(APIView):
+    """
+    Starts a data file upload sent in chunks, for files too large to send reliably
+    in one request:
+
+    1. POST {"file_name": "...", "size": <bytes>, "sha256": "<hex, optional>"}
+       here; the response has the job id and the `upload_url` chunks go to.
+    2. PUT each piece to `upload_url?offset=<bytes sent so far>` as
+       application/octet-stream, optionally with a `Content-SHA256` header (hex)
+       for the piece. After a failure, GET the `status_url` and resume from
+       `received`.
+    3. POST to `finalize_url` once all bytes are sent; the file is checked
+       against its size and checksum and processed like a regular upload.
+    """
+
+    authentication_classes = (SessionAuthentication,)
+
+    def post(self, request, registration_id, format=None):
+        registration, error_response = get_administered_registration(
+            request, registration_id
+        )
+        if error_response:
+            return error_response
+
+        try:
+            file_name = str(request.data["file_name"])
+            size = int(request.data["size"])
+            sha256 = request.data.get("sha256") or None
+        except (KeyError, TypeError, ValueError):
+            return Response(
+                {"error": "file_name and size are required"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        if size <= 0:
+            return Response(
+                {"error": "size must be positive"}, status=status.HTTP_400_BAD_REQUEST
+            )
+
+        job = UploadJob.start_upload(
+            registration.registration_id,
+            registration.sampling_feature_id,
+            file_name,
+            size,
+            sha256,
+        )
         return Response(
-            {"message": "file has been processed successfully"}, status.HTTP_200_OK
+            {
+                "job_id": job.job_id,
+                "offset": 0,
+                "upload_url": reverse("upload_job_data", args=[job.job_id]),
+                "finalize_url": reverse("upload_job_finalize", args=[job.job_id]),
+                "status_url": reverse("upload_job_status", args=[job.job_id]),
+            },
+            status.HTTP_201_CREATED,
         )
 
 
+class UploadJobDataApi(StageTimingMixin, APIView):
+    """Receives one chunk of a resumable upload, see ResumableUploadApi."""
+
+    authentication_classes = (SessionAuthentication,)
+    parser_classes = (UploadChunkParser,)
+
+    def put(self, request, job_id, format=None):
+        job, error_response = get_administered_upload_job(request, job_id)
+        if error_response:
+            return error_response
+        if job.state["status"] != UPLOAD_RECEIVING:
+            return Response(
+                {"error": "This upload is already complete"},
+                status=status.HTTP_409_CONFLICT,
+            )
+        try:
+            offset = int(request.query_params["offset"])
+        except (KeyError, ValueError):
+            return Response(
+                {"error": "offset is required"}, status=status.HTTP_400_BAD_REQUEST
+            )
+
+        try:
+            with request.timer.stage("write"):
+                received = job.write_chunk(
+                    offset, request.data, request.META.get("HTTP_CONTENT_SHA256")
+                )
+        except UploadOffsetError as e:
+            return Response(
+                {"error": str(e), "offset": e.received}, status=status.HTTP_409_CONFLICT
+            )
+        except UploadChunkError as e:
+            return Response(
+                {"error": str(e), "offset": e.received},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        return Response({"offset": received}, status.HTTP_200_OK)
+
+
+class UploadJobFinalizeApi(APIView):
+    """Queues a resumable upload for processing once all of it arrived."""
+
+    authentication_classes = (SessionAuthentication,)
+
+    def post(self, request, job_id, format=None):
+        job, error_response = get_administered_upload_job(request, job_id)
+        if error_response:
+            return error_response
+        if job.state["status"] != UPLOAD_RECEIVING:
+            return Response(
+                {"error": "This upload is already complete"},
+                status=status.HTTP_409_CONFLICT,
+            )
+        try:
+            job.complete_upload()
+        except UploadChunkError as e:
+            return Response(
+                {"error": str(e), "offset": e.received},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        return queue_upload_job(job)
+
+
+def import_sensor_data_file(
+    registration: SiteRegistration,
+    data_file: Iterable[bytes],
+    timer: RequestTimer,
+    job: UploadJob = None,
+) -> Tuple[SensorDataFileParser, WriteResult]:
+    """Parses and writes a logger data file, reporting progress to `job` after each chunk."""
+    with timer.stage("header"):
+        parser = SensorDataFileParser(data_file)
+    if str(registration.sampling_feature.sampling_feature_uuid) != parser.site_uuid:
+        raise exceptions.NotAcceptable("This file corresponds to another site.")
+
+    data_value_unit_id = get_unit_id("hour minute")
+    sensors = registration.sensors.all()
+    column_results = parser.map_columns(
+        {str(sensor.result_uuid): sensor.result_id for sensor in sensors}
+    )
+
+    written = WriteResult()
+    with timer.stage("coverage"), _db_engine.begin() as connection:
+        coverage = ResultCoverage.load(connection, column_results.values())
+
+    def write_partition(result_values: pd.DataFrame, connection) -> WriteResult:
+        # rows already in the database are counted but never sent back to it
+        with timer.stage("dedupe"):
+            result_values, present = drop_existing_values(
+                result_values, connection, coverage
+            )
+        with timer.stage("write"):
+            return present + write_result_values(result_values, connection)
+
+    rows_started = time.perf_counter()
+    for result_values in parser.chunks(column_results, data_value_unit_id):
+        with timer.stage("insert"):
+            written += write_partitioned(
+                result_values,
+                _db_engine,
+                upload_write_executor,
+                UPLOAD_WRITE_PARALLELISM,
+                write_partition,
+            )
+        if job is not None:
+            job.report_progress(parser.rows_parsed, written, parser.warnings)
+    # time spent reading rows, without the database work interleaved with it
+    timer.record(
+        "rows",
+        (time.perf_counter() - rows_started) * 1000 - timer.stages.get("insert", 0),
+    )
+    timer.count("rows", written.total)
+    timer.count("inserted", written.inserted_count)
+    timer.count("duplicates", written.conflicting_count)
+    if job is not None:
+        job.report_progress(parser.rows_parsed, written, parser.warnings)
+
+    for sensor in sensors:
+        uuid = str(sensor.result_uuid)
+        if uuid not in parser.result_columns:
+            logger.info(
+                "Sensor %s of %s is not in the uploaded file",
+                uuid,
+                registration.sampling_feature_code,
+            )
+
+    # the same summaries as data-stream posts: the latest measurement of each sensor,
+    # and valuecount/resultdatetime, which the download validators are built from
+    with timer.stage("summaries"):
+        summaries = ResultSummaryDeltas()
+        summaries.add_latest(
+            TimeseriesResultValueTechDebt(
+                result_id=result_id,
+                data_value=data_value,
+                value_datetime=value_datetime,
+                utc_offset=parser.utc_offset,
+                censor_code="Not censored",
+                quality_code="None",
+                time_aggregation_interval=1,
+                time_aggregation_interval_unit=data_value_unit_id,
+            )
+            for result_id, (value_datetime, data_value) in parser.latest_values.items()
+        )
+        summaries.add_counts(written.inserted)
+        if summaries:
+            with _db_engine.begin() as connection:
+                write_result_summaries(summaries, connection)
+
+    # TODO: Decouple email from this method by having email sender class
+    # subject = 'Data Sharing Portal data upload completed'
+    # message = 'Your data upload for site {} is complete.'.format(registration.sampling_feature_code)
+    # sender = "\"Data Sharing Portal Upload\" <data-upload@usu.edu>"
+    # addresses = [request.user.email]
+    # if send_mail(subject, message, sender, addresses, fail_silently=True):
+    #    print('email sent!')
+    return parser, written
+
+
+# data rows a dry run parses; the rest of the file is only counted
+DRY_RUN_SAMPLE_ROWS = 10000
+# bad timestamps listed in a dry run summary; all of the sample's are counted
+DRY_RUN_MAX_BAD_TIMESTAMPS = 20
+
+
+def is_dry_run(request) -> bool:
+    dry_run = request.query_params.get("dry_run") or request.data.get("dry_run")
+    return str(dry_run).lower() in ("1", "true", "yes", "on")
+
+
+def summarize_sensor_data_file(
+    registration: SiteRegistration, parser: SensorDataFileParser
+) -> Dict:
+    """
+    What uploading a file would do, without touching the values. Only the first
+    `DRY_RUN_SAMPLE_ROWS` data rows are parsed (value counts and bad timestamps are
+    the sample's); the rest of the file is counted by the csv tokenizer, and its last
+    row read for the date range.
+    """
+    sensors = {
+        str(sensor.result_uuid): sensor
+        for sensor in registration.sensors.select_related("sensor_output")
+    }
+    column_results = parser.map_columns(
+        {uuid: sensor.result_id for uuid, sensor in sensors.items()}
+    )
+    value_counts = {}
+    for result_values in parser.chunks(
+        column_results, None, max_rows=DRY_RUN_SAMPLE_ROWS
+    ):
+        for result_id, count in result_values["result_id"].value_counts().items():
+            value_counts[result_id] = value_counts.get(result_id, 0) + int(count)
+    rows_sampled = parser.rows_parsed + len(parser.warnings)
+    rows_left, last_row = parser.count_rows()
+    last_datetime = parser.last_datetime
+    if last_row is not None:
+        last = parse_local_datetime(last_row[0])
+        if not pd.isna(last) and (last_datetime is None or last > last_datetime):
+            last_datetime = last
+
+    columns = []
+    for uuid, index in sorted(parser.result_columns.items(), key=lambda item: item[1]):
+        sensor = sensors.get(uuid)
+        output = sensor.sensor_output if sensor else None
+        columns.append(
+            {
+                "column": index,
+                "result_uuid": uuid,
+                "variable_code": output.variable_code if output else None,
+                "variable_name": output.variable_name if output else None,
+                "unit": output.unit_abbreviation if output else None,
+                "values": value_counts.get(sensor.result_id, 0) if sensor else 0,
+            }
+        )
+
+    return {
+        "dry_run": True,
+        "utc_offset": parser.utc_offset,
+        "rows": rows_sampled + rows_left,
+        "rows_sampled": rows_sampled,
+        "rows_parsed": parser.rows_parsed,
+        "first_datetime": parser.first_datetime,
+        "last_datetime": last_datetime,
+        "columns": columns,
+        "unrecognized_uuids": [
+            uuid for uuid in parser.result_columns if uuid not in sensors
+        ],
+        "sensors_not_in_file": [
+            uuid for uuid in sensors if uuid not in parser.result_columns
+        ],
+        "bad_timestamp_count": len(parser.warnings),
+        "bad_timestamps": parser.warnings[:DRY_RUN_MAX_BAD_TIMESTAMPS],
+    }
+
+
+def run_upload_job(job_id: str) -> bool:
+    """Processes a queued upload job; False if another worker already claimed it."""
+    job = UploadJob.load(job_id)
+    if not job or not job.claim():
+        return False
+
+    timer = RequestTimer("SensorDataUploadJob")
+    error = None
+    try:
+        registration = (
+            SiteRegistration.objects.prefetch_related("sensors")
+            .filter(pk=job.state["registration_id"])
+            .first()
+        )
+        if not registration:
+            raise exceptions.NotFound("Registration not found")
+        with open(job.data_path, "rb") as data_file:
+            import_sensor_data_file(registration, data_file, timer, job)
+    except exceptions.APIException as e:
+        error = str(e.detail)
+    except Exception:
+        logger.exception("Upload job %s failed", job_id)
+        error = "Failed to process the file because of a server error."
+    finally:
+        # worker threads get their own Django connection, don't leave it open
+        db.connection.close()
+    job.finish(error)
+    timer.finish(status.HTTP_500_INTERNAL_SERVER_ERROR if error else status.HTTP_200_OK)
+    return True
+
+
+class DownloadFormatNegotiation(DefaultContentNegotiation):
+    """
+    Content negotiation that leaves the `format` query parameter alone: downloads use
+    it for their file format, which DRF would otherwise look for among the renderers
+    of the (error) responses and answer 404.
+    """
+
+    settings = SimpleNamespace(URL_FORMAT_OVERRIDE=None)
+
+
 class CSVDataApi(APIView):
     authentication_classes = ()
+    content_negotiation_class = DownloadFormatNegotiation
 
     date_format = "%Y-%m-%d %H:%M:%S"
 
@@ -456,6 +799,53 @@ class CSVDataApi(APIView):
                 {"message": "result_id(s) must be a list of integers."}, code=400
             )
 
+    @staticmethod
+    def extract_export_format(request: WSGIRequest):
+        name = request.GET.get("format", "csv").lower()
+        if name not in EXPORT_FORMATS:
+            raise exceptions.ValidationError(
+                {
+                    "message": "format must be one of: {}.".format(
+                        ", ".join(EXPORT_FORMATS)
+                    )
+                },
+                code=400,
+            )
+        return EXPORT_FORMATS[name]
+
+    @staticmethod
+    def extract_aggregation(request: WSGIRequest) -> Aggregation | None:
+        interval = request.GET.get("aggregate", None)
+        stats = request.GET.get("stat", None)
+        if not interval:
+            if stats:
+                raise exceptions.ValidationError(
+                    {"message": "stat requires an aggregate interval."}, code=400
+                )
+            return None
+        if interval not in AGGREGATION_INTERVALS:
+            raise exceptions.ValidationError(
+                {
+                    "message": "aggregate must be one of: {}.".format(
+                        ", ".join(AGGREGATION_INTERVALS)
+                    )
+                },
+                code=400,
+            )
+        stats = [stat.strip() for stat in (stats or "mean").split(",")]
+        if not all(stat in AGGREGATION_STATS for stat in stats) or len(set(stats)) < len(
+            stats
+        ):
+            raise exceptions.ValidationError(
+                {
+                    "message": "stat must be a list of distinct values among: {}.".format(
+                        ", ".join(AGGREGATION_STATS)
+                    )
+                },
+                code=400,
+            )
+        return Aggregation(interval, stats)
+
     def get(self, request: WSGIRequest, *args, **kwargs) -> HttpResponse:
         """
         Downloads csv file for given result id's.
@@ -465,9 +855,31 @@ class CSVDataApi(APIView):
 
         example request to download csv data for multiple series:
                 curl -X GET http://localhost:8000/api.csv-values/?result_ids=100,101,102
+
+        example request to download the same data as Parquet (or `format=arrow` for
+        an Arrow IPC stream), with typed columns and the csv header as file metadata:
+                curl -X GET http://localhost:8000/api.csv-values/?result_ids=100,101&format=parquet
+
+        example request to download it as a CF conventions NetCDF file:
+                curl -X GET http://localhost:8000/api.csv-values/?result_ids=100,101&format=netcdf
+
+        example request to download daily statistics (`aggregate=hour|day|week` of
+        local time, `stat=mean,min,max,count`, mean by default), computed in the database:
+                curl -X GET http://localhost:8000/api.csv-values/?result_ids=100&aggregate=day&stat=mean,max
+
+        Responses carry an ETag and Last-Modified, and a request whose If-None-Match
+        (or If-Modified-Since) matches gets a 304 without the data:
+                curl -X GET -H 'If-None-Match: W/"<etag>"' http://localhost:8000/api.csv-values/?result_ids=100
         """
 
         result_ids = self.extract_and_parse_resultid(request)
+        export_format = self.extract_export_format(request)
+        aggregation = self.extract_aggregation(request)
+        if not export_format.available:
+            return Response(
+                {"message": "This download format is not supported by this server."},
+                status=status.HTTP_406_NOT_ACCEPTABLE,
+            )
 
         # optional date range
         max_datetime = self.extract_and_parse_datetime(request, "max_datetime")
@@ -478,31 +890,57 @@ class CSVDataApi(APIView):
                 code=400,
             )
 
+        # answered from what odm2.results says, before any value is read
+        etag, last_modified = export_validators(result_ids, request.GET)
+        not_modified = conditional_response(request, etag, last_modified)
+        if not_modified is not None:
+            return not_modified
+
         try:
-            filename, csv_file = CSVDataApi.get_csv_file(
-                result_ids,
-                request=request,
-                max_datetime=max_datetime,
-                min_datetime=min_datetime,
-            )
+            time_series_result = CSVDataApi.get_time_series_results(result_ids)
         except ValueError as e:
-            return Response({"error": e.message})  # Time Series Result not found.
-
-        response = HttpResponse(csv_file.getvalue(), content_type="text/csv")
-        response["Content-Disposition"] = 'attachment; filename="%s.csv"' % filename
-        return response
+            return Response({"error": str(e)})  # Time Series Result not found.
+
+        # the data is streamed as it is read, so long series don't have to fit in memory
+        records = load_metadata_records(time_series_result)
+        metadata = format_csv_metadata(records, request=request, aggregation=aggregation)
+        series_ids = [ts_result.pk for ts_result in time_series_result]
+        if export_cache and not (max_datetime or min_datetime or aggregation):
+            # the whole history, only the latest values are read from the database
+            rows = export_cache.iter_data_rows(
+                _export_engine, series_ids, typed=export_format.typed
+            )
+        else:
+            rows = iter_data_rows(
+                _export_engine,
+                series_ids,
+                max_datetime.to_pydatetime() if max_datetime else None,
+                min_datetime.to_pydatetime() if min_datetime else None,
+                typed=export_format.typed,
+                aggregation=aggregation,
+            )
+        response = StreamingHttpResponse(
+            export_format.write(
+                metadata,
+                CSVDataApi.get_csv_headers(
+                    records.time_series_results,
+                    aggregation.stats if aggregation else None,
+                ),
+                rows,
+                records,
+                aggregation,
+            ),
+            content_type=export_format.content_type,
+        )
+        filename = CSVDataApi.get_csv_filename(time_series_result, result_ids)
+        response["Content-Disposition"] = 'attachment; filename="%s.%s"' % (
+            filename,
+            export_format.extension,
+        )
+        return set_validator_headers(response, etag, last_modified)
 
     @staticmethod
-    def get_csv_file(
-        result_ids: List[str],
-        request: WSGIRequest = None,
-        max_datetime=None,
-        min_datetime=None,
-    ) -> Tuple[str, StringIO]:
-        """
-        Gathers time series data for the passed in result id's to generate a csv file for download
-        """
-
+    def get_time_series_results(result_ids: List[str]) -> QuerySet:
         try:
             # Some duck typing here to check if `result_ids` is an iterable,
             # and if it's not, filter using 'pk__in'
@@ -533,20 +971,15 @@ class CSVDataApi(APIView):
         if not time_series_result.count():
             raise ValueError(
                 "Time Series Result(s) not found (result id(s): {}).".format(
-                    ", ".join(result_ids)
+                    ", ".join(map(str, result_ids))
+                    if isinstance(result_ids, (list, tuple))
+                    else result_ids
                 )
             )
+        return time_series_result
 
-        csv_file = StringIO()
-        csv_writer = csv.writer(csv_file)
-        csv_file.write(
-            CSVDataApi.generate_metadata(time_series_result, request=request)
-        )
-        csv_writer.writerow(CSVDataApi.get_csv_headers(time_series_result))
-        csv_writer.writerows(
-            CSVDataApi.get_data_values(result_ids, max_datetime, min_datetime)
-        )
-
+    @staticmethod
+    def get_csv_filename(time_series_result: QuerySet, result_ids) -> str:
         result = time_series_result.first().result
 
         try:
@@ -555,358 +988,700 @@ class CSVDataApi(APIView):
             resultids_len = 1
 
         if resultids_len > 1:
-            filename = "{}_TimeSeriesResults".format(
+            return "{}_TimeSeriesResults".format(
                 result.feature_action.sampling_feature.sampling_feature_code
             )
-        else:
-            filename = "{0}_{1}_{2}".format(
-                result.feature_action.sampling_feature.sampling_feature_code,
-                result.variable.variable_code,
-                result.result_id,
+        return "{0}_{1}_{2}".format(
+            result.feature_action.sampling_feature.sampling_feature_code,
+            result.variable.variable_code,
+            result.result_id,
+        )
+
+    @staticmethod
+    def get_csv_file(
+        result_ids: List[str],
+        request: WSGIRequest = None,
+        max_datetime=None,
+        min_datetime=None,
+    ) -> Tuple[str, StringIO]:
+        """
+        Gathers time series data for the passed in result id's to generate a csv file for download
+        """
+        time_series_result = CSVDataApi.get_time_series_results(result_ids)
+
+        csv_file = StringIO()
+        csv_writer = csv.writer(csv_file)
+        csv_file.write(
+            CSVDataApi.generate_metadata(time_series_result, request=request)
+        )
+        csv_writer.writerow(CSVDataApi.get_csv_headers(time_series_result))
+        csv_writer.writerows(
+            CSVDataApi.get_data_values(
+                [ts_result.pk for ts_result in time_series_result],
+                max_datetime,
+                min_datetime,
             )
+        )
 
+        filename = CSVDataApi.get_csv_filename(time_series_result, result_ids)
         return filename, csv_file
 
     @staticmethod
-    def get_csv_headers(ts_results: List[TimeSeriesResult]) -> None:
+    def get_csv_headers(
+        ts_results: List[TimeSeriesResult], stats: List[str] = None
+    ) -> List[str]:
         headers = ["DateTimeUTC", "UTCOffset", "DateTimeLocalized"]
-        var_codes = [
-            ts_result.result.variable.variable_code for ts_result in ts_results
-        ]
-        return headers + CSVDataApi.clean_variable_codes(var_codes)
+        var_codes = CSVDataApi.clean_variable_codes(
+            [ts_result.result.variable.variable_code for ts_result in ts_results]
+        )
+        if stats:
+            # one column per statistic of each series, e.g. AirTemp_mean
+            return headers + [
+                "{}_{}".format(var_code, stat) for var_code in var_codes for stat in stats
+            ]
+        return headers + var_codes
 
     @staticmethod
     def clean_variable_codes(varcodes: List[str]) -> List[str]:
-        """
-        Looks for duplicate variable codes and appends a number if collisions exist.
-
-        Example:
-            codes = clean_variable_codes(['foo', 'bar', 'foo'])
-            print(codes)
-            # ['foo-1', 'bar', 'foo-2']
-        """
-        for varcode in varcodes:
-            count = varcodes.count(varcode)
-            if count > 1:
-                counter = 1
-                for i in range(0, len(varcodes)):
-                    if varcodes[i] == varcode:
-                        varcodes[i] = "{}-{}".format(varcode, counter)
-                        counter += 1
-        return varcodes
+        return clean_variable_codes(varcodes)
 
     @staticmethod
     def get_data_values(
         result_ids: list[int],
         max_datetime: datetime | None,
         min_datetime: datetime | None,
-    ) -> object:
-        query = (
-            sqlalchemy.select(
-                odm2_models.TimeSeriesResultValues.resultid,
-                odm2_models.TimeSeriesResultValues.datavalue,
-                odm2_models.TimeSeriesResultValues.valuedatetime,
-                odm2_models.TimeSeriesResultValues.valuedatetimeutcoffset,
-            )
-            .filter(odm2_models.TimeSeriesResultValues.resultid.in_(result_ids))
-            .order_by(
-                odm2_models.TimeSeriesResultValues.valuedatetime,
-                odm2_models.TimeSeriesResultValues.resultid,
-            )
-        )
-
-        # the data is store relateive UTC time, we want to filter date relative to local time
-        # just pull and extra day on either side and then we can subset the data further down
-        if max_datetime:
-            query = query.filter(
-                odm2_models.TimeSeriesResultValues.valuedatetime
-                <= max_datetime + timedelta(days=1)
-            )
-        if min_datetime:
-            query = query.filter(
-                odm2_models.TimeSeriesResultValues.valuedatetime
-                >= min_datetime - timedelta(days=1)
-            )
-
-        df = odm2_engine.read_query(query, output_format="dataframe")
-
-        # convert into datetime for vector calculation to utc datetime
-        df["valuedatetime"] = pd.to_datetime(df["valuedatetime"])
-        df["valuedatetime_local"] = df["valuedatetime"] + pd.to_timedelta(
-            df["valuedatetimeutcoffset"], unit="hours"
-        )
-
-        # filter data based on filters
-        if max_datetime:
-            df = df[df["valuedatetime_local"] <= max_datetime]
-        if min_datetime:
-            df = df[df["valuedatetime_local"] >= min_datetime]
-
-        piv = pd.pivot_table(
-            df,
-            ["datavalue"],
-            ["valuedatetime", "valuedatetimeutcoffset", "valuedatetime_local"],
-            ["resultid"],
-        )
-
-        vals = piv.to_numpy()
-        dt = piv.index.get_level_values(0).astype(str)
-        utc_off = piv.index.get_level_values(1).astype(str)
-        dt_utc = piv.index.get_level_values(2).astype(str)
-        z = list(zip(dt, utc_off, dt_utc, vals))
-        lst = [[i[0], i[1], i[2], *i[3]] for i in z]
-
-        return lst
+    ) -> List[list]:
+        """Wide rows of the results' values, one value column per result in id order."""
+        if isinstance(result_ids, (int, str)):
+            result_ids = [result_ids]
+        result_ids = sorted(set(int(result_id) for result_id in result_ids))
+        if export_cache and not (max_datetime or min_datetime):
+            return list(export_cache.iter_data_rows(_export_engine, result_ids))
+        return list(iter_data_rows(_export_engine, result_ids, max_datetime, min_datetime))
 
     @staticmethod
     def read_file(fname: str) -> str:
-        fpath = os.path.join(os.path.dirname(__file__), "csv_templates", fname)
-        with open(fpath, "r", encoding="utf8") as f:
-            contents = f.read()
-        return contents
+        return read_template(fname)
 
     @staticmethod
     def generate_metadata(
         time_series_results: QuerySet, request: WSGIRequest = None
     ) -> str:
-        metadata = ""
-
-        # Get the first TimeSeriesResult object and use it to get values for the
-        # "Site Information" block in the header of the CSV
-        tsr = time_series_results.first()
-        site_sensor = (
-            SiteSensor.objects.select_related("registration")
-            .filter(result_id=tsr.result.result_id)
-            .first()
+        return build_csv_metadata(time_series_results, request=request)
+
+
+def _bundle_member(build, *args) -> BundleMember | None:
+    try:
+        return build(*args)
+    finally:
+        # worker threads get their own Django connection, don't leave it open
+        db.connection.close()
+
+
+def _sensor_bundle_member(request, result_id: int, export_format) -> BundleMember:
+    time_series_result = CSVDataApi.get_time_series_results([result_id])
+    records = load_metadata_records(time_series_result)
+    if export_cache:
+        rows = export_cache.iter_data_rows(
+            _export_engine, [result_id], typed=export_format.typed
         )
-        site_info_template = CSVDataApi.read_file("site_information.txt")
-        site_info_template = site_info_template.format(site=site_sensor.registration)
-        metadata += site_info_template
+    else:
+        rows = iter_data_rows(_export_engine, [result_id], typed=export_format.typed)
+    chunks = export_format.write(
+        format_csv_metadata(records, request=request),
+        CSVDataApi.get_csv_headers(records.time_series_results),
+        rows,
+        records,
+    )
+    filename = CSVDataApi.get_csv_filename(time_series_result, result_id)
+    return spooled_member(
+        "sensors/{}.{}".format(filename, export_format.extension), chunks
+    )
+
+
+def _leafpack_bundle_member(sampling_feature_code: str, leafpack_id: int) -> BundleMember:
+    filename, content = get_leafpack_csv(sampling_feature_code, leafpack_id)
+    return spooled_member("leafpacks/{}".format(filename), [content])
+
+
+def _streamwatch_bundle_member(registration: SiteRegistration) -> BundleMember | None:
+    action_ids = samplingfeature_assessment_ids(registration.sampling_feature_id)
+    if not action_ids:
+        return None
+    filename, content = get_streamwatch_csv(
+        registration.sampling_feature_code, action_ids
+    )
+    return spooled_member("streamwatch/{}".format(filename), [content])
+
+
+class SiteBundleApi(APIView):
+    authentication_classes = ()
+    content_negotiation_class = DownloadFormatNegotiation
 
-        time_series_results_as_list = [tsr for tsr in time_series_results]
+    def get(self, request, sampling_feature_code: str, *args, **kwargs):
+        """
+        Downloads a zip of everything recorded at a site: one file per sensor (csv,
+        or the `format` of the csv-values api), and the leaf pack and StreamWatch csvs.
 
-        if len(time_series_results_as_list) == 1:
-            # If there is only one time series result, use the normal variable and method info template
-            variablemethodinfo_template = CSVDataApi.read_file(
-                "variable_and_method_template.txt"
+        The files are generated in parallel by the site bundle thread pool and the zip
+        is streamed as they are done, so it doesn't come in the order of the site page;
+        files that could not be generated are listed in errors.txt.
+                curl -X GET http://localhost:8000/api/site-bundle/<sampling_feature_code>/?format=parquet
+        """
+        registration = SiteRegistration.objects.filter(
+            sampling_feature_code=sampling_feature_code
+        ).first()
+        if registration is None:
+            return Response(
+                {"error": "Site {} not found.".format(sampling_feature_code)},
+                status=status.HTTP_404_NOT_FOUND,
             )
-            tsr = next(iter(time_series_results_as_list))
-            metadata += variablemethodinfo_template.format(
-                variable_code=tsr.result.variable,
-                r=tsr.result,
-                v=tsr.result.variable,
-                u=tsr.result.unit,
-                s=site_sensor,
+        export_format = CSVDataApi.extract_export_format(request)
+        if not export_format.available:
+            return Response(
+                {"message": "This download format is not supported by this server."},
+                status=status.HTTP_406_NOT_ACCEPTABLE,
             )
-        else:
-            # If there are more than one time series result, use the compact
-            # version of the variable and method info template.
 
-            # Write Variable and Method Information data
-            metadata += (
-                "# Variable and Method Information\n#---------------------------\n"
-            )
-            variablemethodinfo_template = CSVDataApi.read_file(
-                "variable_and_method_template_compact.txt"
+        result_ids = (
+            registration.sensors.filter(result_id__isnull=False)
+            .order_by("result_id")
+            .values_list("result_id", flat=True)
+        )
+        leafpack_ids = LeafPack.objects.filter(
+            site_registration=registration.pk
+        ).values_list("id", flat=True)
+        futures = {
+            site_bundle_executor.submit(
+                _bundle_member, _sensor_bundle_member, request, result_id, export_format
+            ): "sensor result {}".format(result_id)
+            for result_id in result_ids
+        }
+        futures.update(
+            {
+                site_bundle_executor.submit(
+                    _bundle_member,
+                    _leafpack_bundle_member,
+                    registration.sampling_feature_code,
+                    leafpack_id,
+                ): "leaf pack {}".format(leafpack_id)
+                for leafpack_id in leafpack_ids
+            }
+        )
+        futures[
+            site_bundle_executor.submit(
+                _bundle_member, _streamwatch_bundle_member, registration
             )
-            varcodes = [tsr.result.variable for tsr in time_series_results]
-            varcodes = CSVDataApi.clean_variable_codes(varcodes)
-            for i in range(0, len(time_series_results_as_list)):
-                # Yeah, so this is enumerating like this because of the need to append "-#"
-                # to variable codes when there are duplicate variable codes. This is so the
-                # column names can be distinguished easily.
-                tsr = time_series_results_as_list[i]
-
-                sensor = (
-                    SiteSensor.objects.select_related("registration")
-                    .filter(result_id=tsr.result.result_id)
-                    .first()
-                )
+        ] = "StreamWatch assessments"
+
+        response = StreamingHttpResponse(
+            stream_zip(futures), content_type="application/zip"
+        )
+        response["Content-Disposition"] = 'attachment; filename="%s_bundle.zip"' % (
+            registration.sampling_feature_code
+        )
+        return response
 
-                # Why use `varcodes[i]` instead of simply `tsr.result.variable`? Because
-                # there is a possibility of having duplicate variable codes, and
-                # `varcodes` is passed into `CSVDataApi.clean_variable_codes(*arg)`
-                # which does additional formatting to the variable code names.
-                metadata += variablemethodinfo_template.format(
-                    variable_code=varcodes[i],
-                    r=tsr.result,
-                    v=tsr.result.variable,
-                    u=tsr.result.unit,
-                    s=sensor,
-                )
 
-        metadata += "#\n"
-
-        if len(time_series_results) == 1:
-            # If there's only one timeseriesresult, add the variable and unit information block.
-            # When there are multiple timeseriesresults, this part of the CSV becomes cluttered
-            # and unreadable.
-            tsr = time_series_results.first()
-            metadata += CSVDataApi.read_file(
-                "variable_and_unit_information.txt"
-            ).format(
-                variable=tsr.result.variable, unit=tsr.result.unit, sensor=site_sensor
+def build_result_values(
+    payload: DataStreamPayload, result_uuids: Dict[str, int], unit_id: int
+) -> Tuple[pd.DataFrame, List["TimeseriesResultValueTechDebt"]]:
+    """
+    Builds the column buffer of values to insert for every result in the payload,
+    along with the values taken at the latest timestamp.
+    """
+    result_ids = []
+    data_columns = []
+    latest_values = []  # values for only the latest time
+    idx = payload.latest_measurement_idx
+    for key, values in payload.measurement_data.items():
+        try:
+            result_id = result_uuids[key]
+        except KeyError:
+            continue
+
+        result_ids.append(result_id)
+        data_columns.append(values)
+        latest_values.append(
+            TimeseriesResultValueTechDebt(
+                result_id=result_id,
+                data_value=values[idx],
+                value_datetime=payload.value_datetimes[idx].item(),
+                utc_offset=int(payload.utc_offsets[idx]),
+                censor_code="Not censored",
+                quality_code="None",
+                time_aggregation_interval=1,
+                time_aggregation_interval_unit=unit_id,
             )
+        )
 
-        # Write Source Information data
+    if data_columns and all(isinstance(c, np.ndarray) for c in data_columns):
+        data_values = np.concatenate(data_columns)  # float columns of a columnar body
+    else:
+        data_values = [value for values in data_columns for value in values]
+
+    result_values = result_values_columns(
+        np.repeat(result_ids, payload.num_measurements),
+        data_values,
+        np.tile(payload.value_datetimes, len(result_ids)),
+        np.tile(payload.utc_offsets, len(result_ids)),
+        unit_id,
+    )
+    return result_values, latest_values
 
-        # affiliation = tsr.result.feature_action.action.people.first()
-        # affiliation = site_sensor.registration.odm2_affiliation
-        organization = site_sensor.registration.organization
-        annotation = tsr.result.annotations.first()
-        citation = (
-            annotation.citation.title if annotation and annotation.citation else ""
-        )
 
-        if request:
-            source_link = request.build_absolute_uri(
-                reverse(
-                    "site_detail",
-                    kwargs={
-                        "sampling_feature_code": site_sensor.registration.sampling_feature_code
-                    },
-                )
-            )
-        else:
-            source_link = reverse(
-                "site_detail",
-                kwargs={
-                    "sampling_feature_code": site_sensor.registration.sampling_feature_code
-                },
+class ResultValueBatch:
+    """
+    Collects the values of several data-stream payloads so they can be written
+    with one COPY and one round of SensorMeasurement/result summary updates.
+    """
+
+    def __init__(self) -> None:
+        self.result_values = []
+        self.summaries = ResultSummaryDeltas()
+        self.deployment_dates = {}  # sampling_feature_id -> earliest measurement
+
+    def add(self, sampling_feature_id: int, result_values: pd.DataFrame) -> None:
+        if result_values.empty:
+            return
+        self.result_values.append(result_values)
+
+        latest_rows = result_values.loc[
+            result_values.groupby("result_id")["value_datetime"].idxmax()
+        ]
+        self.summaries.add_latest(
+            TimeseriesResultValueTechDebt(
+                result_id=row.result_id,
+                data_value=row.data_value,
+                value_datetime=row.value_datetime.to_pydatetime(),
+                utc_offset=row.utc_offset,
+                censor_code=row.censor_code,
+                quality_code=row.quality_code,
+                time_aggregation_interval=row.time_aggregation_interval,
+                time_aggregation_interval_unit=row.time_aggregation_interval_unit,
             )
+            for row in latest_rows.itertuples(index=False)
+        )
 
-        metadata += CSVDataApi.read_file("source_info_template.txt").format(
-            organization=organization, citation=citation, source_link=source_link
+        earliest = result_values["value_datetime"].min().to_pydatetime()
+        if (
+            sampling_feature_id not in self.deployment_dates
+            or earliest < self.deployment_dates[sampling_feature_id]
+        ):
+            self.deployment_dates[sampling_feature_id] = earliest
+
+    def add_spool_record(self, record: Dict) -> None:
+        result_ids, data_values, value_datetimes, utc_offsets = (
+            zip(*record["values"]) if record["values"] else ([], [], [], [])
+        )
+        self.add(
+            record["sampling_feature_id"],
+            result_values_columns(
+                result_ids,
+                data_values,
+                pd.to_datetime(list(value_datetimes)),
+                utc_offsets,
+                record["unit_id"],
+            ),
         )
 
-        return metadata
+    def write(self, connection, defer_summaries: bool = False) -> None:
+        """
+        Writes the values and their summary updates in the caller's transaction. With
+        `defer_summaries` the summaries go to the write-behind flush, if enabled.
+        """
+        # earliest measurement is the date of deployment
+        for sampling_feature_id, date_time in self.deployment_dates.items():
+            set_deployment_date(sampling_feature_id, date_time, connection)
+
+        if not self.result_values:
+            return
+        written = write_result_values(
+            pd.concat(self.result_values, ignore_index=True), connection
+        )
+        self.summaries.add_counts(written.inserted)
+        if defer_summaries:
+            write_result_summaries(self.summaries, connection)
+        else:
+            self.summaries.write(connection)
+
+
+def to_spool_record(
+    sampling_feature_id: int,
+    result_values: pd.DataFrame,
+    unit_id: int,
+) -> Dict:
+    """Serializes validated values for the write-behind spool, see `ResultValueBatch.add_spool_record`."""
+    return {
+        "sampling_feature_id": sampling_feature_id,
+        "unit_id": unit_id,
+        "values": list(
+            map(
+                list,
+                zip(
+                    result_values["result_id"].tolist(),
+                    result_values["data_value"].tolist(),
+                    result_values["value_datetime"]
+                    .dt.strftime("%Y-%m-%dT%H:%M:%S.%f")
+                    .tolist(),
+                    result_values["utc_offset"].tolist(),
+                ),
+            )
+        ),
+    }
 
 
-class TimeSeriesValuesApi(APIView):
+class TimeSeriesValuesApi(StageTimingMixin, APIView):
     authentication_classes = (UUIDAuthentication,)
+    throttle_classes = (RegistrationTokenThrottle,)
+    parser_classes = (
+        GzipJSONParser,
+        DataStreamMessagePackParser,
+        FormParser,
+        MultiPartParser,
+    )
 
     def post(self, request, format=None):
-        # list-ify all request data
-        measurement_data = {
-            k: v if isinstance(v, list) else [v] for k, v in request.data.items()
-        }
-        # remove non-UUID keys and process now, leaving measurement UUID keys for later
-        try:
-            sampling_feature = measurement_data.pop("sampling_feature")[0]
-            timestamps = measurement_data.pop("timestamp")
-        except (KeyError, IndexError):
-            raise exceptions.ParseError("Required data not found in request.")
-
-        # ensure each measurement has the same number of data points. there's
-        # one timestamp per point so we use that as the expected number.
-        num_measurements = len(timestamps)
-        if not all(len(m) == num_measurements for m in measurement_data.values()):
-            raise exceptions.ParseError("unequal number of data points")
-
-        if num_measurements == 0:
+        # replays of a post that was already accepted get its status without any DB work
+        replay_key = idempotency_key(request)
+        original_status = replay_cache.get(replay_key)
+        if original_status is not None:
+            request.timer.count("replays", 1)
+            return Response({}, original_status, headers={"Idempotent-Replayed": "true"})
+
+        response = self.write_values(request)
+        replay_cache.set(replay_key, response.status_code)
+        return response
+
+    def write_values(self, request) -> Response:
+        timer = request.timer
+        with timer.stage("timestamps"):
+            payload = parse_data_stream_payload(request.data)
+        if payload.num_measurements == 0:
             return Response({}, status.HTTP_201_CREATED)  # vacuous but correct
 
-        sampling_feature = SamplingFeature.objects.filter(
-            sampling_feature_uuid__exact=sampling_feature
-        ).first()
-        if not sampling_feature:
+        # already looked up (and cached) by UUIDAuthentication
+        registration = get_registration(request.META["HTTP_TOKEN"])
+        sampling_feature_id = registration["sampling_feature_id"]
+        if sampling_feature_id is None:
             raise exceptions.ParseError(
                 "Sampling Feature code does not match any existing site."
             )
 
-        unit_id = Unit.objects.get(unit_name="hour minute").unit_id
-
-        measurement_datetimes = []
-        latest_measurement_idx = None
-        latest_measurement_datetime = None  # does not include timezone!
-        for ti, timestamp in enumerate(timestamps):
-            try:
-                measurement_datetime = parse_datetime(timestamp)
-            except ValueError:
-                raise exceptions.ParseError("The timestamp value is not valid.")
-            if not measurement_datetime:
-                raise exceptions.ParseError(
-                    "The timestamp value is not well formatted."
+        unit_id = get_unit_id("hour minute")
+
+        if data_stream_spool is not None:
+            # write-behind mode, flush_data_stream_spool writes the values later. only
+            # a result uuid cache miss waits for the gate and a pooled connection
+            with timer.stage("result_uuids"):
+                result_uuids = get_result_UUIDs(sampling_feature_id)
+            result_values, _ = self.build_values(payload, result_uuids, unit_id, timer)
+            with timer.stage("spool"):
+                data_stream_spool.append(
+                    [to_spool_record(sampling_feature_id, result_values, unit_id)]
                 )
-            if measurement_datetime.utcoffset() is None:
-                raise exceptions.ParseError(
-                    "The timestamp value requires timezone information."
+            return Response({}, status.HTTP_202_ACCEPTED)
+
+        with ExitStack() as stack:
+            # waiting for a slot in the concurrency gate and for a pooled connection
+            with timer.stage("connect"):
+                stack.enter_context(data_stream_gate)
+                connection = stack.enter_context(_db_engine.begin())
+
+            with timer.stage("result_uuids"):
+                result_uuids = get_result_UUIDs(sampling_feature_id, connection)
+            result_values, latest_values = self.build_values(
+                payload, result_uuids, unit_id, timer
+            )
+
+            # earliest measurement is the date of deployment
+            with timer.stage("deployment_date"):
+                set_deployment_date(
+                    sampling_feature_id,
+                    payload.value_datetimes.min().item(),
+                    connection,
                 )
-            utc_offset = int(
-                measurement_datetime.utcoffset().total_seconds()
-                / timedelta(hours=1).total_seconds()
+
+            with timer.stage("insert"):
+                written = write_result_values(result_values, connection)
+            timer.count("inserted", written.inserted_count)
+            timer.count("duplicates", written.conflicting_count)
+
+            with timer.stage("summaries"):
+                summaries = ResultSummaryDeltas()
+                summaries.add_latest(latest_values)
+                summaries.add_counts(written.inserted)
+                write_result_summaries(summaries, connection)
+
+            with timer.stage("commit"):
+                stack.close()
+
+        return Response({}, status.HTTP_201_CREATED)
+
+    @staticmethod
+    def build_values(
+        payload: DataStreamPayload, result_uuids: Dict[str, int], unit_id: int, timer
+    ) -> Tuple[pd.DataFrame, List["TimeseriesResultValueTechDebt"]]:
+        if not result_uuids:
+            raise exceptions.ParseError(
+                f"No results_uuids matched to sampling_feature '{payload.sampling_feature}'"
+            )
+        with timer.stage("build"):
+            result_values, latest_values = build_result_values(
+                payload, result_uuids, unit_id
+            )
+        timer.count("rows", len(result_values))
+        return result_values, latest_values
+
+
+class TimeSeriesValuesBatchApi(APIView):
+    """
+    Accepts a list of data-stream envelopes, each shaped like a TimeSeriesValuesApi
+    body plus the registration token, and writes all of them in one transaction.
+
+    example request body:
+            [{"token": "...", "sampling_feature": "...", "timestamp": [...], "<result_uuid>": [...]}, ...]
+
+    Envelopes are authenticated, rate limited and validated independently; the response
+    holds one status per envelope, so a bad token, malformed envelope or token over its
+    rate only rejects that envelope. Throttled envelopes get a 429 status and the
+    response a Retry-After header, for the longest wait of them.
+    """
+
+    authentication_classes = ()
+
+    @staticmethod
+    def validate_envelope(
+        envelope, registrations: Dict[str, Dict]
+    ) -> Tuple[DataStreamPayload, int]:
+        if not isinstance(envelope, dict):
+            raise exceptions.ParseError("Envelope must be a JSON object.")
+        if "token" not in envelope:
+            raise exceptions.ParseError(
+                "Registration Token not present in the request."
             )
-            measurement_datetime = measurement_datetime.replace(
-                tzinfo=None
-            ) - timedelta(hours=utc_offset)
-            if (
-                latest_measurement_datetime is None
-                or measurement_datetime > latest_measurement_datetime
-            ):
-                latest_measurement_idx = ti
-                latest_measurement_datetime = measurement_datetime
-            measurement_datetimes.append((measurement_datetime, utc_offset))
-
-        with _db_engine.begin() as connection:
-            result_uuids = get_result_UUIDs(
-                sampling_feature.sampling_feature_id, connection
+        elif not isinstance(envelope["token"], str):
+            raise exceptions.ParseError("Registration Token must be a string.")
+        elif "sampling_feature" not in envelope:
+            raise exceptions.ParseError(
+                "Sampling feature UUID not present in the request."
             )
+
+        registration = registrations.get(envelope["token"])
+        verify_registration(registration, envelope["sampling_feature"])
+
+        data = {k: v for k, v in envelope.items() if k != "token"}
+        return parse_data_stream_payload(data), registration["sampling_feature_id"]
+
+    @staticmethod
+    def build_values(
+        accepted: List[Tuple[int, DataStreamPayload, int]],
+        site_result_uuids: Dict[int, Dict[str, int]],
+        unit_id: int,
+        statuses: List[Dict],
+    ) -> Iterator[Tuple[int, pd.DataFrame]]:
+        """Values of the accepted envelopes whose site has results, by sampling feature."""
+        for index, payload, sampling_feature_id in accepted:
+            result_uuids = site_result_uuids.get(sampling_feature_id)
             if not result_uuids:
-                raise exceptions.ParseError(
-                    f"No results_uuids matched to sampling_feature '{sampling_feature.sampling_feature_uuid}'"
+                statuses[index].update(
+                    status=status.HTTP_400_BAD_REQUEST,
+                    detail=f"No results_uuids matched to sampling_feature '{payload.sampling_feature}'",
+                )
+                continue
+            result_values, _ = build_result_values(payload, result_uuids, unit_id)
+            yield sampling_feature_id, result_values
+
+    def post(self, request, format=None):
+        envelopes = request.data
+        if not isinstance(envelopes, list):
+            raise exceptions.ParseError("Request body must be a list of envelopes.")
+
+        registrations = get_registrations(
+            {
+                e["token"]
+                for e in envelopes
+                if isinstance(e, dict) and isinstance(e.get("token"), str)
+            }
+        )
+
+        accepted_status = (
+            status.HTTP_201_CREATED
+            if data_stream_spool is None
+            else status.HTTP_202_ACCEPTED
+        )
+        statuses = [
+            {"index": i, "status": accepted_status} for i in range(len(envelopes))
+        ]
+        accepted = []  # (index, payload, sampling_feature_id)
+        retry_after = 0
+        for index, envelope in enumerate(envelopes):
+            try:
+                payload, sampling_feature_id = self.validate_envelope(
+                    envelope, registrations
                 )
+                # charged like the post of a single envelope would be
+                wait = RegistrationTokenThrottle.charge(envelope["token"])
+                if wait:
+                    raise exceptions.Throttled(wait)
+            except exceptions.Throttled as e:
+                statuses[index].update(status=e.status_code, detail=e.detail)
+                retry_after = max(retry_after, e.wait)
+                continue
+            except exceptions.APIException as e:
+                statuses[index].update(status=e.status_code, detail=e.detail)
+                continue
+            if payload.num_measurements:
+                accepted.append((index, payload, sampling_feature_id))
+
+        if accepted:
+            unit_id = get_unit_id("hour minute")
+            sampling_feature_ids = {
+                sampling_feature_id for _, _, sampling_feature_id in accepted
+            }
 
-            result_values = []  # values for all times
-            latest_values = []  # values for only the latest time
-            for key, values in measurement_data.items():
-                try:
-                    result_id = result_uuids[key]
-                except KeyError:
-                    continue
-
-                for vi, value in enumerate(values):
-                    result_values.append(
-                        TimeseriesResultValueTechDebt(
-                            result_id=result_id,
-                            data_value=value,
-                            value_datetime=measurement_datetimes[vi][0],
-                            utc_offset=measurement_datetimes[vi][1],
-                            censor_code="Not censored",
-                            quality_code="None",
-                            time_aggregation_interval=1,
-                            time_aggregation_interval_unit=unit_id,
+            if data_stream_spool is not None:
+                # only result uuid cache misses wait for the gate and a pooled connection
+                site_result_uuids = get_result_UUIDs_for_sampling_features(
+                    sampling_feature_ids
+                )
+                data_stream_spool.append(
+                    [
+                        to_spool_record(sampling_feature_id, result_values, unit_id)
+                        for sampling_feature_id, result_values in self.build_values(
+                            accepted, site_result_uuids, unit_id, statuses
                         )
+                    ]
+                )
+            else:
+                with data_stream_gate, _db_engine.begin() as connection:
+                    site_result_uuids = get_result_UUIDs_for_sampling_features(
+                        sampling_feature_ids, connection
                     )
-                    if vi == latest_measurement_idx:
-                        latest_values.append(result_values[-1])
+                    batch = ResultValueBatch()
+                    for sampling_feature_id, result_values in self.build_values(
+                        accepted, site_result_uuids, unit_id, statuses
+                    ):
+                        batch.add(sampling_feature_id, result_values)
+                    batch.write(connection, defer_summaries=True)
 
-            # earliest measurement is the date of deployment
-            set_deployment_date(
-                sampling_feature.sampling_feature_id,
-                min(v[0] for v in measurement_datetimes),
-                connection,
+        if all(s["status"] == accepted_status for s in statuses):
+            return Response(statuses, accepted_status)
+        headers = {"Retry-After": "%d" % retry_after} if retry_after else None
+        return Response(statuses, status.HTTP_207_MULTI_STATUS, headers=headers)
+
+
+class DataStreamCacheStatsApi(APIView):
+    """Hit/miss counters of the data-stream lookup caches in this worker process."""
+
+    authentication_classes = (SessionAuthentication,)
+
+    def get(self, request, format=None):
+        if not request.user.is_staff:
+            return Response(
+                {"error": "Not allowed to view cache statistics"},
+                status=status.HTTP_403_FORBIDDEN,
             )
+        return Response(get_cache_stats(), status.HTTP_200_OK)
 
-            insert_timeseries_result_values(result_values, connection)
-            update_sensormeasurements(latest_values, connection)
-            sync_result_table(latest_values, num_measurements, connection)
 
-        return Response({}, status.HTTP_201_CREATED)
+class DataStreamThrottleStatsApi(APIView):
+    """Rate-limited posts per site and posts shed by the concurrency gate in this worker process."""
+
+    authentication_classes = (SessionAuthentication,)
+
+    def get(self, request, format=None):
+        if not request.user.is_staff:
+            return Response(
+                {"error": "Not allowed to view throttle statistics"},
+                status=status.HTTP_403_FORBIDDEN,
+            )
+        return Response(get_throttle_stats(), status.HTTP_200_OK)
+
+
+class MetricsApi(APIView):
+    """Stage latency histograms and row/byte counters of the ingestion endpoints in this worker process."""
+
+    authentication_classes = (SessionAuthentication,)
+
+    def get(self, request, format=None):
+        if not request.user.is_staff:
+            return Response(
+                {"error": "Not allowed to view metrics"},
+                status=status.HTTP_403_FORBIDDEN,
+            )
+        return Response(metrics.snapshot(), status.HTTP_200_OK)
 
 
 def get_result_UUIDs(
-    sampling_feature_id: str, connection
+    sampling_feature_id: str, connection=None
 ) -> Union[Dict[str, str], None]:
-    try:
-        query = text(
-            "SELECT r.resultuuid, r.resultid FROM odm2.results AS r "
-            "JOIN odm2.featureactions AS fa ON r.featureactionid = fa.featureactionid "
-            "WHERE fa.samplingfeatureid = ':sampling_feature_id';"
-        )
-        result = connection.execute(query, sampling_feature_id=sampling_feature_id)
-        return {str(ruuid): rid for ruuid, rid in result}
-    except:
-        return None
+    """
+    Result ids by result uuid of a site; without a `connection`, a cache miss waits
+    for the data-stream gate and reads them on a pooled connection of its own.
+    """
+    result_uuids = result_uuid_cache.get(sampling_feature_id)
+    if result_uuids is not None:
+        return result_uuids
+    with ExitStack() as stack:
+        if connection is None:
+            stack.enter_context(data_stream_gate)
+            connection = stack.enter_context(_db_engine.connect())
+        try:
+            query = text(
+                "SELECT r.resultuuid, r.resultid FROM odm2.results AS r "
+                "JOIN odm2.featureactions AS fa ON r.featureactionid = fa.featureactionid "
+                "WHERE fa.samplingfeatureid = ':sampling_feature_id';"
+            )
+            result = connection.execute(query, sampling_feature_id=sampling_feature_id)
+            result_uuids = {str(ruuid): rid for ruuid, rid in result}
+        except:
+            return None
+    result_uuid_cache.set(sampling_feature_id, result_uuids)
+    return result_uuids
+
+
+def get_result_UUIDs_for_sampling_features(
+    sampling_feature_ids: Iterable[int], connection=None
+) -> Dict[int, Dict[str, int]]:
+    """Same as `get_result_UUIDs`, for several sampling features in one query."""
+    result_uuids = {}
+    missing = []
+    for sampling_feature_id in sampling_feature_ids:
+        cached = result_uuid_cache.get(sampling_feature_id)
+        if cached is not None:
+            result_uuids[sampling_feature_id] = cached
+        else:
+            missing.append(sampling_feature_id)
+    if not missing:
+        return result_uuids
+
+    query = text(
+        "SELECT fa.samplingfeatureid, r.resultuuid, r.resultid FROM odm2.results AS r "
+        "JOIN odm2.featureactions AS fa ON r.featureactionid = fa.featureactionid "
+        "WHERE fa.samplingfeatureid = ANY(:sampling_feature_ids);"
+    )
+    fetched = {sampling_feature_id: {} for sampling_feature_id in missing}
+    with ExitStack() as stack:
+        if connection is None:
+            stack.enter_context(data_stream_gate)
+            connection = stack.enter_context(_db_engine.connect())
+        for sfid, ruuid, rid in connection.execute(
+            query, sampling_feature_ids=missing
+        ):
+            fetched[sfid][str(ruuid)] = rid
+    for sampling_feature_id, uuids in fetched.items():
+        result_uuid_cache.set(sampling_feature_id, uuids)
+    result_uuids.update(fetched)
+    return result_uuids
+
+
+def get_unit_id(unit_name: str) -> int:
+    unit_id = unit_cache.get(unit_name)
+    if unit_id is None:
+        unit_id = Unit.objects.get(unit_name=unit_name).unit_id
+        unit_cache.set(unit_name, unit_id)
+    return unit_id
 
 
 class TimeseriesResultValueTechDebt:
@@ -931,32 +1706,12 @@ class TimeseriesResultValueTechDebt:
         self.time_aggregation_interval_unit = time_aggregation_interval_unit
 
 
-# dataloader utility function
-def update_sensormeasurements(
-    result_values: TimeseriesResultValueTechDebt, connection
-) -> None:
-    query = text(
-        "INSERT INTO public.dataloaderinterface_sensormeasurement as m "
-        "VALUES ((select id from public.dataloaderinterface_sitesensor "
-        'where "ResultID" = :result_id limit 1), :datetime, :utc_offset, :data_value) '
-        "on conflict (sensor_id) do update set "
-        "value_datetime = excluded.value_datetime, "
-        "value_datetime_utc_offset = excluded.value_datetime_utc_offset, "
-        "data_value = excluded.data_value "
-        "where m.value_datetime < excluded.value_datetime;"
-    )
-    result = connection.execute(
-        query,
-        [
-            {
-                "result_id": result_value.result_id,
-                "datetime": result_value.value_datetime,
-                "utc_offset": timedelta(hours=result_value.utc_offset),
-                "data_value": result_value.data_value,
-            }
-            for result_value in result_values
-        ],
-    )
+def write_result_summaries(summaries: ResultSummaryDeltas, connection) -> None:
+    """Applies the summary deltas now, or hands them to the write-behind flush if enabled."""
+    if result_summary_write_behind is not None:
+        result_summary_write_behind.add(summaries)
+    else:
+        summaries.write(connection)
 
 
 # dataloader utility function
@@ -975,92 +1730,6 @@ def set_deployment_date(
     return None
 
 
-def sync_result_table(
-    result_values: TimeseriesResultValueTechDebt, num_measurements, connection
-) -> None:
-    query = text(
-        "UPDATE odm2.results SET valuecount = valuecount + :num_measurements, "
-        "resultdatetime = GREATEST(:result_datetime, resultdatetime)"
-        "WHERE resultid=:result_id; "
-    )
-    result = connection.execute(
-        query,
-        [
-            {
-                "result_id": result_value.result_id,
-                "result_datetime": result_value.value_datetime,
-                "num_measurements": num_measurements,
-            }
-            for result_value in result_values
-        ],
-    )
-    return result
-
-
-def insert_timeseries_result_values(
-    result_values: TimeseriesResultValueTechDebt, connection=None
-) -> None:
-    try:
-        query = text(
-            "INSERT INTO odm2.timeseriesresultvalues "
-            "(resultid, datavalue, valuedatetime, valuedatetimeutcoffset, "
-            "censorcodecv, qualitycodecv, timeaggregationinterval, timeaggregationintervalunitsid) "
-            "VALUES ( "
-            ":result_id, "
-            ":data_value, "
-            ":value_datetime, "
-            ":utc_offset, "
-            ":censor_code, "
-            ":quality_code, "
-            ":time_aggregation_interval, "
-            ":time_aggregation_interval_unit) on conflict do nothing;"
-        )
-        result = connection.execute(query, [vars(v) for v in result_values])
-        return None
-    except sqlalchemy.exc.SQLAlchemyError as e:
-        return f"Failed to INSERT data"
-
-
-def insert_timeseries_result_values_bulk(result_values, connection):
-    connection.execute(
-        text(
-            "create temporary table upload "
-            "(resultid bigint  NOT NULL,"
-            "datavalue double precision  NOT NULL,"
-            "valuedatetime timestamp  NOT NULL,"
-            "valuedatetimeutcoffset integer  NOT NULL,"
-            "censorcodecv varchar (255) NOT NULL,"
-            "qualitycodecv varchar (255) NOT NULL,"
-            "timeaggregationinterval double precision  NOT NULL,"
-            "timeaggregationintervalunitsid integer  NOT NULL) on commit drop;"
-        )
-    )
-
-    result_data = StringIO()
-    for rv in result_values:
-        result_data.write(
-            f"{rv.result_id}\t{rv.data_value}\t"
-            f"{rv.value_datetime}\t{rv.utc_offset}\t{rv.censor_code}\t"
-            f"{rv.quality_code}\t{rv.time_aggregation_interval}\t"
-            f"{rv.time_aggregation_interval_unit}\n"
-        )
-    result_data.seek(0)
-
-    cursor = connection.connection.cursor()
-    cursor.copy_from(result_data, "upload")
-    cursor.close()
-
-    connection.execute(
-        text(
-            "insert into odm2.timeseriesresultvalues "
-            "(resultid, datavalue, valuedatetime, valuedatetimeutcoffset, "
-            "censorcodecv, qualitycodecv, timeaggregationinterval, "
-            "timeaggregationintervalunitsid) "
-            "(select * from upload) on conflict do nothing;"
-        )
-    )
-
-
 class Organizations(APIView):
     def get(self, request: HttpRequest) -> Response:
         query = sqlalchemy.text(
@@ -0,0 +1,256 @@
+"""
+Writer for odm2.timeseriesresultvalues shared by the data-stream and file upload paths.
+
+Small batches go out as a single multi-row INSERT; anything above
+`RESULT_VALUES_COPY_THRESHOLD` rows is COPY'd into a temporary table and merged
+from there. Either way rows that already exist are skipped, and the writer reports
+how many rows each result actually gained so `results.valuecount` stays accurate
+when loggers resend data.
+
+`write_partitioned` splits a large batch by result and writes the parts at the same
+time, each on its own connection and in its own transaction, for the file uploads.
+"""
+from collections import Counter
+from concurrent.futures import Executor
+from datetime import datetime
+from io import StringIO
+from typing import Any, Callable, Dict, Iterable, List, Tuple, Union
+
+import numpy as np
+import pandas as pd
+from django.conf import settings
+from psycopg2.extras import execute_values
+from sqlalchemy.sql import text
+
+# column order of odm2.timeseriesresultvalues (minus valueid), named like the
+# TimeseriesResultValueTechDebt attributes
+RESULT_VALUE_COLUMNS = [
+    "result_id",
+    "data_value",
+    "value_datetime",
+    "utc_offset",
+    "censor_code",
+    "quality_code",
+    "time_aggregation_interval",
+    "time_aggregation_interval_unit",
+]
+
+COPY_THRESHOLD = getattr(settings, "RESULT_VALUES_COPY_THRESHOLD", 1000)
+
+_INSERT_INTO = (
+    "INSERT INTO odm2.timeseriesresultvalues "
+    "(resultid, datavalue, valuedatetime, valuedatetimeutcoffset, "
+    "censorcodecv, qualitycodecv, timeaggregationinterval, "
+    "timeaggregationintervalunitsid) "
+)
+
+
+def result_values_columns(
+    result_ids: Iterable[int],
+    data_values: Iterable,
+    value_datetimes: Iterable[datetime],
+    utc_offsets: Iterable[int],
+    unit_id: int,
+) -> pd.DataFrame:
+    """Column buffer of raw (uncensored, unaggregated) result values for the writers."""
+    return pd.DataFrame(
+        {
+            "result_id": np.asarray(result_ids, dtype=np.int64),
+            # float arrays stay float; anything else is kept as given, so the
+            # database rejects bad values the same as before
+            "data_value": data_values
+            if isinstance(data_values, np.ndarray) and data_values.dtype.kind == "f"
+            else pd.Series(list(data_values), dtype=object),
+            "value_datetime": pd.Series(value_datetimes, dtype="datetime64[ns]"),
+            "utc_offset": np.asarray(utc_offsets, dtype=np.int64),
+            "censor_code": "Not censored",
+            "quality_code": "None",
+            "time_aggregation_interval": 1,
+            "time_aggregation_interval_unit": unit_id,
+        },
+        columns=RESULT_VALUE_COLUMNS,
+    )
+
+
+def result_values_frame(result_values: Union[pd.DataFrame, Iterable[Any]]) -> pd.DataFrame:
+    """Column buffer from a frame, or from TimeseriesResultValueTechDebt-like objects."""
+    if isinstance(result_values, pd.DataFrame):
+        return result_values
+    return pd.DataFrame(
+        [vars(v) for v in result_values], columns=RESULT_VALUE_COLUMNS
+    )
+
+
+class WriteResult:
+    """Rows written by `write_result_values`; `inserted` maps result_id to new rows."""
+
+    def __init__(self, total: int = 0, inserted: Dict[int, int] = None) -> None:
+        self.total = total
+        self.inserted = inserted or {}
+
+    @property
+    def inserted_count(self) -> int:
+        return sum(self.inserted.values())
+
+    @property
+    def conflicting_count(self) -> int:
+        return self.total - self.inserted_count
+
+    def __add__(self, other: "WriteResult") -> "WriteResult":
+        inserted = Counter(self.inserted)
+        inserted.update(other.inserted)
+        return WriteResult(self.total + other.total, dict(inserted))
+
+
+def write_result_values(
+    result_values: pd.DataFrame, connection, copy_threshold: int = None
+) -> WriteResult:
+    """
+    Inserts a frame of RESULT_VALUE_COLUMNS, skipping rows that conflict with
+    existing values. Runs inside the caller's transaction.
+    """
+    if copy_threshold is None:
+        copy_threshold = COPY_THRESHOLD
+    if result_values.empty:
+        return WriteResult()
+
+    if len(result_values) > copy_threshold:
+        inserted = _copy_result_values(result_values, connection)
+    else:
+        inserted = _insert_result_values(result_values, connection)
+    return WriteResult(len(result_values), inserted)
+
+
+def _insert_result_values(result_values: pd.DataFrame, connection) -> Dict[int, int]:
+    cursor = connection.connection.cursor()
+    try:
+        rows = execute_values(
+            cursor,
+            _INSERT_INTO + "VALUES %s ON CONFLICT DO NOTHING RETURNING resultid",
+            result_values[RESULT_VALUE_COLUMNS].itertuples(index=False, name=None),
+            page_size=len(result_values),
+            fetch=True,
+        )
+    finally:
+        cursor.close()
+    return dict(Counter(result_id for result_id, in rows))
+
+
+def _copy_result_values(result_values: pd.DataFrame, connection) -> Dict[int, int]:
+    connection.execute(
+        text(
+            "create temporary table upload "
+            "(resultid bigint  NOT NULL,"
+            "datavalue double precision  NOT NULL,"
+            "valuedatetime timestamp  NOT NULL,"
+            "valuedatetimeutcoffset integer  NOT NULL,"
+            "censorcodecv varchar (255) NOT NULL,"
+            "qualitycodecv varchar (255) NOT NULL,"
+            "timeaggregationinterval double precision  NOT NULL,"
+            "timeaggregationintervalunitsid integer  NOT NULL) on commit drop;"
+        )
+    )
+
+    result_data = StringIO()
+    result_values.to_csv(
+        result_data, sep="\t", header=False, index=False, columns=RESULT_VALUE_COLUMNS
+    )
+    result_data.seek(0)
+
+    cursor = connection.connection.cursor()
+    try:
+        cursor.copy_from(result_data, "upload")
+    finally:
+        cursor.close()
+
+    rows = connection.execute(
+        text(
+            "WITH inserted AS ("
+            + _INSERT_INTO
+            + "(SELECT * FROM upload) ON CONFLICT DO NOTHING RETURNING resultid) "
+            "SELECT resultid, count(*) FROM inserted GROUP BY resultid;"
+        )
+    )
+    inserted = {result_id: count for result_id, count in rows}
+    # dropped now rather than on commit, so one transaction can write several chunks
+    connection.execute(text("drop table upload;"))
+    return inserted
+
+
+class PartitionWriteError(Exception):
+    """
+    Writes of some partitions of `write_partitioned` failed; `errors` holds
+    (result ids, exception) pairs in partition order, whatever order they failed in.
+    """
+
+    def __init__(self, errors: List[Tuple[List[int], Exception]]) -> None:
+        super().__init__(
+            "; ".join(
+                "results {}: {}".format(", ".join(map(str, result_ids)), error)
+                for result_ids, error in errors
+            )
+        )
+        self.errors = errors
+
+
+def partition_by_result(
+    result_values: pd.DataFrame, partitions: int
+) -> List[pd.DataFrame]:
+    """
+    Splits a frame into at most `partitions` frames of whole results with about the
+    same number of rows, ordered by their lowest result id.
+    """
+    row_counts = result_values["result_id"].value_counts()
+    if partitions <= 1 or len(row_counts) <= 1:
+        return [result_values]
+
+    # largest results first, each to the partition with the fewest rows so far
+    assigned = [[] for _ in range(min(partitions, len(row_counts)))]
+    loads = [0] * len(assigned)
+    for result_id, rows in row_counts.sort_values(ascending=False, kind="stable").items():
+        lightest = loads.index(min(loads))
+        assigned[lightest].append(result_id)
+        loads[lightest] += rows
+
+    assigned = sorted(
+        (sorted(result_ids) for result_ids in assigned), key=lambda ids: ids[0]
+    )
+    return [
+        result_values[result_values["result_id"].isin(result_ids)]
+        for result_ids in assigned
+    ]
+
+
+def write_partitioned(
+    result_values: pd.DataFrame,
+    engine,
+    executor: Union[Executor, None],
+    partitions: int,
+    write: Callable[[pd.DataFrame, Any], WriteResult] = write_result_values,
+) -> WriteResult:
+    """
+    Writes `result_values` with `write(frame, connection)`, split by result into up
+    to `partitions` parts run on `executor`. Each part commits on its own, so parts
+    that succeeded stay written when another fails; writes skip existing rows, so
+    the whole batch can simply be written again.
+    """
+    frames = partition_by_result(result_values, partitions if executor else 1)
+    if len(frames) == 1:
+        with engine.begin() as connection:
+            return write(frames[0], connection)
+
+    def write_partition(frame: pd.DataFrame) -> WriteResult:
+        with engine.begin() as connection:
+            return write(frame, connection)
+
+    futures = [executor.submit(write_partition, frame) for frame in frames]
+    written = WriteResult()
+    errors = []
+    for frame, future in zip(frames, futures):
+        try:
+            written += future.result()
+        except Exception as e:
+            errors.append((sorted(frame["result_id"].unique().tolist()), e))
+    if errors:
+        raise PartitionWriteError(errors)
+    return written
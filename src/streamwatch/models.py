@@ -49,22 +49,39 @@ def sampling_feature_code_to_id(code: str) -> Union[int, None]:
     return None
 
 
+def _assessments_query(sampling_feature_id: int, *columns) -> sqlalchemy.sql.Select:
+    """Selects `columns` of the featureactions joined to the StreamWatch actions of a sampling feature"""
+    return (
+        sqlalchemy.select(*columns)
+        .select_from(odm2_models.FeatureActions)
+        .join(
+            odm2_models.Actions,
+            odm2_models.FeatureActions.actionid == odm2_models.Actions.actionid,
+        )
+        .where(odm2_models.FeatureActions.samplingfeatureid == sampling_feature_id)
+        .where(odm2_models.Actions.methodid == STREAMWATCH_METHOD_ID)
+    )
+
+
+def samplingfeature_assessment_ids(sampling_feature_id: int) -> List[int]:
+    """Get the action ids of the StreamWatch assessments of a sampling feature, oldest first"""
+    query = _assessments_query(
+        sampling_feature_id, odm2_models.FeatureActions.actionid
+    ).order_by(odm2_models.Actions.begindatetime)
+    results = odm2_engine.read_query(query, output_format="dict")
+    return [result["actionid"] for result in results]
+
+
 def samplingfeature_assessments(sampling_feature_code: str) -> Dict[str, Any]:
     """Get a joined list joined the featureactions and actions based on sampling_feature_code"""
     sampling_feature_id = sampling_feature_code_to_id(sampling_feature_code)
     if sampling_feature_id is None:
         return {}
 
-    query = (
-        sqlalchemy.select(odm2_models.FeatureActions, odm2_models.Actions)
-        .join(
-            odm2_models.Actions,
-            odm2_models.FeatureActions.actionid == odm2_models.Actions.actionid,
-        )
-        .where(odm2_models.FeatureActions.samplingfeatureid == sampling_feature_id)
-        .where(odm2_models.Actions.methodid == 1)
-        # .order_by(odm2_models.Actions.begindatetime)
+    query = _assessments_query(
+        sampling_feature_id, odm2_models.FeatureActions, odm2_models.Actions
     )
+    # .order_by(odm2_models.Actions.begindatetime)
     results = odm2_engine.read_query(query, output_format="dict")
 
     # acquire additional data
@@ -1,7 +1,8 @@
 import csv
+import io
 import os
 import datetime
-from typing import List, TextIO, Dict, Any
+from typing import List, TextIO, Dict, Any, Iterable, Tuple, Union
 
 import django
 from django.core.files.storage import FileSystemStorage
@@ -268,12 +269,24 @@ class StreamWatchCreateMeasurementView(django.views.generic.edit.FormView):
 
 def csv_export(request, sampling_feature_code: str, actionids: str):
     """
-    Download handler that uses csv_writer.py to parse out a StreamWatch assessment into a csv file.
+    Download handler that uses get_streamwatch_csv to write StreamWatch assessments into a csv file.
 
     :param request: the request object
     :param sampling_feature_code: the first URL parameter
-    :param pk: the second URL parameter and id of the leafpack experiement to download
+    :param actionids: the second URL parameter, comma separated action ids of the assessments to download
     """
+    filename, content = get_streamwatch_csv(sampling_feature_code, actionids.split(","))
+
+    response = HttpResponse(content, content_type="text/csv")
+    response["Content-Disposition"] = f'attachment; filename="{filename}"'
+
+    return response
+
+
+def get_streamwatch_csv(
+    sampling_feature_code: str, action_ids: Iterable[Union[int, str]]
+) -> Tuple[str, str]:
+    """The file name and csv content of the site's StreamWatch assessments with the given action ids"""
 
     def format_metadata(site: SiteRegistration) -> List[List[str]]:
         result = [
@@ -396,18 +409,17 @@ def csv_export(request, sampling_feature_code: str, actionids: str):
 
     site = SiteRegistration.objects.get(sampling_feature_code=sampling_feature_code)
     assessments = [
-        models.StreamWatchODM2Adapter.from_action_id(a) for a in actionids.split(",")
+        models.StreamWatchODM2Adapter.from_action_id(a) for a in action_ids
     ]
 
     filename = f'streamwatchdata_{sampling_feature_code}_{datetime.datetime.now().strftime("%Y-%m-%d")}.csv'
-    response = HttpResponse(content_type="text/csv")
-    response["Content-Disposition"] = f'attachment; filename="{filename}"'
+    content = io.StringIO()
 
-    writer = csv.writer(response)
+    writer = csv.writer(content)
     writer.writerows(format_metadata(site))
     writer.writerow(format_header())
 
     for assessment in assessments:
         writer.writerow(format_assessment(assessment.to_dict(True)))
 
-    return response
+    return filename, content.getvalue()